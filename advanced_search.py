@@ -1,399 +1,3808 @@
 import asyncio
+import base64
 import os
 import random
 import logging
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urljoin, parse_qs, urlencode
 import re
 from pathlib import Path
 from io import BytesIO
+import hashlib
+import json
+import time
+import zlib
+import contextlib
+import email.utils
+import shutil
+import sqlite3
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-import gradio as gr
 import sys
 
+import aiohttp
+from yarl import URL
+
 # Playwright & Parsers
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from PyPDF2 import PdfReader
+try:
+    from lxml import html as lxml_html
+except ImportError:  # BeautifulSoup's html.parser is used instead
+    lxml_html = None
+
+# ------------------------------------------------------------------------------
+# If packaging with PyInstaller or similar:
+if getattr(sys, 'frozen', False):
+    bundle_dir = sys._MEIPASS
+else:
+    bundle_dir = os.path.dirname(os.path.abspath(__file__))
+
+# ------------------------------------------------------------------------------
+# Logging Setup
+logging.basicConfig(
+    filename='advanced_download_log.txt',
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger()
+
+# ------------------------------------------------------------------------------
+# Metrics
+# In-process counters, latency histograms and gauges for every stage of
+# search, analysis and download. Rendered in the Prometheus text format by
+# start_metrics_server() and summarized in the UI's Metrics panel.
+METRICS_NAMESPACE = "advanced_search"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+METRIC_HELP = {
+    "stage_seconds": ("histogram", "Time spent in one stage of search, analysis or download."),
+    "stage_total": ("counter", "Stage runs by outcome (ok or error)."),
+    "downloads_total": ("counter", "Files handled by download_file, by outcome."),
+    "bytes_downloaded_total": ("counter", "Response body bytes received from each host."),
+    "transfer_seconds_total": ("counter", "Time spent receiving bodies from each host."),
+    "host_throughput_bytes_per_second": ("gauge", "Bytes per second of transfer time, per host."),
+    "browser_pool_browsers": ("gauge", "Chromium processes open in the browser pool."),
+    "browser_pool_contexts": ("gauge", "Browser contexts currently leased."),
+    "browser_pool_waiting": ("gauge", "Callers waiting for a browser context."),
+    "browser_pool_max_contexts": ("gauge", "Context cap of the browser pool."),
+}
+
+class Histogram:
+    """Fixed-bucket histogram (bucket counts are not cumulative here)."""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last slot: above every bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (inf past the last)."""
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+            seen += n
+            if seen >= rank and seen:
+                return bound
+        return float('inf')
+
+def _metric_value(value):
+    # Integers in full: "%g" would round large byte counters.
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+class Metrics:
+    """
+    Process-wide metric registry. Counters and histograms are keyed by name
+    and a sorted tuple of label pairs; gauges are read from callbacks when
+    rendered. Safe to update from several threads (Gradio runs handlers on
+    its own loop threads).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}     # (name, labels) -> number
+        self.histograms = {}   # (name, labels) -> Histogram
+        self._gauges = []      # callables returning [(name, labels dict, value)]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        """Time the enclosed block as `stage` and count its outcome."""
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            self.observe("stage_seconds", time.monotonic() - started, stage=stage)
+            self.inc("stage_total", stage=stage, outcome=outcome)
+
+    def add_transfer(self, url, nbytes, seconds):
+        host = urlparse(url).hostname or "unknown"
+        self.inc("bytes_downloaded_total", nbytes, host=host)
+        self.inc("transfer_seconds_total", seconds, host=host)
+
+    def register_gauges(self, callback):
+        self._gauges.append(callback)
+
+    def counter(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def samples(self):
+        """(counters, histograms, gauges) copies taken under the lock."""
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {k: (h.buckets, list(h.counts), h.sum, h.count)
+                          for k, h in self.histograms.items()}
+        gauges = []
+        for callback in self._gauges:
+            try:
+                gauges.extend(callback())
+            except Exception as e:
+                logger.error(f"Metrics gauge callback failed: {e}")
+        return counters, histograms, gauges
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        counters, histograms, gauges = self.samples()
+        series = {}
+        for (name, labels), value in counters.items():
+            series.setdefault(name, []).append(
+                f"{METRICS_NAMESPACE}_{name}{_label_str(labels)} {_metric_value(value)}"
+            )
+        for (name, labels), (buckets, counts, total, count) in histograms.items():
+            lines = series.setdefault(name, [])
+            cumulative = 0
+            for bound, n in zip(buckets + (float('inf'),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float('inf') else f"{bound:g}"
+                lines.append(f"{METRICS_NAMESPACE}_{name}_bucket"
+                             f"{_label_str(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{METRICS_NAMESPACE}_{name}_sum{_label_str(labels)} {_metric_value(total)}")
+            lines.append(f"{METRICS_NAMESPACE}_{name}_count{_label_str(labels)} {count}")
+        for name, labels, value in gauges:
+            series.setdefault(name, []).append(
+                f"{METRICS_NAMESPACE}_{name}{_label_str(tuple(sorted(labels.items())))} "
+                f"{_metric_value(value)}"
+            )
+        out = []
+        for name in sorted(series):
+            kind, text = METRIC_HELP.get(name, ("untyped", name))
+            out.append(f"# HELP {METRICS_NAMESPACE}_{name} {text}")
+            out.append(f"# TYPE {METRICS_NAMESPACE}_{name} {kind}")
+            out.extend(series[name])
+        return "\n".join(out) + "\n"
+
+METRICS = Metrics()
+
+def _throughput_gauges():
+    counters = METRICS.counters
+    out = []
+    for (name, labels), nbytes in list(counters.items()):
+        if name != "bytes_downloaded_total":
+            continue
+        seconds = counters.get(("transfer_seconds_total", labels), 0)
+        if seconds > 0:
+            out.append(("host_throughput_bytes_per_second", dict(labels), nbytes / seconds))
+    return out
+
+METRICS.register_gauges(_throughput_gauges)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = METRICS.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """
+    Serve METRICS at http://host:port/metrics from a daemon thread, so it
+    works whichever event loop (Gradio's, a worker's) the app runs on.
+    Returns the server (call shutdown() to stop it).
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Metrics served at http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+def format_metrics_summary():
+    """Markdown tables of the stage timings, per-host transfers and pool gauges."""
+    counters, histograms, gauges = METRICS.samples()
+    lines = ["| Stage | Runs | Errors | Mean | p50 | p95 |", "|---|---|---|---|---|---|"]
+    stages = sorted((dict(labels)['stage'], (name, labels))
+                    for name, labels in histograms if name == "stage_seconds")
+    for stage, key in stages:
+        buckets, counts, total, count = histograms[key]
+        hist = Histogram(buckets)
+        hist.counts, hist.sum, hist.count = counts, total, count
+        errors = counters.get(("stage_total", (("outcome", "error"), ("stage", stage))), 0)
+        lines.append(f"| {stage} | {count} | {errors:g} | {total / count:.3f}s "
+                     f"| ≤{hist.quantile(0.5):g}s | ≤{hist.quantile(0.95):g}s |")
+    if not stages:
+        lines.append("| (nothing measured yet) | | | | | |")
+    lines += ["", "| Host | Downloaded | Throughput |", "|---|---|---|"]
+    throughput = {labels['host']: value for name, labels, value in gauges
+                  if name == "host_throughput_bytes_per_second"}
+    for (name, labels), nbytes in sorted(counters.items()):
+        if name == "bytes_downloaded_total":
+            host = dict(labels)['host']
+            rate = throughput.get(host)
+            lines.append(f"| {host} | {sizeof_fmt(nbytes)} | "
+                         f"{sizeof_fmt(rate) + '/s' if rate else '-'} |")
+    pool = {name: value for name, labels, value in gauges if name.startswith("browser_pool_")}
+    if pool:
+        lines += ["", "Browser pool: " + ", ".join(
+            f"{name[len('browser_pool_'):]} {value:g}" for name, value in sorted(pool.items()))]
+    return "\n".join(lines)
+
+# ------------------------------------------------------------------------------
+# User-Agent Rotations
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/115.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 12_6_3) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+    'Version/16.4 Safari/605.1.15',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/115.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:115.0) Gecko/20100101 Firefox/115.0',
+]
+
+def get_random_user_agent():
+    return random.choice(USER_AGENTS)
+
+def sizeof_fmt(num, suffix='B'):
+    """Convert a file size to a human-readable string."""
+    for unit in ['', 'K', 'M', 'G', 'T', 'P', 'E', 'Z']:
+        if abs(num) < 1024.0:
+            return f"{num:3.1f}{unit}{suffix}"
+        num /= 1024.0
+    return f"{num:.1f}Y{suffix}"
+
+# Known MIME types we might want to treat as downloadable files:
+KNOWN_MIME_TYPES = {
+    "application/pdf": ".pdf",
+    "application/zip": ".zip",
+    "application/x-rar-compressed": ".rar",
+    "application/x-7z-compressed": ".7z",
+    "application/msword": ".doc",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
+    "audio/mpeg": ".mp3",
+    "video/mp4": ".mp4",
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/gif": ".gif",
+    # add more if you wish
+}
+
+# ------------------------------------------------------------------------------
+# Playwright Helper Functions
+async def human_like_scroll(page):
+    scroll_height = await page.evaluate('document.body.scrollHeight')
+    viewport_height = await page.evaluate('window.innerHeight')
+    current_scroll = 0
+    while current_scroll < scroll_height:
+        await page.evaluate(f'window.scrollTo(0, {current_scroll})')
+        await asyncio.sleep(random.uniform(0.5, 1.5))
+        current_scroll += viewport_height * random.uniform(0.5, 1.5)
+        scroll_height = await page.evaluate('document.body.scrollHeight')
+
+async def human_like_interactions(page):
+    await page.mouse.move(random.randint(0, 1000), random.randint(0, 1000))
+    await asyncio.sleep(random.uniform(0.5, 1.5))
+    await page.mouse.click(random.randint(0, 1000), random.randint(0, 1000))
+    await asyncio.sleep(random.uniform(0.5, 1.5))
+    await page.evaluate("window.scrollBy(0, window.innerHeight / 2)")
+    await asyncio.sleep(random.uniform(0.5, 1.5))
+
+async def quick_scroll(page):
+    """One jump to the bottom so lazy-loaded links render; no pauses."""
+    await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+
+async def page_interactions(page, humanize=True):
+    if humanize:
+        await human_like_interactions(page)
+    else:
+        await quick_scroll(page)
+
+# ------------------------------------------------------------------------------
+# Politeness: per-host rate limits and behavior profiles
+# Request pacing is decided by token buckets (one per host plus a global
+# one) instead of fixed random sleeps, so the cost scales with how polite we
+# need to be to each host rather than with the number of requests. A
+# behavior profile picks the limits and whether pages get human-like
+# interactions.
+BEHAVIOR_PROFILES = {
+    # Human-like page interactions and gentle per-host pacing.
+    "stealth": {"humanize": True, "host_rate": 4.0, "host_burst": 8,
+                "global_rate": 32.0, "global_burst": 32},
+    # No interactions beyond one scroll; limits only guard against hammering.
+    "throughput": {"humanize": False, "host_rate": 20.0, "host_burst": 40,
+                   "global_rate": 200.0, "global_burst": 200},
+}
+DEFAULT_PROFILE = "stealth"
+MAX_RETRY_AFTER = 300  # seconds; longer server requests are capped
+RETRY_STATUSES = (429, 503)
+
+def parse_retry_after(value, default=None):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return default
+    value = value.strip()
+    if value.isdigit():
+        return min(int(value), MAX_RETRY_AFTER)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return default
+    if when is None:
+        return default
+    return min(max(0.0, when.timestamp() - time.time()), MAX_RETRY_AFTER)
+
+class TokenBucket:
+    """
+    `rate` tokens per second, holding at most `burst`. Callers reserve a
+    token and are told how long to wait for it, so waiters are served in
+    arrival order without polling.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self):
+        """Take one token; returns the seconds to wait before using it."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return wait + max(0.0, self.paused_until - now)
+
+    def pause(self, seconds):
+        """Hold back every request for `seconds` (e.g. a Retry-After)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+class RateLimiter:
+    """Per-host token buckets under an optional global bucket."""
+
+    def __init__(self, host_rate, host_burst, global_rate=None, global_burst=None):
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst or global_rate) if global_rate else None
+        self._hosts = {}
+        self.waited = 0.0
+
+    @classmethod
+    def for_profile(cls, name):
+        p = BEHAVIOR_PROFILES[name]
+        return cls(p['host_rate'], p['host_burst'], p['global_rate'], p['global_burst'])
+
+    def _bucket(self, url):
+        host = (urlparse(url).hostname or '').lower()
+        bucket = self._hosts.get(host)
+        if bucket is None:
+            bucket = self._hosts[host] = TokenBucket(self.host_rate, self.host_burst)
+        return bucket
+
+    async def acquire(self, url):
+        """Wait until a request to `url` is allowed."""
+        wait = self._bucket(url).reserve()
+        if self.global_bucket is not None:
+            wait = max(wait, self.global_bucket.reserve())
+        if wait > 0:
+            self.waited += wait
+            await asyncio.sleep(wait)
+
+    def defer(self, url, seconds):
+        """The host of `url` asked us to back off for `seconds`."""
+        logger.info(f"Backing off {urlparse(url).hostname} for {seconds:.0f}s")
+        self._bucket(url).pause(seconds)
+
+# ------------------------------------------------------------------------------
+# URL Probing (HEAD) with a shared cache
+PROBE_TIMEOUT_MS = 8000
+DEFAULT_PROBE_CACHE_SIZE = 4096
+DEFAULT_PROBE_CACHE_TTL = 300  # seconds
+
+def normalize_url(url):
+    """Canonical form of `url` used as a cache key (case, default ports, fragment)."""
+    try:
+        parsed = urlparse(url.strip())
+        host = (parsed.hostname or '').lower()
+        port = parsed.port
+    except ValueError:
+        # Malformed port or IPv6 literal: keep the authority as written.
+        return url.strip().split('#', 1)[0]
+    scheme = parsed.scheme.lower()
+    if port and not ((scheme == 'http' and port == 80) or (scheme == 'https' and port == 443)):
+        host = f"{host}:{port}"
+    path = parsed.path or '/'
+    query = f"?{parsed.query}" if parsed.query else ''
+    return f"{scheme}://{host}{path}{query}"
+
+def probe_from_headers(status, headers):
+    """Normalize the response headers we care about into a plain dict."""
+    length = headers.get('content-length')
+    return {
+        'status': status,
+        'content_type': (headers.get('content-type') or '').split(';')[0].strip().lower(),
+        'content_length': int(length) if length and length.isdigit() else None,
+        'content_disposition': headers.get('content-disposition') or '',
+        'accept_ranges': (headers.get('accept-ranges') or '').lower(),
+        'etag': headers.get('etag'),
+        'last_modified': headers.get('last-modified'),
+        'retry_after': headers.get('retry-after'),
+    }
+
+# Result handed to coalesced waiters when the owning lookup was cancelled.
+_PROBE_ABANDONED = object()
+
+class ProbeCache:
+    """
+    LRU + TTL cache of probe dicts keyed by normalized URL. Concurrent
+    lookups of the same URL share one in-flight request. Failed probes are
+    cached as None so a dead link is not retried within the TTL either.
+    With a RateLimiter, every probe that reaches the network is paced by
+    it, and a 429/503 answer is retried once after its Retry-After.
+    """
+    def __init__(self, max_entries=DEFAULT_PROBE_CACHE_SIZE, ttl=DEFAULT_PROBE_CACHE_TTL,
+                 limiter=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.limiter = limiter
+        self._entries = OrderedDict()   # key -> (expires_at, probe)
+        self._inflight = {}             # key -> Future
+
+    def peek(self, url):
+        """Return the cached probe for `url` without fetching, or None."""
+        key = normalize_url(url)
+        hit = self._entries.get(key)
+        if hit and hit[0] > time.monotonic():
+            return hit[1]
+        return None
+
+    def put(self, url, probe):
+        key = normalize_url(url)
+        self._entries[key] = (time.monotonic() + self.ttl, probe)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, url, fetch):
+        """
+        Return the probe for `url`, calling coroutine function `fetch(url)`
+        only if it is neither cached nor already being fetched.
+        """
+        key = normalize_url(url)
+        while True:
+            hit = self._entries.get(key)
+            if hit:
+                if hit[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return hit[1]
+                del self._entries[key]
+
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            probe = await asyncio.shield(pending)
+            if probe is not _PROBE_ABANDONED:
+                return probe
+            # The caller that owned the probe was cancelled; try again ourselves.
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            probe = await self._fetch(url, fetch)
+            self.put(url, probe)
+            fut.set_result(probe)
+            return probe
+        except BaseException:
+            # Waiters must not inherit our cancellation: wake them to retry.
+            if not fut.done():
+                fut.set_result(_PROBE_ABANDONED)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _fetch(self, url, fetch):
+        for attempt in range(2):
+            if self.limiter is not None:
+                await self.limiter.acquire(url)
+            try:
+                with METRICS.stage("probe"):
+                    probe = await fetch(url)
+            except Exception as e:
+                logger.info(f"Probe failed for {url}: {e}")
+                return None
+            if attempt or not probe or probe['status'] not in RETRY_STATUSES:
+                return probe
+            delay = parse_retry_after(probe['retry_after'], default=5)
+            if self.limiter is not None:
+                self.limiter.defer(url, delay)
+            else:
+                await asyncio.sleep(delay)
+        return probe
+
+async def page_head_probe(url, page):
+    """HEAD `url` through the browser context; raises on network errors."""
+    resp = await page.request.head(url, timeout=PROBE_TIMEOUT_MS)
+    return probe_from_headers(resp.status, resp.headers)
+
+async def probe_url(url, page, probe_cache=None):
+    """Probe dict for `url` (or None), via `probe_cache` when one is given."""
+    if probe_cache is None:
+        try:
+            return await page_head_probe(url, page)
+        except Exception:
+            return None
+    return await probe_cache.get(url, lambda u: page_head_probe(u, page))
+
+def probe_ok(probe):
+    return bool(probe) and 200 <= probe['status'] < 300
+
+async def get_file_size(url, page, probe_cache=None):
+    """Returns a human-readable file size string or 'Unknown Size' if not available."""
+    probe = await probe_url(url, page, probe_cache)
+    if probe and probe['content_length'] is not None:
+        return sizeof_fmt(probe['content_length'])
+    return "Unknown Size"
+
+# ------------------------------------------------------------------------------
+# PDF Metadata via Range Requests
+# Only the trailer, the cross-reference data and the few objects we need
+# (Info, Catalog, page tree root) are fetched, within a per-file byte budget.
+PDF_TAIL_BYTES = 64 * 1024
+PDF_MIN_FETCH = 8 * 1024
+PDF_METADATA_BUDGET = 512 * 1024
+PDF_FETCH_TIMEOUT_MS = 15000
+# What the ranged reader raises on a file it cannot follow (as opposed to a
+# network failure, which a full download would not get past either).
+PDF_STRUCTURE_ERRORS = (ValueError, KeyError, IndexError, TypeError, zlib.error)
+
+class PdfRangeUnsupported(Exception):
+    """The server answered a range request with something other than 206."""
+
+    def __init__(self, message, body=None):
+        super().__init__(message)
+        # Set when the server sent the whole file instead of a range.
+        self.body = body
+
+class PdfBudgetExceeded(Exception):
+    """Reading the metadata would need more bytes than the per-file budget."""
+
+class PdfTruncated(ValueError):
+    """The buffer ended before the PDF object did; read more and retry."""
+
+class PdfRef:
+    __slots__ = ('num', 'gen')
+
+    def __init__(self, num, gen):
+        self.num = num
+        self.gen = gen
+
+_PDF_WS = b' \t\r\n\f\x00'
+_PDF_DELIMS = b'()<>[]{}/%'
+
+def _pdf_skip_ws(data, pos):
+    """Skip whitespace and comments."""
+    while pos < len(data):
+        c = data[pos]
+        if c in _PDF_WS:
+            pos += 1
+        elif c == 0x25:  # '%'
+            while pos < len(data) and data[pos] not in (0x0D, 0x0A):
+                pos += 1
+        else:
+            break
+    return pos
+
+def _pdf_parse_literal(data, pos):
+    """Parse a (...) string starting just after the opening paren."""
+    out = bytearray()
+    depth = 1
+    escapes = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+    while pos < len(data):
+        c = data[pos:pos + 1]
+        pos += 1
+        if c == b'\\':
+            e = data[pos:pos + 1]
+            pos += 1
+            if e in escapes:
+                out += escapes[e]
+            elif e in b'01234567' and e:
+                digits = e
+                while len(digits) < 3 and data[pos:pos + 1] in b'01234567' and data[pos:pos + 1]:
+                    digits += data[pos:pos + 1]
+                    pos += 1
+                out.append(int(digits, 8) & 0xFF)
+            elif e == b'\r':
+                if data[pos:pos + 1] == b'\n':
+                    pos += 1
+            elif e == b'\n':
+                pass
+            else:
+                out += e
+        elif c == b'(':
+            depth += 1
+            out += c
+        elif c == b')':
+            depth -= 1
+            if depth == 0:
+                return bytes(out), pos
+            out += c
+        else:
+            out += c
+    raise PdfTruncated("Unterminated PDF string")
+
+def pdf_parse_value(data, pos=0):
+    """
+    Parse one PDF object (dict, array, string, name, number, reference,
+    boolean or null) at `pos`. Returns (value, new_pos). Names keep their
+    leading slash; strings are bytes; references are PdfRef.
+    """
+    pos = _pdf_skip_ws(data, pos)
+    if pos >= len(data):
+        raise PdfTruncated("Unexpected end of PDF data")
+    if data.startswith(b'<<', pos):
+        pos += 2
+        result = {}
+        while True:
+            pos = _pdf_skip_ws(data, pos)
+            if data.startswith(b'>>', pos):
+                return result, pos + 2
+            if pos >= len(data):
+                raise PdfTruncated("Unterminated PDF dictionary")
+            key, pos = pdf_parse_value(data, pos)
+            value, pos = pdf_parse_value(data, pos)
+            result[key] = value
+    c = data[pos:pos + 1]
+    if c == b'<':
+        end = data.find(b'>', pos)
+        if end < 0:
+            raise PdfTruncated("Unterminated PDF hex string")
+        hexdigits = re.sub(rb'[^0-9A-Fa-f]', b'', data[pos + 1:end])
+        if len(hexdigits) % 2:
+            hexdigits += b'0'
+        return bytes.fromhex(hexdigits.decode('ascii')), end + 1
+    if c == b'(':
+        return _pdf_parse_literal(data, pos + 1)
+    if c == b'[':
+        pos += 1
+        items = []
+        while True:
+            pos = _pdf_skip_ws(data, pos)
+            if data.startswith(b']', pos):
+                return items, pos + 1
+            if pos >= len(data):
+                raise PdfTruncated("Unterminated PDF array")
+            item, pos = pdf_parse_value(data, pos)
+            items.append(item)
+    if c == b'/':
+        end = pos + 1
+        while end < len(data) and data[end:end + 1] not in _PDF_WS and data[end:end + 1] not in _PDF_DELIMS:
+            end += 1
+        return data[pos:end].decode('latin-1'), end
+    mt = re.compile(rb'[+-]?(\d+\.?\d*|\.\d+)').match(data, pos)
+    if mt:
+        token = mt.group(0)
+        if b'.' in token:
+            return float(token), mt.end()
+        ref = re.compile(rb'\s+(\d+)\s+R(?![A-Za-z])').match(data, mt.end())
+        if ref:
+            return PdfRef(int(token), int(ref.group(1))), ref.end()
+        return int(token), mt.end()
+    for kw, value in ((b'true', True), (b'false', False), (b'null', None)):
+        if data.startswith(kw, pos):
+            return value, pos + len(kw)
+    raise ValueError(f"Unexpected PDF token at {pos}")
+
+def pdf_text(value):
+    """Decode a PDF text string (UTF-16BE with BOM, UTF-8 with BOM, or PDFDocEncoding)."""
+    if not isinstance(value, bytes):
+        return None
+    if value.startswith(b'\xfe\xff'):
+        return value[2:].decode('utf-16-be', errors='replace')
+    if value.startswith(b'\xef\xbb\xbf'):
+        return value[3:].decode('utf-8', errors='replace')
+    return value.decode('latin-1')
+
+def _pdf_png_unpredict(data, columns):
+    """Undo PNG row predictors (as used by cross-reference streams)."""
+    row_len = columns + 1
+    prev = bytearray(columns)
+    out = bytearray()
+    for i in range(0, len(data) - row_len + 1, row_len):
+        ftype = data[i]
+        row = bytearray(data[i + 1:i + row_len])
+        if ftype == 1:
+            for j in range(1, columns):
+                row[j] = (row[j] + row[j - 1]) & 0xFF
+        elif ftype == 2:
+            for j in range(columns):
+                row[j] = (row[j] + prev[j]) & 0xFF
+        elif ftype != 0:
+            raise ValueError(f"Unsupported PNG predictor {ftype}")
+        out += row
+        prev = row
+    return bytes(out)
+
+def _pdf_decode_stream(sdict, raw):
+    filters = sdict.get('/Filter')
+    if isinstance(filters, list):
+        filters = filters[0] if len(filters) == 1 else filters
+    if filters is None:
+        data = raw
+    elif filters == '/FlateDecode':
+        data = zlib.decompress(raw)
+    else:
+        raise ValueError(f"Unsupported stream filter {filters}")
+    parms = sdict.get('/DecodeParms') or {}
+    if isinstance(parms, list):
+        parms = parms[0] or {}
+    predictor = parms.get('/Predictor', 1)
+    if predictor >= 10:
+        data = _pdf_png_unpredict(data, parms.get('/Columns', 1))
+    elif predictor != 1:
+        raise ValueError(f"Unsupported predictor {predictor}")
+    return data
+
+class _PdfRangeReader:
+    """Caches fetched byte ranges of one remote PDF and enforces the byte budget."""
+
+    def __init__(self, url, page, budget):
+        self.url = url
+        self.page = page
+        self.budget = budget
+        self.used = 0
+        self.size = None
+        self.chunks = []   # (start, bytes)
+
+    async def _get(self, range_value):
+        resp = await self.page.request.get(
+            self.url, headers={'Range': range_value}, timeout=PDF_FETCH_TIMEOUT_MS
+        )
+        if resp.status == 200:
+            # Ranges unsupported: this is the whole file, keep it for the fallback.
+            raise PdfRangeUnsupported(self.url, body=await resp.body())
+        if resp.status != 206:
+            raise PdfRangeUnsupported(f"{self.url}: status {resp.status}")
+        crange = parse_content_range(resp.headers.get('content-range'))
+        if not crange:
+            raise PdfRangeUnsupported(f"{self.url}: missing Content-Range")
+        body = await resp.body()
+        self.used += len(body)
+        if crange[2] is not None:
+            self.size = crange[2]
+        self.chunks.append((crange[0], body))
+        return crange[0], body
+
+    async def tail(self, length):
+        return await self._get(f"bytes=-{length}")
+
+    async def read(self, start, length):
+        for cstart, cdata in self.chunks:
+            if cstart <= start and start + length <= cstart + len(cdata):
+                return cdata[start - cstart:start + length - cstart]
+        fetch_len = max(length, PDF_MIN_FETCH)
+        if self.size is not None:
+            fetch_len = min(fetch_len, self.size - start)
+        if fetch_len <= 0:
+            raise ValueError("Read past end of PDF")
+        if self.used + fetch_len > self.budget:
+            raise PdfBudgetExceeded(self.url)
+        cstart, cdata = await self._get(f"bytes={start}-{start + fetch_len - 1}")
+        return cdata[start - cstart:start - cstart + length]
+
+    async def read_from(self, start, length=PDF_MIN_FETCH):
+        """Up to `length` bytes at `start`, shorter near the end of the file."""
+        if self.size is not None:
+            length = min(length, self.size - start)
+        return await self.read(start, length)
+
+class _PdfXref:
+    """
+    Lazily walks the cross-reference sections of a remote PDF, newest first.
+    Classic tables are not read in full: only their subsection headers are
+    fetched, and single 20-byte rows when an object number is looked up.
+    """
+
+    def __init__(self, reader, startxref):
+        self.reader = reader
+        self.pending = [startxref]
+        self.seen = set()
+        self.sections = []   # ('table', [(first, count, rows_pos)]) or ('stream', {num: entry})
+        self.trailer = None
+        self.objstm_cache = {}
+
+    async def _load_next_section(self):
+        offset = self.pending.pop(0)
+        if offset in self.seen:
+            return None
+        self.seen.add(offset)
+        head = await self.reader.read_from(offset, 64)
+        if head.lstrip().startswith(b'xref'):
+            section, trailer = await self._load_table(offset + head.index(b'xref') + 4)
+        else:
+            section, trailer = await self._load_stream(offset)
+        self.sections.append(section)
+        if self.trailer is None:
+            self.trailer = trailer
+        # Hybrid files keep compressed objects in a separate xref stream.
+        if isinstance(trailer.get('/XRefStm'), int):
+            self.pending.insert(0, trailer['/XRefStm'])
+        if isinstance(trailer.get('/Prev'), int):
+            self.pending.append(trailer['/Prev'])
+        return section
+
+    async def _load_table(self, pos):
+        subsections = []
+        while True:
+            chunk = await self.reader.read_from(pos, 64)
+            skipped = _pdf_skip_ws(chunk, 0)
+            if chunk.startswith(b'trailer', skipped):
+                trailer, _, _ = await self._read_object(pos + skipped, rb'trailer')
+                return ('table', subsections), trailer
+            mt = re.match(rb'\s*(\d+)\s+(\d+)[ \t]*\r?\n?', chunk)
+            if not mt:
+                raise ValueError("Malformed xref subsection header")
+            first, count = int(mt.group(1)), int(mt.group(2))
+            subsections.append((first, count, pos + mt.end()))
+            pos += mt.end() + 20 * count
+
+    async def _load_stream(self, offset):
+        sdict, raw = await self._read_stream_object(offset)
+        if sdict.get('/Type') != '/XRef':
+            raise ValueError("startxref does not point at an xref table or stream")
+        data = _pdf_decode_stream(sdict, raw)
+        widths = sdict['/W']
+        index = sdict.get('/Index') or [0, sdict['/Size']]
+        row_len = sum(widths)
+        entries = {}
+        pos = 0
+        for k in range(0, len(index), 2):
+            first, count = index[k], index[k + 1]
+            for num in range(first, first + count):
+                row = data[pos:pos + row_len]
+                pos += row_len
+                fields = []
+                p = 0
+                for w in widths:
+                    fields.append(int.from_bytes(row[p:p + w], 'big') if w else None)
+                    p += w
+                kind = 1 if fields[0] is None else fields[0]
+                if kind == 1:
+                    entries[num] = ('offset', fields[1])
+                elif kind == 2:
+                    entries[num] = ('objstm', fields[1], fields[2] or 0)
+                else:
+                    entries[num] = ('free',)
+        return ('stream', entries), sdict
+
+    async def _lookup_in(self, section, num):
+        kind, data = section
+        if kind == 'stream':
+            return data.get(num)
+        for first, count, rows in data:
+            if first <= num < first + count:
+                row = (await self.reader.read(rows + 20 * (num - first), 20)).split()
+                if len(row) < 3:
+                    raise ValueError("Malformed xref row")
+                return ('offset', int(row[0])) if row[2].startswith(b'n') else ('free',)
+        return None
+
+    async def _read_object(self, offset, keyword=rb'\s*\d+\s+\d+\s+obj'):
+        """
+        Parse the value following `keyword` at `offset`, reading a larger
+        window while the object runs past the bytes fetched so far.
+        Returns (value, end_pos, data) with `end_pos` relative to `offset`.
+        """
+        length = PDF_MIN_FETCH
+        while True:
+            data = await self.reader.read_from(offset, length)
+            at_eof = self.reader.size is not None and offset + len(data) >= self.reader.size
+            mt = re.match(keyword, data)
+            if not mt:
+                raise ValueError(f"Expected a PDF object at offset {offset}")
+            try:
+                value, end = pdf_parse_value(data, mt.end())
+            except PdfTruncated:
+                if at_eof:
+                    raise
+                length *= 4
+                continue
+            # A number or name ending right at the buffer edge may be cut short.
+            if end + 16 > len(data) and not at_eof:
+                length *= 4
+                continue
+            return value, end, data
+
+    async def _read_stream_object(self, offset):
+        sdict, pos, data = await self._read_object(offset)
+        length = sdict.get('/Length')
+        if not isinstance(length, int):
+            raise ValueError("Stream length is not direct")
+        pos = _pdf_skip_ws(data, pos)
+        if not data.startswith(b'stream', pos):
+            raise ValueError("Expected stream keyword")
+        pos += 6
+        if data.startswith(b'\r\n', pos):
+            pos += 2
+        elif data.startswith(b'\n', pos) or data.startswith(b'\r', pos):
+            pos += 1
+        raw = await self.reader.read(offset + pos, length)
+        return sdict, raw
+
+    async def load_trailer(self):
+        await self._load_next_section()
+        return self.trailer
+
+    async def lookup(self, num):
+        for section in self.sections:
+            entry = await self._lookup_in(section, num)
+            if entry:
+                return entry
+        while self.pending:
+            section = await self._load_next_section()
+            if section:
+                entry = await self._lookup_in(section, num)
+                if entry:
+                    return entry
+        return None
+
+    async def resolve(self, value, depth=0):
+        """Follow a PdfRef to its object; other values are returned unchanged."""
+        if not isinstance(value, PdfRef):
+            return value
+        if depth > 8:
+            raise ValueError("Reference chain too deep")
+        entry = await self.lookup(value.num)
+        if not entry or entry[0] == 'free':
+            return None
+        if entry[0] == 'offset':
+            obj, _, _ = await self._read_object(entry[1])
+        else:
+            obj = await self._from_objstm(entry[1], entry[2])
+        return await self.resolve(obj, depth + 1)
+
+    async def _from_objstm(self, stm_num, index):
+        if stm_num not in self.objstm_cache:
+            entry = await self.lookup(stm_num)
+            if not entry or entry[0] != 'offset':
+                raise ValueError("Object stream not found")
+            sdict, raw = await self._read_stream_object(entry[1])
+            self.objstm_cache[stm_num] = (sdict, _pdf_decode_stream(sdict, raw))
+        sdict, data = self.objstm_cache[stm_num]
+        header = data[:sdict['/First']].split()
+        offset = int(header[2 * index + 1])
+        obj, _ = pdf_parse_value(data, sdict['/First'] + offset)
+        return obj
+
+async def read_pdf_metadata_ranged(url, page, budget=PDF_METADATA_BUDGET):
+    """
+    Read Title, Author and page count of a remote PDF using HTTP Range
+    requests only. Raises PdfRangeUnsupported, PdfBudgetExceeded or
+    ValueError when the file cannot be read this way.
+    """
+    reader = _PdfRangeReader(url, page, budget)
+    _, tail = await reader.tail(PDF_TAIL_BYTES)
+    marks = list(re.finditer(rb'startxref\s+(\d+)', tail))
+    if not marks:
+        raise ValueError("No startxref in the PDF tail")
+    xref = _PdfXref(reader, int(marks[-1].group(1)))
+    trailer = await xref.load_trailer()
+    if '/Encrypt' in trailer:
+        raise ValueError("Encrypted PDF")
+
+    info = await xref.resolve(trailer.get('/Info')) or {}
+    root = await xref.resolve(trailer.get('/Root')) or {}
+    pages = await xref.resolve(root.get('/Pages')) or {}
+    count = await xref.resolve(pages.get('/Count'))
+    title = pdf_text(await xref.resolve(info.get('/Title')))
+    author = pdf_text(await xref.resolve(info.get('/Author')))
+    logger.info(f"PDF metadata for {url} read with {reader.used} bytes")
+    return {
+        'Title': title if title else 'N/A',
+        'Author': author if author else 'N/A',
+        'Pages': count if isinstance(count, int) else None,
+    }
+
+def _pdf_metadata_from_bytes(content):
+    reader = PdfReader(BytesIO(content))
+    return {
+        'Title': reader.metadata.title if reader.metadata.title else 'N/A',
+        'Author': reader.metadata.author if reader.metadata.author else 'N/A',
+        'Pages': len(reader.pages),
+    }
+
+async def get_pdf_metadata(url, page):
+    """
+    Extract minimal PDF metadata, reading only the needed byte ranges.
+    Falls back to fetching the whole file when the server ignores ranges
+    or the file's structure cannot be followed with ranges alone; timeouts
+    and other request failures just leave the metadata empty.
+    """
+    with METRICS.stage("pdf_metadata"):
+        return await _get_pdf_metadata(url, page)
+
+async def _get_pdf_metadata(url, page):
+    try:
+        return await read_pdf_metadata_ranged(url, page)
+    except PdfBudgetExceeded:
+        logger.info(f"PDF metadata byte budget exceeded for {url}")
+        return {}
+    except PdfRangeUnsupported as e:
+        logger.info(f"Range requests unsupported for {url}: {e}")
+        if e.body is not None:
+            # The server already sent the whole file; no need to fetch it again.
+            try:
+                return _pdf_metadata_from_bytes(e.body)
+            except Exception:
+                return {}
+    except PDF_STRUCTURE_ERRORS as e:
+        logger.info(f"Ranged PDF metadata failed for {url}, fetching whole file: {e}")
+    except Exception as e:
+        logger.info(f"Could not read PDF metadata for {url}: {e}")
+        return {}
+
+    try:
+        resp = await page.request.get(url, timeout=PDF_FETCH_TIMEOUT_MS)
+        if resp.ok:
+            return _pdf_metadata_from_bytes(await resp.body())
+        else:
+            return {}
+    except Exception:
+        return {}
+
+# ------------------------------------------------------------------------------
+# Bing Search & File Extraction
+BING_SEARCH_URL = "https://www.bing.com/search"
+BING_PAGE_SIZE = 10           # results per result page; further pages use first=11, 21, ...
+BING_MAX_PAGES = 30
+BING_PAGE_CONCURRENCY = 4
+DEFAULT_SEARCH_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".advanced_search",
+                                         "search_cache.sqlite3")
+DEFAULT_SEARCH_CACHE_TTL = 6 * 3600  # seconds
+
+def bing_search_url(query, first=1, count=BING_PAGE_SIZE):
+    params = {'q': query, 'count': count}
+    if first > 1:
+        params['first'] = first
+    return f"{BING_SEARCH_URL}?{urlencode(params)}"
+
+def unwrap_bing_link(href):
+    """The target of a bing.com/ck/a click-tracking link (its u=a1<base64> param), else `href`."""
+    parsed = urlparse(href)
+    if not (parsed.hostname or '').endswith('bing.com') or not parsed.path.startswith('/ck/'):
+        return href
+    u = parse_qs(parsed.query).get('u', [''])[0]
+    if not u.startswith('a1'):
+        return href
+    encoded = u[2:]
+    try:
+        target = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        return href
+    return target if target.startswith(('http://', 'https://')) else href
+
+def parse_bing_results(html):
+    """
+    Organic result URLs (li.b_algo, first link of each) from a Bing result
+    page, in page order. Pure function of the HTML, so saved pages can be
+    replayed through it.
+    """
+    hrefs = []
+    doc = None
+    if lxml_html is not None and html.strip():
+        try:
+            doc = lxml_html.document_fromstring(html)
+        except (ValueError, lxml_html.etree.ParserError):
+            doc = None
+    if doc is not None:
+        for li in doc.xpath('//li[contains(concat(" ", normalize-space(@class), " "), " b_algo ")]'):
+            links = li.xpath('.//h2//a[@href]') or li.xpath('.//a[@href]')
+            if links:
+                hrefs.append(links[0].get('href'))
+    else:
+        soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('li'))
+        for li in soup.find_all('li', class_='b_algo'):
+            link = (li.h2.find('a', href=True) if li.h2 else None) or li.find('a', href=True)
+            if link:
+                hrefs.append(link['href'])
+    urls = []
+    for href in hrefs:
+        url = unwrap_bing_link(href.strip())
+        if url.startswith(('http://', 'https://')):
+            urls.append(url)
+    return urls
+
+async def perform_bing_search(query, num_results, page, humanize=True, first=1):
+    """
+    One Bing result page (starting at result `first`) loaded in the browser.
+    Returns the parsed URLs ([] when Bing has no results there), or None
+    when the page could not be loaded.
+    """
+    bing_url = bing_search_url(query, first, max(num_results, BING_PAGE_SIZE))
+    try:
+        with METRICS.stage("bing_navigate"):
+            await page.goto(bing_url, timeout=30000)
+        with METRICS.stage("bing_results"):
+            # li.b_no is Bing's "no results" notice: an answer, not a failure.
+            await page.wait_for_selector('li.b_algo, li.b_no', timeout=30000)
+        if humanize:
+            with METRICS.stage("interactions"):
+                await human_like_scroll(page)
+        html = await page.content()
+        with METRICS.stage("bing_parse"):
+            return parse_bing_results(html)[:num_results]
+    except PlaywrightTimeoutError:
+        logger.error("Bing search timed out.")
+        return None
+    except Exception as e:
+        logger.error(f"Bing search error: {e}")
+        return None
+
+async def fetch_bing_page(session, query, first, proxy=None):
+    """
+    One Bing result page over plain HTTP. Returns the parsed URLs, or None
+    when the page needs a real browser (blocked, consent wall, no results
+    markup).
+    """
+    with METRICS.stage("bing_http"):
+        fetched = await fetch_static_page(session, bing_search_url(query, first), proxy=proxy)
+    if fetched is None or fetched['status'] >= 400 or not fetched['html']:
+        return None
+    if 'b_algo' not in fetched['html']:
+        return None
+    return parse_bing_results(fetched['html'])
+
+class SearchCache:
+    """Disk-backed (SQLite) cache of search result lists with a TTL."""
+
+    def __init__(self, path=DEFAULT_SEARCH_CACHE_PATH, ttl=DEFAULT_SEARCH_CACHE_TTL):
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS searches ("
+                " key TEXT PRIMARY KEY, results TEXT NOT NULL, complete INTEGER NOT NULL,"
+                " fetched_at REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def key(query):
+        return " ".join(query.lower().split())
+
+    def get(self, query, num_results):
+        """Cached results for `query` if fresh and long enough for `num_results`."""
+        row = self.db.execute(
+            "SELECT results, complete, fetched_at FROM searches WHERE key = ?", (self.key(query),)
+        ).fetchone()
+        if row is None or row[2] + self.ttl < time.time():
+            return None
+        results = json.loads(row[0])
+        # A shorter list only satisfies a bigger request if Bing had no more.
+        if len(results) < num_results and not row[1]:
+            return None
+        return results[:num_results]
+
+    def put(self, query, results, complete):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO searches (key, results, complete, fetched_at)"
+                " VALUES (?, ?, ?, ?)",
+                (self.key(query), json.dumps(results), int(complete), time.time())
+            )
+
+    def close(self):
+        self.db.close()
+
+# Base file extensions we always look for:
+DEFAULT_FILE_EXTS = [
+    '.pdf', '.docx', '.zip', '.rar', '.exe', '.mp3',
+    '.mp4', '.avi', '.mkv', '.png', '.jpg', '.jpeg', '.gif'
+]
+# How many links are classified (HEAD / size / PDF metadata) at once.
+DEFAULT_CLASSIFY_CONCURRENCY = 16
+
+def merge_extensions(custom_ext_list):
+    """Merge the default extensions with the user's custom list."""
+    return set(DEFAULT_FILE_EXTS + [ext.strip().lower() for ext in custom_ext_list if ext.strip()])
+
+# Collected inside the page: only (raw href, resolved href) pairs cross the
+# Playwright bridge instead of the whole serialized DOM.
+PAGE_LINKS_JS = """
+anchors => anchors.map(a => [a.getAttribute('href'), a.href])
+"""
+
+def resolve_link(base_url, href):
+    """Absolute http(s) URL for `href` relative to `base_url`, or None."""
+    href = href.strip()
+    if not href:
+        return None
+    file_url = urljoin(base_url, href)
+    if urlparse(file_url).scheme not in ('http', 'https'):
+        # javascript:, mailto:, data: and the like
+        return None
+    return file_url
+
+def unique_links(pairs):
+    """
+    (href, file_url) pairs in document order, dropping unusable ones and
+    keeping a URL linked several times (nav, body, footer) once.
+    """
+    links = []
+    seen = set()
+    for href, file_url in pairs:
+        if not href or not file_url or urlparse(file_url).scheme not in ('http', 'https'):
+            continue
+        key = normalize_url(file_url)
+        if key in seen:
+            continue
+        seen.add(key)
+        links.append((href.strip(), file_url))
+    return links
+
+def collect_page_links(url, html):
+    """
+    Absolute (href, file_url) pairs for the anchors in the `html` of `url`,
+    honouring <base href>. Parsed with lxml when it is installed.
+    """
+    base = url
+    pairs = []
+    doc = None
+    if lxml_html is not None and html.strip():
+        try:
+            doc = lxml_html.document_fromstring(html)
+        except (ValueError, lxml_html.etree.ParserError):
+            # e.g. an XML encoding declaration in a decoded string
+            doc = None
+    if doc is not None:
+        base_hrefs = doc.xpath('//base/@href')
+        anchors = [a.get('href') for a in doc.iter('a') if a.get('href') is not None]
+    else:
+        soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer(['a', 'base']))
+        base_hrefs = [b['href'] for b in soup.find_all('base', href=True)]
+        anchors = [a['href'] for a in soup.find_all('a', href=True)]
+    if base_hrefs:
+        base = urljoin(url, base_hrefs[0].strip())
+    for href in anchors:
+        pairs.append((href, resolve_link(base, href)))
+    return unique_links(pairs)
+
+async def extract_page_links(page):
+    """(href, file_url) pairs for the anchors of the loaded `page`, resolved by the browser."""
+    pairs = await page.eval_on_selector_all('a[href]', PAGE_LINKS_JS)
+    return unique_links(pairs)
+
+async def classify_link(href, file_url, page, all_exts, probe_cache):
+    """Return a file-info dict if the link points at a downloadable file, else None."""
+    # Check #1: Google Drive link detection
+    if "drive.google.com" in href.lower():
+        file_id = None
+        match1 = re.search(r'/file/d/([^/]+)/', href)
+        if match1:
+            file_id = match1.group(1)
+        match2 = re.search(r'open\?id=([^&]+)', href)
+        if match2:
+            file_id = match2.group(1)
+        match3 = re.search(r'id=([^&]+)', href)
+        if match3:
+            file_id = match3.group(1)
+        if not file_id:
+            return None
+        direct = f"https://drive.google.com/uc?export=download&id={file_id}"
+        size_str = await get_file_size(direct, page, probe_cache)
+        return {
+            'url': direct,
+            'filename': f"drive_file_{file_id}",
+            'size': size_str,
+            'metadata': {}
+        }
+
+    # Check #2: Known or custom extension
+    lower_href = href.lower()
+    if any(lower_href.endswith(ext) for ext in all_exts):
+        # It's a recognized direct file link
+        size_str = await get_file_size(file_url, page, probe_cache)
+
+        meta = {}
+        if file_url.lower().endswith('.pdf'):
+            meta = await get_pdf_metadata(file_url, page)
+
+        return {
+            'url': file_url,
+            'filename': os.path.basename(file_url.split('?')[0]),
+            'size': size_str,
+            'metadata': meta
+        }
+
+    # Check #3: Use HEAD request to see if it's a known file by MIME type
+    probe = await probe_url(file_url, page, probe_cache)
+    return await file_info_from_probe(file_url, probe, page, probe_cache)
+
+def is_attachment(probe):
+    cdisp = (probe.get('content_disposition') or '').lower()
+    return cdisp.startswith('attachment')
+
+async def file_info_from_probe(file_url, probe, page, probe_cache):
+    """File-info dict for a URL whose headers mark it as a file, else None."""
+    if not probe_ok(probe):
+        return None
+    ctype = probe['content_type']
+    if ctype not in KNOWN_MIME_TYPES and not is_attachment(probe):
+        return None
+
+    # We treat this as a file
+    # If there's a content-disposition filename, we can use that;
+    # otherwise, we'll guess from the URL
+    cdisp = probe['content_disposition']
+    filename = os.path.basename(file_url.split('?')[0])
+    if cdisp:
+        mt = re.search(r'filename\*?="?([^";]+)', cdisp)
+        if mt:
+            cdisp_fname = mt.group(1).strip('"').strip()
+            if cdisp_fname:
+                filename = cdisp_fname
+    else:
+        # If there's no extension in the URL, attach the known extension
+        base_part, ext_part = os.path.splitext(filename)
+        if not ext_part and ctype in KNOWN_MIME_TYPES:
+            known_ext = KNOWN_MIME_TYPES[ctype]
+            filename = base_part + known_ext
+
+    # Same URL as the MIME probe, so this is a cache hit.
+    size_str = await get_file_size(file_url, page, probe_cache)
+
+    meta = {}
+    # PDF metadata if relevant
+    if ctype == 'application/pdf':
+        meta = await get_pdf_metadata(file_url, page)
+
+    return {
+        'url': file_url,
+        'filename': filename,
+        'size': size_str,
+        'metadata': meta
+    }
+
+async def classify_links(links, page, all_exts, probe_cache,
+                         concurrency=DEFAULT_CLASSIFY_CONCURRENCY, max_results=None):
+    """
+    Classify (href, file_url) pairs with up to `concurrency` links in flight.
+    Async generator of file-info dicts in the original link order. Stops
+    dispatching new work once `max_results` files have been yielded.
+    """
+    if not links:
+        return
+    results = {}
+    completed = asyncio.Queue()
+    next_idx = 0
+
+    async def worker():
+        nonlocal next_idx
+        while next_idx < len(links):
+            i = next_idx
+            next_idx += 1
+            href, file_url = links[i]
+            try:
+                with METRICS.stage("classify"):
+                    results[i] = await classify_link(href, file_url, page, all_exts, probe_cache)
+            except Exception as e:
+                logger.info(f"Could not classify {file_url}: {e}")
+            finally:
+                # Always report the slot, or the in-order emitter waits forever.
+                results.setdefault(i, None)
+                completed.put_nowait(i)
+
+    workers = [asyncio.ensure_future(worker())
+               for _ in range(max(1, min(concurrency, len(links))))]
+    try:
+        emit_idx = 0
+        emitted = 0
+        while emit_idx < len(links):
+            await completed.get()
+            # Release everything that is now contiguous from the front.
+            while emit_idx in results:
+                found = results.pop(emit_idx)
+                emit_idx += 1
+                if found is None:
+                    continue
+                yield found
+                emitted += 1
+                if max_results and emitted >= max_results:
+                    return
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+# ------------------------------------------------------------------------------
+# Analysis Page Loading
+# Analysis only needs the DOM's anchors, so pictures, video, fonts and
+# trackers are refused at the network layer, and a page counts as ready once
+# its links stop changing rather than when the network goes quiet (which
+# ad-heavy pages may never do).
+DEFAULT_BLOCKED_RESOURCE_TYPES = ("image", "media", "font")
+DEFAULT_BLOCKED_HOSTS = (
+    "google-analytics.com", "googletagmanager.com", "googlesyndication.com",
+    "doubleclick.net", "adservice.google.com", "connect.facebook.net",
+    "hotjar.com", "scorecardresearch.com", "quantserve.com", "criteo.com",
+    "amazon-adsystem.com", "segment.io", "newrelic.com", "nr-data.net",
+)
+PAGE_READY_TIMEOUT_MS = 10000
+PAGE_READY_POLL_MS = 400
+PAGE_READY_STABLE_POLLS = 2
+
+class ResourcePolicy:
+    """
+    Which subresources analysis pages may load. `block_types` are Playwright
+    resource types; `block_hosts` match a request's host or any parent
+    domain of it.
+    """
+
+    def __init__(self, block_types=DEFAULT_BLOCKED_RESOURCE_TYPES,
+                 block_hosts=DEFAULT_BLOCKED_HOSTS):
+        self.block_types = frozenset(block_types)
+        self.block_hosts = frozenset(h.lower() for h in block_hosts)
+        self.blocked = 0
+
+    def blocks(self, resource_type, url):
+        if resource_type in self.block_types:
+            return True
+        if not self.block_hosts:
+            return False
+        host = (urlparse(url).hostname or '').lower()
+        parts = host.split('.')
+        return any('.'.join(parts[i:]) in self.block_hosts for i in range(len(parts) - 1))
+
+    async def _handle(self, route):
+        request = route.request
+        # Documents are always let through: a blocked navigation is a failed analysis.
+        if request.resource_type != "document" and self.blocks(request.resource_type, request.url):
+            self.blocked += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def apply(self, context):
+        """Route every request of the browser `context` through this policy."""
+        if self.block_types or self.block_hosts:
+            await context.route("**/*", self._handle)
+
+async def wait_for_page_ready(page, timeout=PAGE_READY_TIMEOUT_MS):
+    """
+    Wait until the DOM is parsed and its link count has held still for
+    PAGE_READY_STABLE_POLLS polls, or `timeout` ms have passed. Never raises
+    on timeout: whatever links exist by then are analyzed.
+    """
+    deadline = time.monotonic() + timeout / 1000
+    last = None
+    stable = 0
+    while time.monotonic() < deadline:
+        state, count = await page.evaluate(
+            "() => [document.readyState, document.querySelectorAll('a[href]').length]"
+        )
+        if state != "loading" and count == last:
+            stable += 1
+            if stable >= PAGE_READY_STABLE_POLLS:
+                return
+        else:
+            stable = 0
+        last = count
+        await asyncio.sleep(PAGE_READY_POLL_MS / 1000)
+    logger.info(f"Page {page.url} still changing after {timeout} ms; analyzing as-is")
+
+# Resource types whose responses may be files the page fetched for the user
+# (navigations, script-driven downloads). Images, scripts, styles and the
+# like are what the page is made of, not what it offers.
+SNIFF_RESOURCE_TYPES = ("document", "xhr", "fetch", "other")
+
+class ResponseSniffer:
+    """
+    Records the responses a page receives while attached, so files that
+    only appear through scripts or redirects are found, and every response
+    seen primes the probe cache (no HEAD is needed for those URLs later).
+    """
+
+    def __init__(self, page, probe_cache):
+        self.page = page
+        self.probe_cache = probe_cache
+        self.seen = OrderedDict()  # url -> probe dict
+        self._cancels = set()      # download.cancel() tasks still running
+
+    def _on_response(self, response):
+        try:
+            if response.request.resource_type not in SNIFF_RESOURCE_TYPES:
+                return
+            if response.status != 200 or response.url.startswith('data:'):
+                return
+            probe = probe_from_headers(response.status, response.headers)
+        except Exception:
+            return
+        self.seen[response.url] = probe
+        self.probe_cache.put(response.url, probe)
+
+    def _on_download(self, download):
+        # A click or script started a download: record it, but do not save it.
+        self.seen.setdefault(download.url, None)
+        task = asyncio.ensure_future(download.cancel())
+        self._cancels.add(task)
+        task.add_done_callback(self._cancel_done)
+
+    def _cancel_done(self, task):
+        self._cancels.discard(task)
+        # Fails harmlessly when the page closed first; retrieve it so it is not reported.
+        if not task.cancelled() and task.exception() is not None:
+            logger.info(f"Download cancel failed: {task.exception()}")
+
+    def __enter__(self):
+        self.page.on("response", self._on_response)
+        self.page.on("download", self._on_download)
+        return self
+
+    def __exit__(self, *exc):
+        self.page.remove_listener("response", self._on_response)
+        self.page.remove_listener("download", self._on_download)
+
+    async def files(self, page_url, exclude=()):
+        """File-info dicts for the recorded responses that are files, in arrival order."""
+        if self._cancels:
+            await asyncio.gather(*self._cancels, return_exceptions=True)
+        found = []
+        for file_url, probe in self.seen.items():
+            if file_url == page_url or normalize_url(file_url) in exclude:
+                continue
+            if probe is None:
+                # Downloads are cut off before their headers are known.
+                probe = await probe_url(file_url, self.page, self.probe_cache)
+            info = await file_info_from_probe(file_url, probe, self.page, self.probe_cache)
+            if info:
+                found.append(info)
+        return found
+
+async def iter_downloadable_files(url, page, custom_ext_list, probe_cache=None,
+                                  concurrency=DEFAULT_CLASSIFY_CONCURRENCY, max_results=None,
+                                  link_sink=None, sniff_responses=False, humanize=True,
+                                  error_sink=None):
+    """
+    Analyze the page for direct file links, or Google Drive links, or 
+    files indicated by HEAD request checks, yielding each file-info dict in
+    document order as soon as it (and every link before it) is classified.
+    `custom_ext_list` is a list of additional file extensions to consider.
+    `probe_cache` (a ProbeCache) lets every HEAD for the same URL be shared;
+    a fresh one is used when not given, so each URL is probed at most once.
+    If `link_sink` is a list, every (href, file_url) pair found on the page
+    is appended to it (the crawler uses this to extend its frontier).
+    If `error_sink` is a list, the reason the page could not be loaded,
+    if it could not, is appended to it.
+    With `sniff_responses`, responses received during loading and the
+    interactions are classified from their headers too, and files found
+    only that way follow the linked ones. `humanize=False` replaces the
+    human-like interactions with a single scroll.
+    """
+    if probe_cache is None:
+        probe_cache = ProbeCache()
+    sniffer = ResponseSniffer(page, probe_cache) if sniff_responses else None
+    try:
+        with (sniffer or contextlib.nullcontext()):
+            with METRICS.stage("navigate"):
+                await page.goto(url, timeout=30000, wait_until='domcontentloaded')
+            with METRICS.stage("page_ready"):
+                await wait_for_page_ready(page)
+            with METRICS.stage("interactions"):
+                await page_interactions(page, humanize)
+            with METRICS.stage("extract_links"):
+                links = await extract_page_links(page)
+    except PlaywrightTimeoutError:
+        logger.error(f"Timeout extracting from {url}")
+        if error_sink is not None:
+            error_sink.append("timed out loading the page")
+        return
+    except Exception as e:
+        logger.error(f"Error extracting from {url}: {e}")
+        if error_sink is not None:
+            error_sink.append(str(e))
+        return
+
+    if link_sink is not None:
+        link_sink.extend(links)
+    all_exts = merge_extensions(custom_ext_list)
+    count = 0
+    async for found in classify_links(links, page, all_exts, probe_cache,
+                                      concurrency=concurrency, max_results=max_results):
+        count += 1
+        yield found
+
+    if sniffer is not None and (max_results is None or count < max_results):
+        linked = {normalize_url(file_url) for _, file_url in links}
+        with METRICS.stage("sniff"):
+            extra = await sniffer.files(page.url, exclude=linked)
+        if extra:
+            logger.info(f"Found {len(extra)} files in network traffic of {url}")
+        for found in extra[:None if max_results is None else max_results - count]:
+            yield found
+
+async def extract_downloadable_files(url, page, custom_ext_list, probe_cache=None,
+                                     concurrency=DEFAULT_CLASSIFY_CONCURRENCY, max_results=None):
+    """List form of iter_downloadable_files."""
+    return [
+        found async for found in iter_downloadable_files(
+            url, page, custom_ext_list, probe_cache=probe_cache,
+            concurrency=concurrency, max_results=max_results
+        )
+    ]
+
+# Streaming transfers: bytes are held in memory at most `buffer_size` at a time.
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+# No overall deadline (large files legitimately take long); only stalls abort.
+TRANSFER_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=30)
+DEFAULT_DOWNLOAD_RETRIES = 3
+# Segmented mode: files at least this large, on servers that accept byte
+# ranges, are fetched over several connections at once.
+DEFAULT_SEGMENTS = 4
+DEFAULT_SEGMENT_THRESHOLD = 32 * 1024 * 1024
+# How often (in bytes) the partial-state sidecar is refreshed during a transfer.
+PARTIAL_STATE_INTERVAL = 8 * 1024 * 1024
+
+def unique_path(save_dir, fname):
+    """Return a path in `save_dir` for `fname` that does not exist yet."""
+    path = os.path.join(save_dir, fname)
+    base, ext = os.path.splitext(fname)
+    i = 1
+    while os.path.exists(path):
+        path = os.path.join(save_dir, f"{base}({i}){ext}")
+        i += 1
+    return path
+
+def partial_paths(save_dir, url, fname):
+    """
+    Stable (part_path, state_path) for a URL, so a later attempt or a later
+    run finds the bytes an earlier one left behind.
+    """
+    tag = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+    part = os.path.join(save_dir, f".{fname}.{tag}.part")
+    return part, part + ".json"
+
+def load_partial_state(state_path):
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_partial_state(state_path, state):
+    tmp = state_path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp, state_path)
+
+def remove_quietly(*paths):
+    for p in paths:
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+
+def parse_content_range(value):
+    """Parse 'bytes start-end/total' into (start, end, total); total may be None."""
+    mt = re.match(r'\s*bytes\s+(\d+)-(\d+)/(\d+|\*)', value or '')
+    if not mt:
+        return None
+    total = None if mt.group(3) == '*' else int(mt.group(3))
+    return int(mt.group(1)), int(mt.group(2)), total
+
+def resume_offset(state, url, part_path):
+    """How many bytes of `part_path` can be reused for `url` (0 if none)."""
+    if not state or state.get('url') != url or not os.path.exists(part_path):
+        return 0
+    # Without a validator we cannot tell whether the resource changed.
+    if not (state.get('etag') or state.get('last_modified')):
+        return 0
+    # bytes_done is only written after a flush, so it never exceeds what is on disk.
+    return min(os.path.getsize(part_path), int(state.get('bytes_done', 0)))
+
+async def _transfer_once(session, file_url, headers, part_path, state_path,
+                         buffer_size, proxy, progress):
+    """
+    One attempt at fetching `file_url` into `part_path`, resuming from the
+    partial state when possible. Returns the Content-Disposition filename
+    (or None) once `part_path` holds the complete body; raises otherwise.
+    """
+    state = load_partial_state(state_path)
+    offset = resume_offset(state, file_url, part_path)
+    req_headers = dict(headers)
+    if offset:
+        req_headers['Range'] = f"bytes={offset}-"
+        # If-Range makes the server send the full body if the resource changed.
+        req_headers['If-Range'] = state.get('etag') or state.get('last_modified')
+
+    async with session.get(file_url, headers=req_headers, proxy=proxy,
+                           timeout=TRANSFER_TIMEOUT) as resp:
+        if resp.status == 416 and offset and state.get('total') == offset:
+            return state.get('fname_hint')
+        if resp.status == 403:
+            raise PermissionError(f"403 Forbidden: {file_url}")
+        if resp.status >= 400:
+            raise aiohttp.ClientResponseError(
+                resp.request_info, resp.history, status=resp.status,
+                message=f"Status {resp.status}", headers=resp.headers
+            )
+
+        etag = resp.headers.get('etag')
+        last_modified = resp.headers.get('last-modified')
+        total = None
+        if resp.status == 206 and offset:
+            crange = parse_content_range(resp.headers.get('content-range'))
+            changed = (state.get('etag') and etag and etag != state['etag'])
+            if not crange or crange[0] != offset or changed:
+                raise ValueError(f"Unexpected range response for {file_url}; restarting")
+            total = crange[2]
+            mode = 'ab'
+            logger.info(f"Resuming {file_url} at byte {offset}")
+        else:
+            # Full body: server ignored the range or the resource changed.
+            offset = 0
+            mode = 'wb'
+            if resp.headers.get('content-length'):
+                total = int(resp.headers['content-length'])
+
+        fname_hint = None
+        cdisp = resp.headers.get("content-disposition")
+        if cdisp:
+            mt = re.search(r'filename\*?="?([^";]+)', cdisp)
+            if mt:
+                fname_hint = mt.group(1).strip('"').strip() or None
+
+        if mode == 'ab':
+            etag = etag or state.get('etag')
+            last_modified = last_modified or state.get('last_modified')
+        state = {
+            'url': file_url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'total': total,
+            'bytes_done': offset,
+            'fname_hint': fname_hint,
+        }
+        save_partial_state(state_path, state)
+        progress.done = offset
+        if total is not None:
+            progress.total = total
+
+        done = offset
+        since_save = 0
+        started = time.monotonic()
+        with open(part_path, mode) as f:
+            if mode == 'ab':
+                f.truncate(offset)
+            try:
+                async for chunk in resp.content.iter_chunked(buffer_size):
+                    f.write(chunk)
+                    done += len(chunk)
+                    progress.add(len(chunk))
+                    since_save += len(chunk)
+                    if since_save >= PARTIAL_STATE_INTERVAL:
+                        f.flush()
+                        state['bytes_done'] = done
+                        save_partial_state(state_path, state)
+                        since_save = 0
+            finally:
+                f.flush()
+                state['bytes_done'] = done
+                save_partial_state(state_path, state)
+                METRICS.add_transfer(file_url, done - offset, time.monotonic() - started)
+
+    if total is not None and done != total:
+        raise IOError(f"Incomplete body for {file_url}: {done} of {total} bytes")
+    return fname_hint
+
+async def head_probe(session, url, headers=None, proxy=None):
+    """HEAD `url` with the aiohttp `session`; returns a probe dict or None."""
+    try:
+        async with session.head(url, headers=headers, proxy=proxy, allow_redirects=True,
+                                timeout=aiohttp.ClientTimeout(total=15)) as resp:
+            return probe_from_headers(resp.status, resp.headers)
+    except Exception as e:
+        logger.info(f"HEAD probe failed for {url}: {e}")
+        return None
+
+def plan_segments(total, count):
+    """Split `total` bytes into `count` [start, end, done] ranges (end inclusive)."""
+    count = max(1, min(count, total))
+    step = total // count
+    segs = []
+    for i in range(count):
+        start = i * step
+        end = total - 1 if i == count - 1 else start + step - 1
+        segs.append([start, end, 0])
+    return segs
+
+def use_segmented(probe, segments, threshold):
+    return bool(
+        probe and probe['status'] < 400 and segments > 1
+        and probe['accept_ranges'] == 'bytes'
+        and probe['content_length'] and probe['content_length'] >= threshold
+        # Segments are stitched together, so the resource must be pinned by a validator.
+        and (probe['etag'] or probe['last_modified'])
+    )
+
+async def _fetch_segment(session, file_url, headers, validator, part_path, seg,
+                         state, state_path, buffer_size, proxy, progress):
+    start, end, done = seg
+    if start + done > end:
+        return
+    req_headers = dict(headers)
+    req_headers['Range'] = f"bytes={start + done}-{end}"
+    req_headers['If-Range'] = validator
+    async with session.get(file_url, headers=req_headers, proxy=proxy,
+                           timeout=TRANSFER_TIMEOUT) as resp:
+        if resp.status in RETRY_STATUSES:
+            raise aiohttp.ClientResponseError(
+                resp.request_info, resp.history, status=resp.status,
+                message=f"Status {resp.status}", headers=resp.headers
+            )
+        crange = parse_content_range(resp.headers.get('content-range'))
+        if resp.status != 206 or not crange or crange[0] != start + done:
+            raise ValueError(f"Segment request for {file_url} was not honoured; restarting")
+        # If-Range alone trusts the server; also check every segment is cut
+        # from the same representation before stitching it in.
+        etag = resp.headers.get('etag')
+        if ((crange[2] is not None and crange[2] != state['total'])
+                or (state['etag'] and etag and etag != state['etag'])):
+            raise ValueError(f"{file_url} changed during a segmented download; restarting")
+        since_save = 0
+        started = time.monotonic()
+        with open(part_path, 'r+b') as f:
+            f.seek(start + done)
+            try:
+                async for chunk in resp.content.iter_chunked(buffer_size):
+                    # Never write past the segment, even if the server over-sends.
+                    chunk = chunk[:end + 1 - (start + seg[2])]
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    seg[2] += len(chunk)
+                    progress.add(len(chunk))
+                    since_save += len(chunk)
+                    if since_save >= PARTIAL_STATE_INTERVAL:
+                        f.flush()
+                        save_partial_state(state_path, state)
+                        since_save = 0
+            finally:
+                f.flush()
+                save_partial_state(state_path, state)
+                METRICS.add_transfer(file_url, seg[2] - done, time.monotonic() - started)
+
+async def _transfer_segmented(session, file_url, headers, probe, part_path, state_path,
+                              segments, buffer_size, proxy, progress):
+    """
+    Fetch `file_url` as `segments` concurrent byte ranges written in place
+    into a preallocated `part_path`. Progress per segment is kept in the
+    sidecar, so an interrupted transfer resumes only the missing ranges.
+    """
+    total = probe['content_length']
+    state = load_partial_state(state_path)
+    reusable = (
+        state and state.get('url') == file_url and state.get('segments')
+        and state.get('total') == total
+        and state.get('etag') == probe['etag']
+        and state.get('last_modified') == probe['last_modified']
+        and os.path.exists(part_path) and os.path.getsize(part_path) == total
+    )
+    if reusable:
+        logger.info(f"Resuming segmented download of {file_url}")
+    else:
+        state = {
+            'url': file_url,
+            'etag': probe['etag'],
+            'last_modified': probe['last_modified'],
+            'total': total,
+            'segments': plan_segments(total, segments),
+            'fname_hint': None,
+        }
+        with open(part_path, 'wb') as f:
+            f.truncate(total)
+        save_partial_state(state_path, state)
+
+    cdisp = probe.get('content_disposition')
+    if cdisp:
+        mt = re.search(r'filename\*?="?([^";]+)', cdisp)
+        if mt:
+            state['fname_hint'] = mt.group(1).strip('"').strip() or None
+
+    validator = probe['etag'] or probe['last_modified']
+    progress.total = total
+    progress.done = sum(seg[2] for seg in state['segments'])
+    tasks = [
+        asyncio.ensure_future(_fetch_segment(session, file_url, headers, validator, part_path,
+                                             seg, state, state_path, buffer_size, proxy,
+                                             progress))
+        for seg in state['segments']
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # Stop the sibling segments; their progress is already in the sidecar.
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        save_partial_state(state_path, state)
+        raise
+
+    # Each segment was checked against the validators; verify every range
+    # also arrived in full and the file has the advertised size.
+    missing = [seg for seg in state['segments'] if seg[2] != seg[1] - seg[0] + 1]
+    if missing or os.path.getsize(part_path) != total:
+        raise IOError(f"Segmented download of {file_url} is incomplete")
+    return state['fname_hint']
+
+# ------------------------------------------------------------------------------
+# Transfer Progress
+# download_file updates a TransferProgress in place instead of calling back
+# per chunk, so a UI polls a TransferTracker at its own pace however fast
+# the chunks arrive.
+PROGRESS_INTERVAL = 0.5       # seconds between progress updates in the UI
+PROGRESS_TABLE_ROWS = 25
+ACTIVE_TRANSFER_STATES = ("checking", "downloading", "retrying")
+FINISHED_TRANSFER_STATES = ("done", "stored", "unchanged", "failed")
+
+class TransferProgress:
+    """Live state of one file's transfer."""
+    def __init__(self, file_info, total=None):
+        self.filename = file_info['filename']
+        self.url = file_info['url']
+        self.state = "queued"
+        self.total = total
+        self.done = 0          # bytes of the file on disk; a resumed transfer starts above 0
+        self.received = 0      # bytes received in this run, which the rate is based on
+        self.attempt = 0
+        self.path = None
+        self.started = None
+        self.finished = None
+
+    def begin(self, state):
+        if self.started is None:
+            self.started = time.monotonic()
+        self.state = state
+
+    def add(self, nbytes):
+        self.done += nbytes
+        self.received += nbytes
+
+    def finish(self, state, path=None):
+        self.state = state
+        self.path = path
+        self.finished = time.monotonic()
+        if path and os.path.exists(path):
+            self.done = self.total = os.path.getsize(path)
+
+    def rate(self):
+        """Bytes per second received so far (None before the transfer starts)."""
+        if self.started is None:
+            return None
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.received / elapsed if elapsed > 0 else None
+
+    def eta(self):
+        rate = self.rate()
+        if self.state != "downloading" or not rate or self.total is None:
+            return None
+        return max(0.0, (self.total - self.done) / rate)
+
+class TransferTracker:
+    """TransferProgress of every file in a batch, by file id (or URL)."""
+    def __init__(self, file_list, probe_cache=None):
+        self.items = OrderedDict()
+        self.started = time.monotonic()
+        for fi in file_list:
+            # Sizes seen during analysis give queued files a total up front.
+            probe = probe_cache.peek(fi['url']) if probe_cache is not None else None
+            total = probe['content_length'] if probe else None
+            self.items[fi.get('id') or fi['url']] = TransferProgress(fi, total)
+
+    def get(self, file_info):
+        return self.items.get(file_info.get('id') or file_info['url'])
+
+    def counts(self):
+        counts = {}
+        for p in self.items.values():
+            counts[p.state] = counts.get(p.state, 0) + 1
+        return counts
+
+    def summary(self):
+        """One line: files finished, bytes, overall rate and ETA."""
+        progress = list(self.items.values())
+        counts = self.counts()
+        finished = sum(counts.get(state, 0) for state in FINISHED_TRANSFER_STATES)
+        done = sum(p.done for p in progress)
+        known = [p.total for p in progress if p.total is not None]
+        received = sum(p.received for p in progress)
+        elapsed = time.monotonic() - self.started
+        rate = received / elapsed if elapsed > 0 else 0
+        parts = [f"{finished}/{len(progress)} files"]
+        if known and len(known) == len(progress):
+            parts.append(f"{sizeof_fmt(done)} of {sizeof_fmt(sum(known))}")
+        else:
+            parts.append(f"{sizeof_fmt(done)}")
+        parts.append(f"{sizeof_fmt(rate)}/s")
+        remaining = sum(p.total - p.done for p in progress
+                        if p.total is not None and p.state not in FINISHED_TRANSFER_STATES)
+        if rate and remaining and finished < len(progress):
+            parts.append(f"ETA {format_duration(remaining / rate)}")
+        states = ", ".join(f"{n} {state}" for state, n in counts.items())
+        return " | ".join(parts) + f" ({states})"
+
+    def table(self, max_rows=PROGRESS_TABLE_ROWS):
+        """Markdown table: active transfers first, then failures, then finished and queued."""
+        order = {"downloading": 0, "retrying": 0, "checking": 0, "failed": 1, "done": 2,
+                 "stored": 2, "unchanged": 2, "queued": 3}
+        rows = sorted(self.items.values(), key=lambda p: order.get(p.state, 3))
+        lines = ["| File | State | Progress | Rate | ETA |", "|---|---|---|---|---|"]
+        for p in rows[:max_rows]:
+            if p.total:
+                amount = f"{sizeof_fmt(p.done)} / {sizeof_fmt(p.total)} ({100 * p.done / p.total:.0f}%)"
+            else:
+                amount = sizeof_fmt(p.done) if p.done else "-"
+            # Finished rows show their average rate; waits make a live one misleading.
+            rate = p.rate() if p.state in ("downloading", "done") else None
+            eta = p.eta()
+            state = p.state if p.attempt <= 1 else f"{p.state} (attempt {p.attempt})"
+            name = p.filename.replace("|", "\\|")
+            lines.append(f"| {name} | {state} | {amount} | "
+                         f"{sizeof_fmt(rate) + '/s' if rate else '-'} | "
+                         f"{format_duration(eta) if eta is not None else '-'} |")
+        if len(rows) > max_rows:
+            lines.append(f"| … {len(rows) - max_rows} more | | | | |")
+        return "\n".join(lines)
+
+def format_duration(seconds):
+    if seconds < 1:
+        return "<1s"
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+async def poll_task(task, interval=PROGRESS_INTERVAL):
+    """Yield every `interval` seconds while `task` runs; returns once it is done."""
+    while True:
+        done, _ = await asyncio.wait([task], timeout=interval)
+        if done:
+            return
+        yield
+
+async def stream_transfers(task, tracker, label, interval=PROGRESS_INTERVAL):
+    """
+    (status line, progress table) every `interval` seconds while the
+    transfer `task` runs. The task is cancelled if the stream is abandoned.
+    """
+    try:
+        async for _ in poll_task(task, interval):
+            yield f"{label}: {tracker.summary()}", tracker.table()
+    finally:
+        if not task.done():
+            task.cancel()
+
+async def download_file(file_info, save_dir, session, referer,
+                        buffer_size=DEFAULT_BUFFER_SIZE, proxy=None,
+                        retries=DEFAULT_DOWNLOAD_RETRIES, segments=DEFAULT_SEGMENTS,
+                        segment_threshold=DEFAULT_SEGMENT_THRESHOLD, probe_cache=None,
+                        store=None, limiter=None, progress=None):
+    """
+    Stream `file_info['url']` into `save_dir` using the aiohttp `session`.
+    The body is written in `buffer_size` chunks to a partial file that is
+    renamed into place once complete, so memory use does not grow with the
+    file size. Interrupted transfers keep their partial file plus a small
+    JSON state record, and later attempts (or later runs) resume with a
+    Range request when the server's validators still match.
+    Files of at least `segment_threshold` bytes on servers advertising
+    `Accept-Ranges: bytes` are fetched as `segments` parallel ranges.
+    With a DownloadStore, a URL whose stored copy still matches the
+    server's validators is linked into place without a transfer, and new
+    content is kept once in the store however many URLs serve it.
+    Each attempt is paced by `limiter` (a RateLimiter) when given, and a
+    429/503 answer is retried after the server's Retry-After.
+    `progress` (a TransferProgress) is kept up to date while it runs.
+    Returns the saved path, or None on failure.
+    """
+    file_url = file_info['url']
+    fname = file_info['filename']
+    started = time.monotonic()
+    if progress is None:
+        progress = TransferProgress(file_info)
+    progress.begin("checking")
+
+    def finished(path, outcome):
+        METRICS.observe("stage_seconds", time.monotonic() - started, stage="download")
+        METRICS.inc("stage_total", stage="download", outcome="error" if path is None else "ok")
+        METRICS.inc("downloads_total", outcome=outcome)
+        progress.finish("done" if outcome == "ok" else outcome, path)
+        return path
+
+    os.makedirs(save_dir, exist_ok=True)
+    part_path, state_path = partial_paths(save_dir, file_url, fname)
+    if store is not None and not store.can_link(save_dir):
+        # On another filesystem every file would be written, and kept, twice.
+        store = None
+
+    headers = {
+        'Accept-Language': 'en-US,en;q=0.9',
+        'Accept-Encoding': 'identity',
+        'Referer': referer
+    }
+    record = None
+    if store is not None:
+        try:
+            record = store.lookup(file_url)
+        except sqlite3.Error as e:
+            logger.error(f"Download store lookup failed for {file_url}: {e}")
+    probe = None
+    if segments > 1 or record:
+        if probe_cache is not None:
+            # Reuses the HEAD already made during analysis when there was one.
+            probe = await probe_cache.get(
+                file_url, lambda u: head_probe(session, u, headers=headers, proxy=proxy)
+            )
+        else:
+            probe = await head_probe(session, file_url, headers=headers, proxy=proxy)
+    if record and store_record_fresh(record, probe):
+        if "drive.google.com" in file_url.lower() and record['filename']:
+            fname = record['filename']
+        try:
+            path = await store.place(record['sha256'], save_dir, fname)
+        except OSError as e:
+            logger.error(f"Could not place stored copy of {file_url}: {e}")
+            return finished(None, "failed")
+        logger.info(f"Already stored, not re-downloaded: {file_url} -> {path}")
+        return finished(path, "stored")
+    segmented = use_segmented(probe, segments, segment_threshold)
+    if probe and probe['content_length'] is not None:
+        progress.total = probe['content_length']
+
+    for attempt in range(1, retries + 1):
+        retry_after = None
+        progress.attempt = attempt
+        if limiter is not None:
+            await limiter.acquire(file_url)
+        progress.state = "downloading"
+        try:
+            with METRICS.stage("transfer"):
+                if segmented:
+                    fname_hint = await _transfer_segmented(
+                        session, file_url, headers, probe, part_path, state_path,
+                        segments, buffer_size, proxy, progress
+                    )
+                else:
+                    fname_hint = await _transfer_once(
+                        session, file_url, headers, part_path, state_path, buffer_size, proxy,
+                        progress
+                    )
+            break
+        except PermissionError as e:
+            logger.error(str(e))
+            return finished(None, "failed")
+        except aiohttp.ClientResponseError as e:
+            logger.error(f"Failed to download {file_url}: Status {e.status}")
+            if e.status in RETRY_STATUSES:
+                retry_after = parse_retry_after((e.headers or {}).get('retry-after'))
+            elif e.status < 500:
+                return finished(None, "failed")
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout downloading {file_url} (attempt {attempt}/{retries})")
+        except ValueError as e:
+            logger.error(str(e))
+            remove_quietly(part_path, state_path)
+            # Ranges are not reliable here; fall back to a single stream.
+            segmented = False
+        except Exception as e:
+            logger.error(f"Error downloading {file_url} (attempt {attempt}/{retries}): {e}")
+        if attempt < retries:
+            progress.state = "retrying"
+            if retry_after is not None and limiter is not None:
+                # The next acquire() waits it out, along with other requests to the host.
+                limiter.defer(file_url, retry_after)
+            else:
+                await asyncio.sleep(retry_after if retry_after is not None else min(2 ** attempt, 30))
+    else:
+        # Partial bytes stay on disk for the next run to resume.
+        return finished(None, "failed")
+
+    # If it's Google Drive, refine filename
+    if "drive.google.com" in file_url.lower() and fname_hint:
+        fname = fname_hint
+
+    if store is not None:
+        state = load_partial_state(state_path) or {}
+        try:
+            with METRICS.stage("store_ingest"):
+                sha256, size = await store.ingest(part_path)
+            store.record(file_url, sha256, size, etag=state.get('etag'),
+                         last_modified=state.get('last_modified'), filename=fname)
+            path = await store.place(sha256, save_dir, fname)
+        except (OSError, sqlite3.Error) as e:
+            logger.error(f"Could not add {file_url} to the store: {e}")
+            return finished(None, "failed")
+        remove_quietly(state_path)
+        logger.info(f"Downloaded: {path}")
+        return finished(path, "ok")
+
+    # Pick the name only now, with no await before the rename,
+    # so concurrent downloads of the same name cannot collide.
+    path = unique_path(save_dir, fname)
+    try:
+        os.replace(part_path, path)
+    except OSError as e:
+        logger.error(f"Could not save {file_url} as {path}: {e}")
+        return finished(None, "failed")
+    remove_quietly(state_path)
+    logger.info(f"Downloaded: {path}")
+    return finished(path, "ok")
+
+# ------------------------------------------------------------------------------
+# Persistent Download Store
+# Completed downloads are kept once per distinct content under
+# objects/<sha256[:2]>/<sha256>, and a SQLite index maps each URL to the
+# content it last produced plus the validators it was served with. Files
+# in the download folder are hard links to those objects (copies where the
+# filesystem cannot link), so re-running a job, or fetching the same bytes
+# from another URL, costs no extra transfer or disk space.
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser("~"), ".advanced_search", "store")
+HASH_CHUNK_SIZE = 1024 * 1024
+STORE_DB_TIMEOUT = 30
+# Objects are shared by every file linked to them, so nobody may edit one in place.
+STORE_OBJECT_MODE = 0o444
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class DownloadStore:
+    """Content-addressed file store with a persistent URL index."""
+
+    def __init__(self, root=DEFAULT_STORE_DIR):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(root, "index.sqlite3"), timeout=STORE_DB_TIMEOUT,
+                                  check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        # Batch runs and queue workers may share one store from several processes.
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " url TEXT PRIMARY KEY, sha256 TEXT NOT NULL, size INTEGER NOT NULL,"
+                " etag TEXT, last_modified TEXT, filename TEXT, fetched_at REAL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files(sha256)")
+            # What each sync run last left in a folder for a given source page.
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS mirror ("
+                " directory TEXT NOT NULL, source TEXT NOT NULL, url TEXT NOT NULL,"
+                " path TEXT NOT NULL, sha256 TEXT, etag TEXT, last_modified TEXT, synced_at REAL,"
+                " PRIMARY KEY (directory, source, url))"
+            )
+
+    def close(self):
+        self.db.close()
+
+    def object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+    def can_link(self, save_dir):
+        """True if files in `save_dir` can be hard links to the store's objects."""
+        try:
+            return os.stat(save_dir).st_dev == os.stat(self.objects_dir).st_dev
+        except OSError:
+            return False
+
+    def has_object(self, sha256, size=None):
+        try:
+            return size is None or os.path.getsize(self.object_path(sha256)) == size
+        except OSError:
+            return False
+
+    def lookup(self, url):
+        """The index record for `url`, or None if unknown or its object is gone."""
+        row = self.db.execute("SELECT * FROM files WHERE url = ?", (url,)).fetchone()
+        if row is None or not self.has_object(row['sha256'], row['size']):
+            return None
+        return dict(row)
+
+    def record(self, url, sha256, size, etag=None, last_modified=None, filename=None):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files"
+                " (url, sha256, size, etag, last_modified, filename, fetched_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, sha256, size, etag, last_modified, filename, time.time())
+            )
+
+    def release(self, url):
+        """
+        Drop `url` and its object from the store once no file outside the
+        store links to that object. Returns True if the object was deleted.
+        """
+        row = self.db.execute("SELECT sha256 FROM files WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return False
+        target = self.object_path(row['sha256'])
+        try:
+            if os.stat(target).st_nlink > 1:
+                return False
+        except OSError:
+            pass
+        remove_quietly(target)
+        with self.db:
+            self.db.execute("DELETE FROM files WHERE sha256 = ?", (row['sha256'],))
+        return True
+
+    def release_object(self, sha256):
+        """
+        Delete the object `sha256` if no URL in the index maps to it any
+        more and no file outside the store links to it. Returns True if it
+        was deleted.
+        """
+        if self.db.execute("SELECT 1 FROM files WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone():
+            return False
+        target = self.object_path(sha256)
+        try:
+            if os.stat(target).st_nlink > 1:
+                return False
+        except OSError:
+            return False
+        remove_quietly(target)
+        return True
+
+    def mirror_entries(self, directory, source):
+        """url -> mirror record for everything synced into `directory` from `source`."""
+        rows = self.db.execute(
+            "SELECT * FROM mirror WHERE directory = ? AND source = ?", (directory, source)
+        ).fetchall()
+        return {row['url']: dict(row) for row in rows}
+
+    def mirror_record(self, directory, source, url, path, sha256=None,
+                      etag=None, last_modified=None):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO mirror"
+                " (directory, source, url, path, sha256, etag, last_modified, synced_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (directory, source, url, path, sha256, etag, last_modified, time.time())
+            )
+
+    def mirror_forget(self, directory, source, url):
+        with self.db:
+            self.db.execute(
+                "DELETE FROM mirror WHERE directory = ? AND source = ? AND url = ?",
+                (directory, source, url)
+            )
+
+    async def ingest(self, path):
+        """
+        Move the finished file at `path` into the store and return its
+        (sha256, size). If the content is already stored, `path` is
+        simply removed.
+        """
+        loop = asyncio.get_event_loop()
+        sha256 = await loop.run_in_executor(None, sha256_file, path)
+        size = os.path.getsize(path)
+        target = self.object_path(sha256)
+        if self.has_object(sha256, size):
+            remove_quietly(path)
+            return sha256, size
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.replace(path, target)
+        except OSError:
+            # Store on another filesystem: copy, then publish atomically.
+            tmp = f"{target}.{os.getpid()}.tmp"
+            await loop.run_in_executor(None, shutil.copyfile, path, tmp)
+            os.replace(tmp, target)
+            remove_quietly(path)
+        os.chmod(target, STORE_OBJECT_MODE)
+        return sha256, size
+
+    async def place(self, sha256, save_dir, fname):
+        """
+        Make the object `sha256` available as `fname` in `save_dir` and
+        return the path. A file already there with the same content is
+        reused rather than duplicated as `name(1)`.
+        """
+        source = self.object_path(sha256)
+        existing = os.path.join(save_dir, fname)
+        if os.path.exists(existing):
+            try:
+                if os.path.samefile(existing, source):
+                    return existing
+            except OSError:
+                pass
+        path = unique_path(save_dir, fname)
+        try:
+            os.link(source, path)
+        except OSError:
+            # Claim the name before the first await so no concurrent place() takes it.
+            open(path, 'xb').close()
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, shutil.copyfile, source, path)
+        return path
+
+def store_record_fresh(record, probe):
+    """True if `probe` shows the server still serves what `record` stored."""
+    if not probe_ok(probe):
+        return False
+    if probe['content_length'] is not None and probe['content_length'] != record['size']:
+        return False
+    if record['etag'] and probe['etag']:
+        return record['etag'] == probe['etag']
+    if record['last_modified'] and probe['last_modified']:
+        return record['last_modified'] == probe['last_modified']
+    # No validator to compare: the content may have changed.
+    return False
+
+async def revalidate(session, url, etag, last_modified, headers=None, proxy=None, limiter=None):
+    """
+    Ask the server whether `url` still matches the stored validators.
+    Returns True (unchanged), False (changed) or None if the check failed.
+    Only a 304, or a response carrying the same ETag, counts as unchanged;
+    a 200 body is abandoned unread and fetched by the normal download path.
+    """
+    if not (etag or last_modified):
+        return False
+    req_headers = dict(headers or {})
+    if etag:
+        req_headers['If-None-Match'] = etag
+    if last_modified:
+        req_headers['If-Modified-Since'] = last_modified
+    if limiter is not None:
+        await limiter.acquire(url)
+    try:
+        async with session.get(url, headers=req_headers, proxy=proxy,
+                               timeout=aiohttp.ClientTimeout(total=30)) as resp:
+            if resp.status == 304:
+                return True
+            if resp.status >= 400:
+                logger.error(f"Revalidation of {url} failed: Status {resp.status}")
+                return None
+            return bool(etag) and resp.headers.get('etag') == etag
+    except Exception as e:
+        logger.error(f"Revalidation of {url} failed: {e}")
+        return None
+
+SYNC_STATES = ("new", "changed", "unchanged", "removed", "failed")
+
+def format_sync_summary(summary):
+    return ", ".join(f"{len(summary[k])} {k}" for k in SYNC_STATES)
+
+# ------------------------------------------------------------------------------
+# Concurrent Transfer Scheduling
+DEFAULT_MAX_CONCURRENT_DOWNLOADS = 8
+DEFAULT_PER_HOST_DOWNLOADS = 3
+
+class TransferScheduler:
+    """
+    Runs transfers concurrently under a global cap and a per-host cap.
+    Results are yielded as each transfer finishes, not in submission order.
+    """
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+                 per_host=DEFAULT_PER_HOST_DOWNLOADS):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.per_host = max(1, int(per_host))
+        self._global = asyncio.Semaphore(self.max_concurrent)
+        self._hosts = {}
+
+    def _host_semaphore(self, url):
+        host = urlparse(url).netloc.lower()
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.per_host)
+        return self._hosts[host]
+
+    @contextlib.asynccontextmanager
+    async def extra_host_slots(self, url, wanted):
+        """
+        For a transfer already holding one of `url`'s host slots that could
+        use more connections: take up to `wanted` further host slots, each
+        with a global slot, only if both are free and nobody waits for
+        them. Yields how many were taken.
+        """
+        sem = self._host_semaphore(url)
+        taken = 0
+        try:
+            while taken < wanted and not sem.locked() and not self._global.locked():
+                # Neither acquire waits: both semaphores have a free slot.
+                await sem.acquire()
+                await self._global.acquire()
+                taken += 1
+            yield taken
+        finally:
+            for _ in range(taken):
+                self._global.release()
+                sem.release()
+
+    async def _run_one(self, item, url, transfer):
+        # Take the host slot first so a busy host never holds global slots
+        # that other hosts could be using.
+        async with self._host_semaphore(url):
+            async with self._global:
+                return item, await transfer(item)
+
+    async def run(self, items, transfer, url_of=lambda item: item['url']):
+        """
+        Async generator of (item, result) pairs, in completion order.
+        `transfer` is a coroutine function taking one item.
+        """
+        tasks = [
+            asyncio.ensure_future(self._run_one(item, url_of(item), transfer))
+            for item in items
+        ]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield await fut
+        finally:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+            # Wait for them to unwind, so no transfer outlives the generator.
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+# ------------------------------------------------------------------------------
+# Lightweight HTTP Page Fetching (no browser)
+# Static pages (directory indexes, plain HTML) are fetched and parsed with the
+# pooled aiohttp client; the browser is only used when the page looks
+# script-rendered or the plain fetch fails or is blocked.
+FETCH_MODES = ("auto", "http", "browser")
+STATIC_PAGE_MAX_BYTES = 20 * 1024 * 1024
+PAGE_TRUNCATED_REASON = "page larger than the plain-HTTP size cap"
+STATIC_PAGE_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=15)
+HTTP_POOL_LIMIT = 64
+HTTP_POOL_LIMIT_PER_HOST = 8
+
+# Bot walls and challenge pages served to non-browser clients.
+BLOCKED_PAGE_MARKERS = (
+    'cf-browser-verification', 'cf-challenge', 'challenge-platform',
+    '<title>just a moment', 'attention required! | cloudflare',
+    'g-recaptcha', 'hcaptcha', 'px-captcha', 'distil_r_captcha',
+)
+# Mount points and globals of client-side rendered apps.
+SCRIPT_RENDERED_MARKERS = (
+    '<div id="root"></div>', '<div id="app"></div>', '<div id="__next"',
+    '__next_data__', 'window.__nuxt__', 'ng-app', 'data-reactroot',
+    'you need to enable javascript', 'please enable javascript',
+)
+
+class HttpResponse:
+    """The subset of Playwright's APIResponse interface the helpers use."""
+    def __init__(self, status, headers, body=b''):
+        self.status = status
+        self.ok = 200 <= status < 300
+        self.headers = {k.lower(): v for k, v in headers.items()}
+        self._body = body
+
+    async def body(self):
+        return self._body
+
+class HttpRequestContext:
+    """aiohttp-backed stand-in for Playwright's `page.request`."""
+    def __init__(self, session, proxy=None):
+        self.session = session
+        self.proxy = proxy
+
+    @staticmethod
+    def _timeout(timeout_ms):
+        return aiohttp.ClientTimeout(total=timeout_ms / 1000.0 if timeout_ms else 30)
+
+    async def head(self, url, headers=None, timeout=None):
+        async with self.session.head(url, headers=headers, proxy=self.proxy,
+                                     allow_redirects=True, timeout=self._timeout(timeout)) as resp:
+            return HttpResponse(resp.status, resp.headers)
+
+    async def get(self, url, headers=None, timeout=None):
+        async with self.session.get(url, headers=headers, proxy=self.proxy,
+                                    timeout=self._timeout(timeout)) as resp:
+            return HttpResponse(resp.status, resp.headers, await resp.read())
+
+class HttpPage:
+    """Lets the link classifiers, which only use `page.request`, run without a browser."""
+    def __init__(self, session, proxy=None):
+        self.request = HttpRequestContext(session, proxy)
+
+async def fetch_static_page(session, url, proxy=None):
+    """
+    GET `url` without a browser. Returns a dict with status, final url,
+    content_type, html (None for non-HTML bodies) and truncated (the page
+    was longer than STATIC_PAGE_MAX_BYTES), or None on errors.
+    """
+    try:
+        async with session.get(url, proxy=proxy, timeout=STATIC_PAGE_TIMEOUT,
+                               headers={'Accept': 'text/html,application/xhtml+xml,*/*;q=0.8'}) as resp:
+            ctype = (resp.headers.get('content-type') or '').split(';')[0].strip().lower()
+            html = None
+            truncated = False
+            if 'html' in ctype:
+                # read(n) returns whatever is buffered, so gather chunks up to the cap.
+                raw = bytearray()
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    raw += chunk
+                    if len(raw) > STATIC_PAGE_MAX_BYTES:
+                        del raw[STATIC_PAGE_MAX_BYTES:]
+                        truncated = True
+                        logger.info(f"{url} is larger than {sizeof_fmt(STATIC_PAGE_MAX_BYTES)}; "
+                                    f"read only the first {sizeof_fmt(STATIC_PAGE_MAX_BYTES)}")
+                        break
+                html = bytes(raw).decode(resp.get_encoding() if resp.charset else 'utf-8', errors='replace')
+            return {'status': resp.status, 'url': str(resp.url), 'content_type': ctype, 'html': html,
+                    'truncated': truncated}
+    except Exception as e:
+        logger.info(f"Plain HTTP fetch failed for {url}: {e}")
+        return None
+
+def browser_needed_reason(fetched):
+    """
+    Why the plainly fetched page is not good enough (a short string), or
+    None when its HTML can be analyzed as-is.
+    """
+    if fetched is None:
+        return "plain fetch failed"
+    if fetched['status'] >= 400:
+        return f"HTTP {fetched['status']}"
+    if fetched['html'] is None:
+        return f"not HTML ({fetched['content_type'] or 'unknown type'})"
+    lower = fetched['html'].lower()
+    if any(marker in lower for marker in BLOCKED_PAGE_MARKERS):
+        return "challenge page"
+    anchors = lower.count('<a ')
+    scripts = lower.count('<script')
+    if anchors == 0 and scripts > 0:
+        return "no anchors, scripts present"
+    if anchors < 5 and any(marker in lower for marker in SCRIPT_RENDERED_MARKERS):
+        return "script-rendered app"
+    if fetched.get('truncated'):
+        return PAGE_TRUNCATED_REASON
+    return None
 
 # ------------------------------------------------------------------------------
-# If packaging with PyInstaller or similar:
-if getattr(sys, 'frozen', False):
-    bundle_dir = sys._MEIPASS
-else:
-    bundle_dir = os.path.dirname(os.path.abspath(__file__))
+# Shared Browser Pool
+# One Playwright driver and a few Chromium processes per Python process.
+# Managers lease an isolated context + page instead of launching a browser.
+POOL_MAX_BROWSERS = 2
+POOL_MAX_CONTEXTS = 16
+POOL_RECYCLE_AFTER = 50       # contexts handed out before a browser is replaced
+POOL_IDLE_TIMEOUT = 600       # seconds before an unused lease or browser is closed
+POOL_REAP_INTERVAL = 30
+MANAGER_IDLE_TIMEOUT = POOL_IDLE_TIMEOUT  # seconds before an unused UI manager closes
 
-# ------------------------------------------------------------------------------
-# Logging Setup
-logging.basicConfig(
-    filename='advanced_download_log.txt',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger()
+class BrowserLease:
+    """An isolated context and page borrowed from the BrowserPool."""
+    def __init__(self, pool, entry, context, page):
+        self.pool = pool
+        self.entry = entry
+        self.context = context
+        self.page = page
+        self.closed = False
+        self.busy = 0
+        self.last_used = time.monotonic()
 
-# ------------------------------------------------------------------------------
-# User-Agent Rotations
-USER_AGENTS = [
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
-    'Chrome/115.0.0.0 Safari/537.36',
-    'Mozilla/5.0 (Macintosh; Intel Mac OS X 12_6_3) AppleWebKit/605.1.15 (KHTML, like Gecko) '
-    'Version/16.4 Safari/605.1.15',
-    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) '
-    'Chrome/115.0.0.0 Safari/537.36',
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:115.0) Gecko/20100101 Firefox/115.0',
-]
+    def touch(self):
+        self.last_used = time.monotonic()
 
-def get_random_user_agent():
-    return random.choice(USER_AGENTS)
+    async def release(self):
+        await self.pool.release(self)
 
-def sizeof_fmt(num, suffix='B'):
-    """Convert a file size to a human-readable string."""
-    for unit in ['', 'K', 'M', 'G', 'T', 'P', 'E', 'Z']:
-        if abs(num) < 1024.0:
-            return f"{num:3.1f}{unit}{suffix}"
-        num /= 1024.0
-    return f"{num:.1f}Y{suffix}"
+class BrowserPool:
+    """
+    Process-wide pool of Chromium browsers (one per proxy setting) handing
+    out contexts. Caps browsers and contexts, retires a browser after
+    `recycle_after` contexts, and closes leases and browsers left idle for
+    `idle_timeout` seconds (e.g. UI sessions that were simply abandoned).
+    """
+    def __init__(self, max_browsers=POOL_MAX_BROWSERS, max_contexts=POOL_MAX_CONTEXTS,
+                 recycle_after=POOL_RECYCLE_AFTER, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.max_browsers = max_browsers
+        self.max_contexts = max_contexts
+        self.recycle_after = recycle_after
+        self.idle_timeout = idle_timeout
+        self._playwright = None
+        self._browsers = []   # dicts: proxy, browser, uses, active, last_used
+        self._leases = set()
+        self._active = 0
+        self._waiting = 0
+        self._cond = None
+        self._reaper = None
+        self._loop = None
 
-# Known MIME types we might want to treat as downloadable files:
-KNOWN_MIME_TYPES = {
-    "application/pdf": ".pdf",
-    "application/zip": ".zip",
-    "application/x-rar-compressed": ".rar",
-    "application/x-7z-compressed": ".7z",
-    "application/msword": ".doc",
-    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
-    "audio/mpeg": ".mp3",
-    "video/mp4": ".mp4",
-    "image/png": ".png",
-    "image/jpeg": ".jpg",
-    "image/gif": ".gif",
-    # add more if you wish
-}
+    def _bind(self, loop):
+        """Start over on event loop `loop`; what an earlier loop opened cannot be used."""
+        if self._browsers or self._leases:
+            logger.error("Browser pool reused on a new event loop; forgetting its browsers")
+        self._loop = loop
+        self._cond = asyncio.Condition()
+        self._playwright = None
+        self._browsers = []
+        self._leases = set()
+        self._active = 0
+        self._waiting = 0
+        self._reaper = None
 
-# ------------------------------------------------------------------------------
-# Playwright Helper Functions
-async def human_like_scroll(page):
-    scroll_height = await page.evaluate('document.body.scrollHeight')
-    viewport_height = await page.evaluate('window.innerHeight')
-    current_scroll = 0
-    while current_scroll < scroll_height:
-        await page.evaluate(f'window.scrollTo(0, {current_scroll})')
-        await asyncio.sleep(random.uniform(0.5, 1.5))
-        current_scroll += viewport_height * random.uniform(0.5, 1.5)
-        scroll_height = await page.evaluate('document.body.scrollHeight')
+    def _drop_disconnected(self):
+        """
+        Stop counting browsers that went away (crashed or killed) against
+        `max_browsers`; their leases still count as contexts until released.
+        """
+        for entry in [b for b in self._browsers if not b['browser'].is_connected()]:
+            self._browsers.remove(entry)
+            logger.error(f"Pooled browser disconnected with {entry['active']} contexts open")
 
-async def human_like_interactions(page):
-    await page.mouse.move(random.randint(0, 1000), random.randint(0, 1000))
-    await asyncio.sleep(random.uniform(0.5, 1.5))
-    await page.mouse.click(random.randint(0, 1000), random.randint(0, 1000))
-    await asyncio.sleep(random.uniform(0.5, 1.5))
-    await page.evaluate("window.scrollBy(0, window.innerHeight / 2)")
-    await asyncio.sleep(random.uniform(0.5, 1.5))
+    def stats(self):
+        return {
+            'browsers': len(self._browsers),
+            'contexts': self._active,
+            'waiting': self._waiting,
+            'max_browsers': self.max_browsers,
+            'max_contexts': self.max_contexts,
+        }
 
-async def get_file_size(url, page):
-    """Returns a human-readable file size string or 'Unknown Size' if not available."""
-    try:
-        response = await page.request.head(url)
-        length = response.headers.get('Content-Length', None)
-        if length:
-            return sizeof_fmt(int(length))
-        else:
-            return "Unknown Size"
-    except Exception:
-        return "Unknown Size"
+    def _usable(self, entry, proxy):
+        return (entry['proxy'] == proxy and entry['uses'] < self.recycle_after
+                and entry['browser'].is_connected())
 
-async def get_pdf_metadata(url, page):
-    """Fetch PDF from the given URL and extract minimal metadata."""
-    try:
-        resp = await page.request.get(url, timeout=15000)
-        if resp.ok:
-            content = await resp.body()
-            pdf = BytesIO(content)
-            reader = PdfReader(pdf)
-            return {
-                'Title': reader.metadata.title if reader.metadata.title else 'N/A',
-                'Author': reader.metadata.author if reader.metadata.author else 'N/A',
-                'Pages': len(reader.pages),
-            }
-        else:
-            return {}
-    except Exception:
-        return {}
+    async def _launch(self, proxy):
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        opts = {"headless": True}
+        if proxy:
+            opts["proxy"] = {"server": proxy}
+        browser = await self._playwright.chromium.launch(**opts)
+        entry = {'proxy': proxy, 'browser': browser, 'uses': 0, 'active': 0,
+                 'last_used': time.monotonic()}
+        self._browsers.append(entry)
+        logger.info(f"Browser pool launched a browser (proxy={proxy}), {len(self._browsers)} open")
+        return entry
 
-# ------------------------------------------------------------------------------
-# Bing Search & File Extraction
-async def perform_bing_search(query, num_results, page):
-    bing_url = f"https://www.bing.com/search?q={query.replace(' ', '+')}&count={num_results}"
-    try:
-        await page.goto(bing_url, timeout=30000)
-        await page.wait_for_selector('li.b_algo', timeout=30000)
-        await human_like_scroll(page)
+    async def _close_browser(self, entry):
+        if entry in self._browsers:
+            self._browsers.remove(entry)
+        try:
+            await entry['browser'].close()
+        except Exception as e:
+            logger.error(f"Error closing pooled browser: {e}")
 
-        html = await page.content()
-        soup = BeautifulSoup(html, 'html.parser')
-        results = soup.find_all('li', class_='b_algo')
-        urls = []
-        for r in results:
-            link = r.find('a')
-            if link and 'href' in link.attrs:
-                urls.append(link['href'])
-                if len(urls) >= num_results:
+    async def acquire(self, proxy=None, user_agent=None):
+        """Lease a fresh context and page, waiting while the pool is at capacity."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._bind(loop)
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.ensure_future(self._reap_forever())
+        waited_from = time.monotonic()
+        async with self._cond:
+            while True:
+                self._drop_disconnected()
+                entry = None
+                if self._active < self.max_contexts:
+                    entry = next((b for b in self._browsers if self._usable(b, proxy)), None)
+                    if entry is None:
+                        if len(self._browsers) >= self.max_browsers:
+                            idle = next((b for b in self._browsers if b['active'] == 0), None)
+                            if idle is not None:
+                                await self._close_browser(idle)
+                        if len(self._browsers) < self.max_browsers:
+                            entry = await self._launch(proxy)
+                if entry is not None:
                     break
-        return urls
-    except PlaywrightTimeoutError:
-        logger.error("Bing search timed out.")
-        return []
-    except Exception as e:
-        logger.error(f"Bing search error: {e}")
+                self._waiting += 1
+                try:
+                    await self._cond.wait()
+                finally:
+                    self._waiting -= 1
+            METRICS.observe("stage_seconds", time.monotonic() - waited_from, stage="pool_acquire")
+            entry['uses'] += 1
+            entry['active'] += 1
+            self._active += 1
+        try:
+            context = await entry['browser'].new_context(user_agent=user_agent)
+            page = await context.new_page()
+        except BaseException:
+            await self._returned(entry)
+            raise
+        lease = BrowserLease(self, entry, context, page)
+        self._leases.add(lease)
+        return lease
+
+    async def _returned(self, entry):
+        async with self._cond:
+            entry['active'] -= 1
+            entry['last_used'] = time.monotonic()
+            self._active -= 1
+            # Retire a well-used browser once its last context is gone.
+            if entry['active'] == 0 and entry['uses'] >= self.recycle_after:
+                await self._close_browser(entry)
+            self._cond.notify_all()
+
+    async def release(self, lease):
+        if lease.closed:
+            return
+        lease.closed = True
+        self._leases.discard(lease)
+        try:
+            await lease.context.close()
+        except Exception as e:
+            logger.error(f"Error closing pooled context: {e}")
+        await self._returned(lease.entry)
+
+    async def _reap_forever(self):
+        while True:
+            await asyncio.sleep(POOL_REAP_INTERVAL)
+            try:
+                await self.reap()
+            except Exception as e:
+                logger.error(f"Browser pool reaper error: {e}")
+
+    async def reap(self):
+        """Close leases and browsers that have been idle for too long."""
+        now = time.monotonic()
+        for lease in list(self._leases):
+            if not lease.busy and now - lease.last_used > self.idle_timeout:
+                logger.info("Browser pool evicting an idle context")
+                await self.release(lease)
+        async with self._cond:
+            self._drop_disconnected()
+            for entry in list(self._browsers):
+                if entry['active'] == 0 and now - entry['last_used'] > self.idle_timeout:
+                    await self._close_browser(entry)
+            # A dropped browser may have freed room for a waiting acquire().
+            self._cond.notify_all()
+
+    async def close(self):
+        for lease in list(self._leases):
+            await self.release(lease)
+        for entry in list(self._browsers):
+            await self._close_browser(entry)
+        if self._reaper:
+            self._reaper.cancel()
+        if self._playwright:
+            await self._playwright.stop()
+            self._playwright = None
+
+_browser_pool = None
+
+def get_browser_pool():
+    """The process-wide BrowserPool, created on first use."""
+    global _browser_pool
+    if _browser_pool is None:
+        _browser_pool = BrowserPool()
+    return _browser_pool
+
+def _browser_pool_gauges():
+    if _browser_pool is None:
         return []
+    stats = _browser_pool.stats()
+    return [(f"browser_pool_{key}", {}, stats[key])
+            for key in ('browsers', 'contexts', 'waiting', 'max_contexts')]
+
+METRICS.register_gauges(_browser_pool_gauges)
+
+# ------------------------------------------------------------------------------
+# Site Crawler
+DEFAULT_CRAWL_DEPTH = 2
+DEFAULT_CRAWL_MAX_PAGES = 200
+DEFAULT_CRAWL_CONCURRENCY = 4
+DEFAULT_CRAWL_PER_DOMAIN = 2
+
+# Links with these extensions are never treated as pages to crawl.
+NON_PAGE_EXTS = (
+    '.css', '.js', '.json', '.xml', '.rss', '.ico', '.svg', '.webp', '.woff', '.woff2',
+    '.ttf', '.eot', '.tar', '.gz', '.bz2', '.xz', '.7z', '.iso', '.dmg', '.msi',
+    '.csv', '.txt', '.doc', '.xls', '.xlsx', '.ppt', '.pptx', '.wav', '.flac', '.webm',
+)
 
-async def extract_downloadable_files(url, page, custom_ext_list):
+class VisitedSet:
     """
-    Analyze the page for direct file links, or Google Drive links, or 
-    files indicated by HEAD request checks. 
-    `custom_ext_list` is a list of additional file extensions to consider.
+    Set of URLs stored as 64-bit digests of their normalized form. Each
+    entry costs a small int rather than the whole URL string, which keeps
+    hundreds of thousands of URLs in a few tens of MB. A digest collision
+    (about 1 in 10^9 at a million URLs) only means one page is skipped.
     """
-    found_files = []
-    try:
-        await page.goto(url, timeout=30000)
-        await page.wait_for_load_state('networkidle', timeout=30000)
-        await human_like_interactions(page)
+    def __init__(self):
+        self._digests = set()
 
-        content = await page.content()
-        soup = BeautifulSoup(content, 'html.parser')
+    @staticmethod
+    def _digest(url):
+        return int.from_bytes(
+            hashlib.blake2b(normalize_url(url).encode('utf-8'), digest_size=8).digest(), 'big'
+        )
 
-        # Base file extensions we always look for:
-        default_exts = [
-            '.pdf', '.docx', '.zip', '.rar', '.exe', '.mp3',
-            '.mp4', '.avi', '.mkv', '.png', '.jpg', '.jpeg', '.gif'
-        ]
-        # Merge them with the user's custom list
-        all_exts = set(default_exts + [ext.strip().lower() for ext in custom_ext_list if ext.strip()])
+    def add(self, url):
+        """Add `url`; returns False if it was already present."""
+        d = self._digest(url)
+        if d in self._digests:
+            return False
+        self._digests.add(d)
+        return True
 
-        anchors = soup.find_all('a', href=True)
-        for a in anchors:
-            href = a['href'].strip()
-            if not href:
-                continue
+    def __contains__(self, url):
+        return self._digest(url) in self._digests
 
-            # Build the absolute URL if necessary
-            if href.startswith('http'):
-                file_url = href
-            elif href.startswith('/'):
-                parsed = urlparse(url)
-                file_url = f"{parsed.scheme}://{parsed.netloc}{href}"
-            else:
-                # Some relative or unusual link
-                parsed = urlparse(url)
-                if not parsed.scheme or not parsed.netloc:
-                    # Skip if we cannot form a valid absolute URL
-                    continue
-                base_path = parsed.path.rsplit('/', 1)[0]
-                file_url = f"{parsed.scheme}://{parsed.netloc}{base_path}/{href}"
-
-            # Check #1: Google Drive link detection
-            if "drive.google.com" in href.lower():
-                file_id = None
-                match1 = re.search(r'/file/d/([^/]+)/', href)
-                if match1:
-                    file_id = match1.group(1)
-                match2 = re.search(r'open\?id=([^&]+)', href)
-                if match2:
-                    file_id = match2.group(1)
-                match3 = re.search(r'id=([^&]+)', href)
-                if match3:
-                    file_id = match3.group(1)
-                if file_id:
-                    direct = f"https://drive.google.com/uc?export=download&id={file_id}"
-                    size_str = await get_file_size(direct, page)
-                    found_files.append({
-                        'url': direct,
-                        'filename': f"drive_file_{file_id}",
-                        'size': size_str,
-                        'metadata': {}
-                    })
-                continue
+    def __len__(self):
+        return len(self._digests)
 
-            # Check #2: Known or custom extension
-            lower_href = href.lower()
-            if any(lower_href.endswith(ext) for ext in all_exts):
-                # It's a recognized direct file link
-                size_str = await get_file_size(file_url, page)
-
-                meta = {}
-                if file_url.lower().endswith('.pdf'):
-                    meta = await get_pdf_metadata(file_url, page)
-
-                found_files.append({
-                    'url': file_url,
-                    'filename': os.path.basename(file_url.split('?')[0]),
-                    'size': size_str,
-                    'metadata': meta
-                })
-            else:
-                # Check #3: Use HEAD request to see if it's a known file by MIME type
-                try:
-                    head_resp = await page.request.head(file_url, timeout=8000)
-                    if head_resp.ok:
-                        ctype = head_resp.headers.get("Content-Type", "").lower()
-                        if ctype in KNOWN_MIME_TYPES:
-                            # We treat this as a file
-                            # If there's a content-disposition filename, we can use that;
-                            # otherwise, we'll guess from the URL
-                            cdisp = head_resp.headers.get("Content-Disposition", "")
-                            filename = os.path.basename(file_url.split('?')[0])
-                            if cdisp:
-                                mt = re.search(r'filename\*?="?([^";]+)', cdisp)
-                                if mt:
-                                    cdisp_fname = mt.group(1).strip('"').strip()
-                                    if cdisp_fname:
-                                        filename = cdisp_fname
-                            else:
-                                # If there's no extension in the URL, attach the known extension
-                                base_part, ext_part = os.path.splitext(filename)
-                                if not ext_part:
-                                    known_ext = KNOWN_MIME_TYPES[ctype]
-                                    filename = base_part + known_ext
-
-                            size_str = await get_file_size(file_url, page)
-
-                            meta = {}
-                            # PDF metadata if relevant
-                            if KNOWN_MIME_TYPES[ctype] == '.pdf':
-                                meta = await get_pdf_metadata(file_url, page)
-
-                            found_files.append({
-                                'url': file_url,
-                                'filename': filename,
-                                'size': size_str,
-                                'metadata': meta
-                            })
-                except PlaywrightTimeoutError:
-                    # skip link if HEAD request times out
-                    pass
-                except Exception:
-                    pass
-
-        return found_files
-    except PlaywrightTimeoutError:
-        logger.error(f"Timeout extracting from {url}")
-        return []
-    except Exception as e:
-        logger.error(f"Error extracting from {url}: {e}")
-        return []
+class CrawlScope:
+    """Decides which links the crawler may follow."""
+    def __init__(self, start_url, same_domain=True, path_prefix=None):
+        parsed = urlparse(start_url)
+        self.host = (parsed.hostname or '').lower()
+        self.same_domain = same_domain
+        self.path_prefix = path_prefix or None
 
-async def download_file(file_info, save_dir, page, referer):
-    file_url = file_info['url']
-    fname = file_info['filename']
-    path = os.path.join(save_dir, fname)
+    def allows(self, url):
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https'):
+            return False
+        if self.same_domain and (parsed.hostname or '').lower() != self.host:
+            return False
+        if self.path_prefix and not (parsed.path or '/').startswith(self.path_prefix):
+            return False
+        return True
 
-    base, ext = os.path.splitext(fname)
-    i = 1
-    while os.path.exists(path):
-        path = os.path.join(save_dir, f"{base}({i}){ext}")
-        i += 1
+def is_crawlable_link(href, file_url, all_exts, probe_cache):
+    """True if the link looks like another HTML page rather than a file or asset."""
+    lower_href = href.lower()
+    if lower_href.startswith(('#', 'mailto:', 'javascript:', 'tel:', 'data:')):
+        return False
+    if "drive.google.com" in lower_href:
+        return False
+    path = urlparse(file_url).path.lower()
+    if any(path.endswith(ext) for ext in all_exts) or path.endswith(NON_PAGE_EXTS):
+        return False
+    # Classification already HEAD-probed extension-less links; reuse that answer.
+    probe = probe_cache.peek(file_url) if probe_cache else None
+    if probe and probe['content_type'] and 'html' not in probe['content_type']:
+        return False
+    return True
 
-    os.makedirs(save_dir, exist_ok=True)
+# Pages analyzed at once by DownloadManager.iter_analyze_many
+DEFAULT_BATCH_PAGES = 4
 
-    try:
-        headers = {
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Referer': referer
-        }
-        await human_like_interactions(page)
-        resp = await page.request.get(file_url, headers=headers, timeout=30000)
-        if resp.status == 403:
-            logger.error(f"403 Forbidden: {file_url}")
+# Headers set on every leased browser page
+PAGE_EXTRA_HEADERS = {
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Referer': 'https://www.bing.com/'
+}
+
+# ------------------------------------------------------------------------------
+# Session-scoped Analysis Results
+class ResultStore:
+    """
+    Keeps every file discovered during a session under a stable ID derived
+    from its normalized URL, so a later download is a direct lookup rather
+    than a fresh analysis of the page.
+    """
+    def __init__(self):
+        self._files = {}    # file_id -> file_info
+        self._pages = {}    # source page URL -> [file_id, ...] from its latest analysis
+        self._outcomes = {} # source page URL -> timing and error of its latest analysis
+
+    @staticmethod
+    def file_id(url):
+        return hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()[:16]
+
+    def start_page(self, source_url):
+        """Forget the file list of an earlier analysis of `source_url`."""
+        self._pages[source_url] = []
+        self._outcomes[source_url] = {'started': time.monotonic(), 'seconds': None, 'error': None}
+
+    def finish_page(self, source_url, error=None):
+        """Record that the analysis of `source_url` ended, failing with `error` if given."""
+        outcome = self._outcomes.setdefault(source_url, {'started': time.monotonic()})
+        outcome['seconds'] = time.monotonic() - outcome['started']
+        outcome['error'] = error
+
+    def page_outcome(self, source_url):
+        """{'seconds', 'error'} of the latest analysis of `source_url`, or None."""
+        outcome = self._outcomes.get(source_url)
+        if outcome is None:
             return None
-        if not resp.ok:
-            logger.error(f"Failed to download {file_url}: Status {resp.status}")
+        return {'seconds': outcome['seconds'], 'error': outcome['error']}
+
+    def add(self, source_url, file_info):
+        """
+        Record `file_info` as found on `source_url`. Returns the stored copy
+        (with 'id' and 'source' keys), or None if the page already listed it.
+        """
+        fid = self.file_id(file_info['url'])
+        ids = self._pages.setdefault(source_url, [])
+        if fid in ids:
             return None
+        stored = dict(file_info, id=fid, source=source_url)
+        self._files[fid] = stored
+        ids.append(fid)
+        return stored
 
-        # If it's Google Drive, refine filename
-        if "drive.google.com" in file_url.lower():
-            cdisp = resp.headers.get("Content-Disposition")
-            if cdisp:
-                mt = re.search(r'filename\*?="?([^";]+)', cdisp)
-                if mt:
-                    real_fname = mt.group(1).strip('"').strip()
-                    if real_fname:
-                        path = os.path.join(save_dir, real_fname)
-                        b2, e2 = os.path.splitext(real_fname)
-                        j = 1
-                        while os.path.exists(path):
-                            path = os.path.join(save_dir, f"{b2}({j}){e2}")
-                            j += 1
-
-        data = await resp.body()
-        with open(path, 'wb') as f:
-            f.write(data)
-        logger.info(f"Downloaded: {path}")
-        return path
-    except PlaywrightTimeoutError:
-        logger.error(f"Timeout downloading {file_url}")
-        return None
-    except Exception as e:
-        logger.error(f"Error downloading {file_url}: {e}")
-        return None
+    def get(self, file_id):
+        return self._files.get(file_id)
+
+    def get_many(self, file_ids):
+        """Stored files for `file_ids`, in the given order, skipping unknown IDs."""
+        return [self._files[fid] for fid in file_ids if fid in self._files]
+
+    def files_for(self, source_url):
+        return self.get_many(self._pages.get(source_url, []))
 
 # ------------------------------------------------------------------------------
 # DownloadManager
 class DownloadManager:
-    def __init__(self, use_proxy=False, proxy=None, query=None, num_results=5):
+    def __init__(self, use_proxy=False, proxy=None, query=None, num_results=5,
+                 max_concurrent_downloads=DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+                 per_host_downloads=DEFAULT_PER_HOST_DOWNLOADS,
+                 buffer_size=DEFAULT_BUFFER_SIZE,
+                 segments=DEFAULT_SEGMENTS, segment_threshold=DEFAULT_SEGMENT_THRESHOLD,
+                 classify_concurrency=DEFAULT_CLASSIFY_CONCURRENCY, fetch_mode="auto",
+                 store_dir=DEFAULT_STORE_DIR, resource_policy=None, sniff_responses=False,
+                 profile=DEFAULT_PROFILE, rate_limiter=None,
+                 search_cache_path=DEFAULT_SEARCH_CACHE_PATH,
+                 search_cache_ttl=DEFAULT_SEARCH_CACHE_TTL):
         self.use_proxy = use_proxy
         self.proxy = proxy
         self.query = query
         self.num_results = num_results
+        self.max_concurrent_downloads = max_concurrent_downloads
+        self.per_host_downloads = per_host_downloads
+        self.buffer_size = buffer_size
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        self.classify_concurrency = classify_concurrency
+        # "auto": plain HTTP first, browser on demand; "http"/"browser": force one.
+        self.fetch_mode = fetch_mode if fetch_mode in FETCH_MODES else "auto"
+        # Persistent content-addressed store; None downloads straight to the folder.
+        self.store_dir = store_dir
+        # Subresources refused on browser pages; ResourcePolicy((), ()) loads everything.
+        self.resource_policy = resource_policy if resource_policy is not None else ResourcePolicy()
+        # Also classify network responses seen while pages load (browser analysis only).
+        self.sniff_responses = sniff_responses
+        # Bing result lists kept on disk for `search_cache_ttl` seconds; None disables.
+        self.search_cache_path = search_cache_path
+        self.search_cache_ttl = search_cache_ttl
+        # "stealth" or "throughput": page interactions and default request pacing.
+        self.profile = None
+        self.humanize = True
+        self.limiter = None
+        self.set_profile(profile, rate_limiter)
+
+        self._lease = None
+        self.user_agent = None
+        self.http = None
+        self.store = None
+        self.search_cache = None
+        self.probe_cache = ProbeCache(limiter=self.limiter)
+        self.results = ResultStore()
+        self.search_results = []
+        self._users = 0
+        self._idle_close = None
+        self._closing = None
+
+    def set_profile(self, profile, rate_limiter=None):
+        """
+        Switch to the behavior profile `profile` for the requests that follow.
+        `rate_limiter` replaces the profile's own pacing when given.
+        """
+        if profile not in BEHAVIOR_PROFILES:
+            profile = DEFAULT_PROFILE
+        if profile == self.profile and rate_limiter is None:
+            return
+        self.profile = profile
+        self.humanize = BEHAVIOR_PROFILES[profile]['humanize']
+        self.limiter = rate_limiter or RateLimiter.for_profile(profile)
+        if getattr(self, 'probe_cache', None) is not None:
+            self.probe_cache.limiter = self.limiter
+
+    @property
+    def proxy_url(self):
+        return self.proxy if self.use_proxy and self.proxy else None
 
-        self.playwright = None
-        self.browser = None
-        self.context = None
-        self.page = None
+    @property
+    def page(self):
+        """The leased browser page, or None if none is held (or it was evicted)."""
+        if self._lease is None or self._lease.closed:
+            return None
+        return self._lease.page
+
+    @property
+    def context(self):
+        if self._lease is None or self._lease.closed:
+            return None
+        return self._lease.context
 
     async def __aenter__(self):
-        self.playwright = await async_playwright().start()
-        opts = {"headless": True}
-        if self.use_proxy and self.proxy:
-            opts["proxy"] = {"server": self.proxy}
+        self.user_agent = get_random_user_agent()
+        # Pooled plain HTTP client: static page fetches, probes and file transfers
+        self.http = aiohttp.ClientSession(
+            headers={'User-Agent': self.user_agent, 'Accept-Language': 'en-US,en;q=0.9'},
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_LIMIT,
+                                           limit_per_host=HTTP_POOL_LIMIT_PER_HOST),
+            read_bufsize=self.buffer_size,
+        )
+        self._open_store()
+        if self.search_cache_path:
+            try:
+                self.search_cache = SearchCache(self.search_cache_path, self.search_cache_ttl)
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Search cache unavailable at {self.search_cache_path}: {e}")
+        # The browser is started on first use; static pages never need it.
+        if self.fetch_mode == "browser":
+            await self.ensure_browser()
+        return self
+
+    def _open_store(self):
+        if not self.store_dir:
+            return
+        try:
+            self.store = DownloadStore(self.store_dir)
+        except (OSError, sqlite3.Error) as e:
+            logger.error(f"Download store unavailable at {self.store_dir}: {e}")
+
+    def set_store(self, store_dir):
+        """Use the download store at `store_dir` (None for none) for the transfers that follow."""
+        if store_dir == self.store_dir and (self.store is not None or not store_dir):
+            return
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+        self.store_dir = store_dir
+        self._open_store()
 
-        self.browser = await self.playwright.chromium.launch(**opts)
-        self.context = await self.browser.new_context(user_agent=get_random_user_agent())
-        self.page = await self.context.new_page()
+    async def ensure_browser(self):
+        """Lease a context and page from the shared pool if none is held."""
+        if self.page is not None:
+            self._lease.touch()
+            return self.page
+        self._lease = await get_browser_pool().acquire(proxy=self.proxy_url,
+                                                       user_agent=self.user_agent)
 
         # Extra headers
-        await self.page.set_extra_http_headers({
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Referer': 'https://www.bing.com/'
-        })
-        return self
+        await self.page.set_extra_http_headers(PAGE_EXTRA_HEADERS)
+        await self.resource_policy.apply(self.context)
+        return self.page
+
+    @contextlib.asynccontextmanager
+    async def browser_page(self):
+        """Hold the leased page for the duration of a block (not evicted meanwhile)."""
+        page = await self.ensure_browser()
+        lease = self._lease
+        lease.busy += 1
+        try:
+            yield page
+        finally:
+            lease.busy -= 1
+            lease.touch()
+
+    @contextlib.asynccontextmanager
+    async def extra_page(self):
+        """Lease an additional context and page for parallel work, released afterwards."""
+        lease = await get_browser_pool().acquire(proxy=self.proxy_url, user_agent=self.user_agent)
+        lease.busy += 1
+        try:
+            await lease.page.set_extra_http_headers(PAGE_EXTRA_HEADERS)
+            await self.resource_policy.apply(lease.context)
+            yield lease.page
+        finally:
+            await lease.release()
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.browser.close()
-        await self.playwright.stop()
+        await self.close()
+
+    @contextlib.asynccontextmanager
+    async def in_use(self):
+        """
+        Hold the manager open for a block, reopening it if it was closed
+        while idle. Once no block has held it for MANAGER_IDLE_TIMEOUT
+        seconds it closes itself, so an abandoned UI session keeps no
+        connections or database handles; its results stay available.
+        """
+        if self._idle_close is not None:
+            self._idle_close.cancel()
+            self._idle_close = None
+        self._users += 1
+        try:
+            if self._closing is not None:
+                await self._closing
+                self._closing = None
+            if self.http is None or self.http.closed:
+                await self.__aenter__()
+            yield self
+        finally:
+            self._users -= 1
+            if self._users == 0:
+                self._idle_close = asyncio.get_running_loop().call_later(
+                    MANAGER_IDLE_TIMEOUT, self._close_if_idle)
+
+    def _close_if_idle(self):
+        self._idle_close = None
+        if self._users == 0:
+            logger.info("Closing a download manager left idle")
+            self._closing = asyncio.ensure_future(self.close())
+
+    async def close(self):
+        """Return the browser lease to the pool and close the HTTP client and store."""
+        if self._idle_close is not None:
+            self._idle_close.cancel()
+            self._idle_close = None
+        if self.http and not self.http.closed:
+            await self.http.close()
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+        if self.search_cache is not None:
+            self.search_cache.close()
+            self.search_cache = None
+        if self._lease is not None:
+            await self._lease.release()
+            self._lease = None
 
     async def search_bing(self):
         if not self.query:
             return []
-        return await perform_bing_search(self.query, self.num_results, self.page)
+        self.search_results = await self.fetch_search_results(self.query, self.num_results)
+        return self.search_results
+
+    async def fetch_bing_page(self, query, first):
+        """
+        One result page: plain HTTP unless forced to the browser, else an
+        extra page. Returns None if the page could not be fetched at all.
+        """
+        await self.limiter.acquire(BING_SEARCH_URL)
+        if self.fetch_mode != "browser":
+            urls = await fetch_bing_page(self.http, query, first, proxy=self.proxy_url)
+            if urls is not None:
+                return urls
+            if self.fetch_mode == "http":
+                logger.error(f"Bing page at {first} could not be read over HTTP")
+                return None
+            logger.info(f"Bing page at {first} needs the browser")
+        try:
+            # Own context per page: several result pages load at once.
+            async with self.extra_page() as page:
+                return await perform_bing_search(query, BING_PAGE_SIZE, page,
+                                                 humanize=self.humanize, first=first)
+        except Exception as e:
+            logger.error(f"Bing page at {first} failed: {e}")
+            return None
+
+    async def fetch_search_results(self, query, num_results,
+                                   concurrency=BING_PAGE_CONCURRENCY):
+        """
+        Up to `num_results` distinct result URLs for `query`, served from the
+        search cache when fresh. Result pages are fetched `concurrency` at a
+        time and merged in page order; an empty page ends the search. A
+        page that fails also stops it, but the list is then not cached as
+        complete, so a later call asks Bing again.
+        """
+        if self.search_cache is not None:
+            cached = self.search_cache.get(query, num_results)
+            if cached is not None:
+                logger.info(f"Search cache hit for '{query}' ({len(cached)} results)")
+                return cached
+
+        pages_needed = min(BING_MAX_PAGES, -(-num_results // BING_PAGE_SIZE))
+        results, seen = [], set()
+        exhausted = failed = False
+        next_page = 0
+        while (len(results) < num_results and next_page < pages_needed
+               and not exhausted and not failed):
+            batch = range(next_page, min(pages_needed, next_page + concurrency))
+            next_page = batch[-1] + 1
+            pages = await asyncio.gather(
+                *(self.fetch_bing_page(query, n * BING_PAGE_SIZE + 1) for n in batch)
+            )
+            for urls in pages:
+                if urls is None:
+                    # Pages after a gap would shift every later rank; stop here.
+                    failed = True
+                    break
+                fresh = [u for u in urls if normalize_url(u) not in seen]
+                if not fresh:
+                    # Past the last page Bing repeats results or shows none.
+                    exhausted = True
+                    break
+                for url in fresh:
+                    if normalize_url(url) not in seen:
+                        seen.add(normalize_url(url))
+                        results.append(url)
+            if len(results) < num_results and next_page == pages_needed < BING_MAX_PAGES:
+                # Pages short of their size leave gaps; ask for one more round.
+                pages_needed += 1
+        if self.search_cache is not None and results:
+            self.search_cache.put(query, results, exhausted)
+        return results[:num_results]
+
+    async def iter_analyze_search_results(self, custom_ext_list, concurrency=DEFAULT_BATCH_PAGES):
+        """iter_analyze_many over the URLs of the last search_bing() call."""
+        async for item in self.iter_analyze_many(self.search_results, custom_ext_list, concurrency):
+            yield item
+
+    async def iter_analyze_url(self, url, custom_ext_list, max_results=None, isolated=False,
+                               link_sink=None, sniff_responses=None):
+        """
+        Yield discovered files in page order as classification progresses.
+        Each file is recorded in `self.results` and carries its stable 'id'.
+        With `isolated`, a page that needs the browser gets its own leased
+        context instead of the manager's shared page. `link_sink` is passed
+        through to collect the page's links (see iter_downloadable_files).
+        `sniff_responses` overrides the manager's setting for this page;
+        when on, the page is always loaded in the browser.
+        """
+        if sniff_responses is None:
+            sniff_responses = self.sniff_responses
+        self.results.start_page(url)
+        errors = []
+        try:
+            async for found in self._iter_page_files(url, custom_ext_list, max_results, isolated,
+                                                     link_sink, sniff_responses, errors):
+                stored = self.results.add(url, found)
+                if stored:
+                    yield stored
+        except Exception as e:
+            errors.append(str(e))
+            raise
+        finally:
+            self.results.finish_page(url, errors[0] if errors else None)
+
+    async def _iter_page_files(self, url, custom_ext_list, max_results, isolated=False,
+                               link_sink=None, sniff_responses=False, error_sink=None):
+        # Network traffic only exists in the browser, so sniffing skips the HTTP path.
+        if self.fetch_mode == "http" or (self.fetch_mode == "auto" and not sniff_responses):
+            await self.limiter.acquire(url)
+            with METRICS.stage("http_fetch"):
+                fetched = await fetch_static_page(self.http, url, proxy=self.proxy_url)
+            reason = browser_needed_reason(fetched)
+            if reason is None or self.fetch_mode == "http":
+                if reason == PAGE_TRUNCATED_REASON:
+                    # No browser allowed: the links in the part read beat none at all.
+                    logger.error(f"HTTP-only analysis of {url} covers only part of it: {reason}")
+                elif reason is not None:
+                    logger.error(f"HTTP-only analysis of {url} failed: {reason}")
+                    if error_sink is not None:
+                        error_sink.append(reason)
+                    return
+                with METRICS.stage("extract_links"):
+                    links = collect_page_links(fetched['url'], fetched['html'])
+                if link_sink is not None:
+                    link_sink.extend(links)
+                logger.info(f"Analyzed {url} over plain HTTP ({len(links)} links)")
+                async for found in classify_links(
+                    links, HttpPage(self.http, self.proxy_url), merge_extensions(custom_ext_list),
+                    self.probe_cache, concurrency=self.classify_concurrency,
+                    max_results=max_results
+                ):
+                    yield found
+                return
+            logger.info(f"Using the browser for {url}: {reason}")
 
-    async def analyze_url(self, url, custom_ext_list):
+        await self.limiter.acquire(url)
+        page_cm = self.extra_page() if isolated else self.browser_page()
+        async with page_cm as page:
+            async for found in iter_downloadable_files(
+                url, page, custom_ext_list, probe_cache=self.probe_cache,
+                concurrency=self.classify_concurrency, max_results=max_results,
+                link_sink=link_sink, sniff_responses=sniff_responses, humanize=self.humanize,
+                error_sink=error_sink
+            ):
+                yield found
+
+    async def analyze_url(self, url, custom_ext_list, max_results=None, sniff_responses=None):
         """Now includes a list of custom extensions and advanced MIME checks."""
-        return await extract_downloadable_files(url, self.page, custom_ext_list)
+        return [
+            found async for found in self.iter_analyze_url(
+                url, custom_ext_list, max_results, sniff_responses=sniff_responses
+            )
+        ]
+
+    async def iter_analyze_many(self, urls, custom_ext_list, concurrency=DEFAULT_BATCH_PAGES):
+        """
+        Analyze several pages with up to `concurrency` in flight, each one
+        that needs the browser on its own leased context. Yields
+        (url, new_files) as each page finishes; `new_files` leaves out
+        files an earlier page already produced.
+        """
+        sem = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(url):
+            async with sem:
+                try:
+                    return url, [f async for f in self.iter_analyze_url(url, custom_ext_list,
+                                                                         isolated=True)]
+                except Exception as e:
+                    logger.error(f"Error analyzing {url}: {e}")
+                    return url, []
+
+        # dict.fromkeys drops repeated URLs but keeps their order
+        tasks = [asyncio.ensure_future(one(u)) for u in dict.fromkeys(urls)]
+        seen = set()
+        try:
+            for fut in asyncio.as_completed(tasks):
+                url, files = await fut
+                fresh = [f for f in files if f['id'] not in seen]
+                seen.update(f['id'] for f in fresh)
+                yield url, fresh
+        finally:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+
+    async def analyze_many(self, urls, custom_ext_list, concurrency=DEFAULT_BATCH_PAGES):
+        """Merged, de-duplicated file list across all `urls`."""
+        merged = []
+        async for _, fresh in self.iter_analyze_many(urls, custom_ext_list, concurrency):
+            merged.extend(fresh)
+        return merged
+
+    async def iter_crawl(self, start_url, custom_ext_list, max_depth=DEFAULT_CRAWL_DEPTH,
+                         max_pages=DEFAULT_CRAWL_MAX_PAGES, same_domain=True, path_prefix=None,
+                         concurrency=DEFAULT_CRAWL_CONCURRENCY, per_domain=DEFAULT_CRAWL_PER_DOMAIN):
+        """
+        Breadth-first crawl from `start_url` up to `max_depth` link hops and
+        `max_pages` pages, following only links inside the scope (same host
+        and/or under `path_prefix`). Every page goes through the normal
+        analysis, so files are classified as usual. Yields
+        (page_url, depth, new_files) as each page finishes, with files
+        de-duplicated across the crawl.
+        """
+        scope = CrawlScope(start_url, same_domain=same_domain, path_prefix=path_prefix)
+        all_exts = merge_extensions(custom_ext_list)
+        visited = VisitedSet()
+        visited.add(start_url)
+        global_sem = asyncio.Semaphore(max(1, concurrency))
+        host_sems = {}
+        seen_files = set()
+        scheduled = 1
+        level = [start_url]
+
+        async def crawl_one(url):
+            host = urlparse(url).netloc.lower()
+            host_sem = host_sems.setdefault(host, asyncio.Semaphore(max(1, per_domain)))
+            links = []
+            async with host_sem:
+                async with global_sem:
+                    try:
+                        files = [f async for f in self.iter_analyze_url(
+                            url, custom_ext_list, isolated=True, link_sink=links)]
+                    except Exception as e:
+                        logger.error(f"Error crawling {url}: {e}")
+                        files = []
+            return url, files, links
+
+        for depth in range(max_depth + 1):
+            if not level:
+                break
+            next_level = []
+            tasks = [asyncio.ensure_future(crawl_one(u)) for u in level]
+            try:
+                for fut in asyncio.as_completed(tasks):
+                    url, files, links = await fut
+                    fresh = [f for f in files if f['id'] not in seen_files]
+                    seen_files.update(f['id'] for f in fresh)
+                    if depth < max_depth:
+                        file_urls = {normalize_url(f['url']) for f in files}
+                        for href, link_url in links:
+                            link_url = link_url.split('#', 1)[0]
+                            if scheduled >= max_pages:
+                                break
+                            if normalize_url(link_url) in file_urls:
+                                continue
+                            if not scope.allows(link_url):
+                                continue
+                            if not is_crawlable_link(href, link_url, all_exts, self.probe_cache):
+                                continue
+                            if visited.add(link_url):
+                                next_level.append(link_url)
+                                scheduled += 1
+                    yield url, depth, fresh
+            finally:
+                for t in tasks:
+                    if not t.done():
+                        t.cancel()
+            logger.info(f"Crawl depth {depth} done; {len(next_level)} pages queued, "
+                        f"{len(visited)} URLs seen")
+            level = next_level
+
+    async def _sync_cookies(self):
+        """Copy the browser context's cookies into the transfer client."""
+        if self.context is None:
+            return
+        try:
+            cookies = await self.context.cookies()
+        except Exception as e:
+            logger.error(f"Could not read browser cookies: {e}")
+            return
+        for c in cookies:
+            domain = c.get('domain', '').lstrip('.')
+            if not domain:
+                continue
+            scheme = 'https' if c.get('secure') else 'http'
+            self.http.cookie_jar.update_cookies(
+                {c['name']: c['value']},
+                response_url=URL(f"{scheme}://{domain}{c.get('path', '/')}")
+            )
+
+    async def prepare_transfers(self):
+        # One round of human-like activity per batch rather than per file,
+        # and only if the profile asks for it and a browser session is in play.
+        if self.humanize and self.page is not None:
+            async with self.browser_page() as page:
+                await human_like_interactions(page)
+        await self._sync_cookies()
+
+    def track_transfers(self, file_list):
+        """A TransferTracker for `file_list`, with sizes known from analysis filled in."""
+        return TransferTracker(file_list, self.probe_cache)
+
+    async def download_one(self, fi, directory, referer, progress=None, segments=None):
+        """
+        Download a single file with this manager's settings; returns the
+        saved path or None. Callers batching many files should use
+        iter_downloads, or call prepare_transfers() once first.
+        `segments` overrides the manager's connection count for this file.
+        """
+        # Files from a multi-page analysis are fetched with their own page as referer.
+        return await download_file(fi, directory, self.http, fi.get('source') or referer,
+                                   buffer_size=self.buffer_size, proxy=self.proxy_url,
+                                   segments=self.segments if segments is None else segments,
+                                   segment_threshold=self.segment_threshold,
+                                   probe_cache=self.probe_cache, store=self.store,
+                                   limiter=self.limiter, progress=progress)
+
+    async def scheduled_download(self, scheduler, fi, directory, referer, progress=None):
+        """
+        download_one for a transfer run by `scheduler` (a TransferScheduler),
+        which holds one of the host's slots for it. A file large enough for
+        segments opens one connection per host slot it can add, so a host
+        never sees more connections than its per-host cap.
+        """
+        wanted = 1
+        if self.segments > 1:
+            # The probe is cached, so download_file does not repeat it.
+            headers = {'Referer': fi.get('source') or referer}
+            probe = await self.probe_cache.get(
+                fi['url'], lambda u: head_probe(self.http, u, headers=headers, proxy=self.proxy_url)
+            )
+            if use_segmented(probe, self.segments, self.segment_threshold):
+                wanted = self.segments
+        async with scheduler.extra_host_slots(fi['url'], wanted - 1) as extra:
+            return await self.download_one(fi, directory, referer, progress=progress,
+                                           segments=1 + extra)
+
+    async def iter_downloads(self, file_list, directory, referer, tracker=None):
+        """
+        Download `file_list` concurrently, yielding (file_info, saved_path)
+        as each transfer finishes. `saved_path` is None on failure. A
+        `tracker` (see track_transfers) follows every file's progress.
+        """
+        if not file_list:
+            return
+        await self.prepare_transfers()
+        scheduler = TransferScheduler(self.max_concurrent_downloads, self.per_host_downloads)
 
-    async def download_files(self, file_list, directory, referer):
+        async def transfer(fi):
+            progress = tracker.get(fi) if tracker is not None else None
+            return await self.scheduled_download(scheduler, fi, directory, referer, progress)
+
+        async for fi, saved in scheduler.run(file_list, transfer):
+            yield fi, saved
+
+    async def download_files(self, file_list, directory, referer, tracker=None):
         out_paths = []
-        for fi in file_list:
-            saved = await download_file(fi, directory, self.page, referer)
+        async for _, saved in self.iter_downloads(file_list, directory, referer, tracker):
             if saved:
                 out_paths.append(saved)
         return out_paths
 
+    async def iter_sync(self, file_list, directory, referer, prune=False, tracker=None,
+                        listed_urls=None):
+        """
+        Mirror `file_list` into `directory`, transferring only what changed
+        since the last sync of the same folder from the same `referer`.
+        Files synced before are revalidated with If-None-Match /
+        If-Modified-Since; a 304 leaves the local copy alone. Yields
+        (file_info, state, path) with state one of SYNC_STATES.
+        `listed_urls` is every file URL a finished analysis of `referer`
+        found, whether selected or not: files from the previous run missing
+        from it come last as "removed" and are deleted locally only with
+        `prune`. Without it nothing is judged removed, since a partial
+        selection or scan says nothing about what the source dropped.
+        `tracker` is as for iter_downloads.
+        """
+        if self.store is None:
+            logger.error("Sync needs the download store; falling back to plain downloads")
+            async for fi, saved in self.iter_downloads(file_list, directory, referer, tracker):
+                yield fi, ("new" if saved else "failed"), saved
+            return
+
+        directory = os.path.abspath(directory)
+        previous = self.store.mirror_entries(directory, referer)
+        if file_list:
+            await self.prepare_transfers()
+        scheduler = TransferScheduler(self.max_concurrent_downloads, self.per_host_downloads)
+        proxy = self.proxy_url
+
+        async def sync_one(fi):
+            try:
+                return await sync_file(fi)
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Sync of {fi['url']} failed: {e}")
+                progress = tracker.get(fi) if tracker is not None else None
+                if progress is not None:
+                    progress.finish("failed")
+                return "failed", None
+
+        async def sync_file(fi):
+            url = fi['url']
+            prev = previous.get(url)
+            source = fi.get('source') or referer
+            progress = tracker.get(fi) if tracker is not None else None
+            if prev:
+                if progress is not None:
+                    progress.begin("checking")
+                unchanged = await revalidate(self.http, url, prev['etag'], prev['last_modified'],
+                                             headers={'Referer': source}, proxy=proxy,
+                                             limiter=self.limiter)
+                if unchanged:
+                    path = prev['path']
+                    if not os.path.exists(path):
+                        if not (prev['sha256'] and self.store.has_object(prev['sha256'])):
+                            unchanged = False
+                        else:
+                            # Deleted locally but still stored: restore without a transfer.
+                            path = await self.store.place(prev['sha256'], os.path.dirname(path),
+                                                          os.path.basename(path))
+                    if unchanged:
+                        self.store.mirror_record(directory, referer, url, path, prev['sha256'],
+                                                 prev['etag'], prev['last_modified'])
+                        if progress is not None:
+                            progress.finish("unchanged", path)
+                        return "unchanged", path
+
+            path = await self.scheduled_download(scheduler, fi, directory, source, progress)
+            if not path:
+                return "failed", None
+            if prev and path != prev['path'] and os.path.exists(prev['path']):
+                # A changed file keeps its mirrored name instead of becoming name(1).
+                os.replace(path, prev['path'])
+                path = prev['path']
+            # Files kept out of the store (another filesystem) still have the probe's validators.
+            rec = self.store.lookup(url) or self.probe_cache.peek(url) or {}
+            sha256 = rec.get('sha256')
+            if sha256 is None:
+                sha256 = await asyncio.get_event_loop().run_in_executor(None, sha256_file, path)
+            self.store.mirror_record(directory, referer, url, path, sha256,
+                                     rec.get('etag'), rec.get('last_modified'))
+            if not prev:
+                return "new", path
+            # Without validators a known file is fetched again; its hash tells if it changed.
+            if prev['sha256'] == sha256:
+                if progress is not None:
+                    progress.finish("unchanged", path)
+                return "unchanged", path
+            if prev['sha256']:
+                self.store.release_object(prev['sha256'])
+            return "changed", path
+
+        async for fi, (state, path) in scheduler.run(file_list, sync_one):
+            yield fi, state, path
+
+        if listed_urls is None:
+            return
+        listed = set(listed_urls)
+        listed.update(fi['url'] for fi in file_list)
+        for url, prev in previous.items():
+            if url in listed:
+                continue
+            if prune:
+                remove_quietly(prev['path'])
+                logger.info(f"Pruned: {prev['path']}")
+            self.store.mirror_forget(directory, referer, url)
+            yield {'url': url, 'filename': os.path.basename(prev['path'])}, "removed", prev['path']
+
+    def delete_download(self, url, path):
+        """
+        Delete the downloaded file `path` (from `url`), and its stored copy
+        too once nothing else links to it, so the space is really freed.
+        """
+        try:
+            os.remove(path)
+            logger.info(f"Deleted: {path}")
+        except OSError as e:
+            logger.error(f"Error deleting {path}: {e}")
+            return False
+        if self.store is not None:
+            try:
+                self.store.release(url)
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Could not drop {url} from the download store: {e}")
+        return True
+
+    async def sync_files(self, file_list, directory, referer, prune=False, tracker=None,
+                         listed_urls=None):
+        """Run iter_sync to completion; returns {state: [path or url, ...]}."""
+        summary = {k: [] for k in SYNC_STATES}
+        async for fi, state, path in self.iter_sync(file_list, directory, referer, prune=prune,
+                                                    tracker=tracker, listed_urls=listed_urls):
+            summary[state].append(path or fi['url'])
+        logger.info(f"Sync of {directory} from {referer}: {format_sync_summary(summary)}")
+        return summary
+
+def format_file_label(i, f):
+    """Checkbox label for a discovered file: index, name, size and PDF details."""
+    detail_parts = []
+    if f['size']:
+        detail_parts.append(f"Size: {f['size']}")
+    meta = f.get("metadata", {})
+    if meta.get('Title') and meta['Title'] != 'N/A':
+        detail_parts.append(f"Title: {meta['Title']}")
+    if meta.get('Author') and meta['Author'] != 'N/A':
+        detail_parts.append(f"Author: {meta['Author']}")
+    if meta.get('Pages') is not None:
+        detail_parts.append(f"Pages: {meta['Pages']}")
+    return f"{i}. {f['filename']} | " + " | ".join(detail_parts)
+
 # ------------------------------------------------------------------------------
 # BUILD THE APP (Two “pages” in one UI via radio + show/hide groups)
 # ------------------------------------------------------------------------------
 def build_gradio_app():
+    # Imported here so headless use (batch_download.py, workers) never loads Gradio.
+    import gradio as gr
+
     with gr.Blocks() as demo:
         gr.Markdown("# Advanced Downloader with 'Two Pages' in One UI")
         gr.Markdown(
@@ -419,6 +3828,19 @@ def build_gradio_app():
                 "Any extensions here get **added** to the default set:\n"
                 "`.pdf, .docx, .zip, .rar, .exe, .mp3, .mp4, .avi, .mkv, .png, .jpg, .jpeg, .gif`\n"
             )
+            behavior_profile = gr.Radio(
+                label="Behavior Profile",
+                choices=list(BEHAVIOR_PROFILES),
+                value=DEFAULT_PROFILE,
+                info="stealth: human-like page interactions, gentle per-host pacing. "
+                     "throughput: no interactions, higher request rates."
+            )
+            use_store_ck = gr.Checkbox(
+                label="Keep downloads in the shared store",
+                value=False,
+                info=f"Deduplicated copies in {DEFAULT_STORE_DIR}, so repeat downloads are "
+                     "linked instead of fetched again. Sync mode always uses it."
+            )
 
         # A "Clear Logs" button
         def clear_logs_action():
@@ -430,8 +3852,11 @@ def build_gradio_app():
         with gr.Group(visible=True) as manual_group:
             gr.Markdown("## Manual URL Workflow")
             manual_manager_state = gr.State(None)
-            manual_files_label_state = gr.State([])
+            # IDs of the files listed by the last analysis (checkbox values)
+            manual_file_ids_state = gr.State([])
             manual_url_state = gr.State("")
+            # URLs of every file a finished analysis listed; None while one is running.
+            manual_listing_state = gr.State(None)
 
             use_proxy_manual = gr.Checkbox(label="Use Proxy? (Manual)", value=False)
             proxy_manual = gr.Textbox(label="Proxy (http://ip:port)", placeholder="Optional")
@@ -439,6 +3864,17 @@ def build_gradio_app():
             manual_url = gr.Textbox(label="Manual URL", placeholder="https://example.com")
             analyze_manual_btn = gr.Button("Analyze URL (Manual)")
 
+            with gr.Accordion("Crawl Site (Optional)", open=False):
+                gr.Markdown("Follow links from the URL above, breadth-first, and collect files from every page.")
+                with gr.Row():
+                    crawl_depth_sl = gr.Slider(label="Max Depth", minimum=1, maximum=5,
+                                               value=DEFAULT_CRAWL_DEPTH, step=1)
+                    crawl_pages_num = gr.Number(label="Max Pages", value=DEFAULT_CRAWL_MAX_PAGES, precision=0)
+                with gr.Row():
+                    crawl_same_domain_ck = gr.Checkbox(label="Stay on the same domain", value=True)
+                    crawl_prefix = gr.Textbox(label="Path Prefix", placeholder="/docs/ (optional)")
+                crawl_manual_btn = gr.Button("Crawl Site (Manual)")
+
             manual_files_checkbox = gr.CheckboxGroup(label="Files from Manual URL", choices=[])
             with gr.Row():
                 select_all_manual_btn = gr.Button("Select All (Manual)")
@@ -446,111 +3882,187 @@ def build_gradio_app():
 
             directory_manual = gr.Textbox(label="Download Directory (Manual)", placeholder="./downloads_manual")
             delete_manual_ck = gr.Checkbox(label="Delete after download? (Manual)", value=False)
+            sync_manual_ck = gr.Checkbox(
+                label="Sync mode: only fetch files changed since the last download to this folder",
+                value=False
+            )
             download_manual_btn = gr.Button("Download (Manual)")
 
             manual_output = gr.Textbox(label="Manual Output / Logs", lines=5)
+            manual_progress = gr.Markdown("")
 
             # For clearing logs
             clear_manual_logs_btn = gr.Button("Clear Logs (Manual)")
 
             # Helper
-            async def create_manual_manager(usep, prox):
-                dm = DownloadManager(use_proxy=usep, proxy=prox)
-                await dm.__aenter__()
-                return dm
+            def create_manual_manager(usep, prox, profile):
+                # Opened by in_use() and closed again once the session sits idle.
+                return DownloadManager(use_proxy=usep, proxy=prox, profile=profile, store_dir=None)
 
-            async def analyze_manual_fn(url_val, usep, prox, mgr, custom_ext_str):
+            async def analyze_manual_fn(url_val, usep, prox, mgr, custom_ext_str, profile):
                 if not url_val:
-                    return (gr.update(choices=[], value=[]), [], None, "Please enter a URL first.")
+                    yield (gr.update(choices=[], value=[]), [], None, "", "Please enter a URL first.", None)
+                    return
 
                 exts = [x.strip() for x in custom_ext_str.split(",") if x.strip()]
 
                 if mgr is None:
-                    mgr = await create_manual_manager(usep, prox)
+                    mgr = create_manual_manager(usep, prox, profile)
+                async with mgr.in_use():
+                    mgr.set_profile(profile)
+
+                    # Files are listed as they are found, so selecting can start mid-scan.
+                    yield (gr.update(choices=[], value=[]), [], mgr, url_val,
+                           f"Analyzing {url_val}...", None)
+                    discovered = []
+                    last_update = time.monotonic()
+                    async for found in mgr.iter_analyze_url(url_val, exts):
+                        discovered.append(found)
+                        if time.monotonic() - last_update >= PROGRESS_INTERVAL:
+                            last_update = time.monotonic()
+                            choices = [(format_file_label(i, f), f['id']) for i, f in enumerate(discovered)]
+                            yield (
+                                gr.update(choices=choices),
+                                [f['id'] for f in discovered],
+                                mgr,
+                                url_val,
+                                f"Analyzing {url_val}: {len(discovered)} files so far...",
+                                None
+                            )
+                    if not discovered:
+                        yield (
+                            gr.update(choices=[], value=[]),
+                            [],
+                            mgr,
+                            url_val,
+                            f"No files found at {url_val}.",
+                            None
+                        )
+                        return
 
-                discovered = await mgr.analyze_url(url_val, exts)
-                if not discovered:
-                    return (
-                        gr.update(choices=[], value=[]),
-                        [],
+                    choices = [(format_file_label(i, f), f['id']) for i, f in enumerate(discovered)]
+                    yield (
+                        gr.update(choices=choices),
+                        [f['id'] for f in discovered],
                         mgr,
-                        f"No files found at {url_val}."
+                        url_val,
+                        f"Found {len(discovered)} files at {url_val}.",
+                        # The finished listing is what sync judges "removed" files against.
+                        [f['url'] for f in discovered]
                     )
 
-                label_list = []
-                for i, f in enumerate(discovered):
-                    detail_parts = []
-                    if f['size']:
-                        detail_parts.append(f"Size: {f['size']}")
-                    meta = f.get("metadata", {})
-                    if meta.get('Title') and meta['Title'] != 'N/A':
-                        detail_parts.append(f"Title: {meta['Title']}")
-                    if meta.get('Author') and meta['Author'] != 'N/A':
-                        detail_parts.append(f"Author: {meta['Author']}")
-                    if meta.get('Pages') is not None:
-                        detail_parts.append(f"Pages: {meta['Pages']}")
-                    label_str = f"{i}. {f['filename']} | " + " | ".join(detail_parts)
-                    label_list.append(label_str)
-
-                return (
-                    gr.update(choices=label_list, value=[]),
-                    label_list,
-                    mgr,
-                    f"Found {len(discovered)} files at {url_val}."
-                )
-
-            def select_all_manual_fn(file_labels):
-                return gr.update(value=file_labels)
+            async def crawl_manual_fn(url_val, usep, prox, mgr, custom_ext_str, profile,
+                                      depth, max_pages, same_domain, prefix):
+                if not url_val:
+                    yield (gr.update(choices=[], value=[]), [], mgr, "Please enter a URL first.", None)
+                    return
+
+                exts = [x.strip() for x in custom_ext_str.split(",") if x.strip()]
+                if mgr is None:
+                    mgr = create_manual_manager(usep, prox, profile)
+                async with mgr.in_use():
+                    mgr.set_profile(profile)
+
+                    merged = []
+                    pages = 0
+                    async for page_url, page_depth, fresh in mgr.iter_crawl(
+                        url_val, exts, max_depth=int(depth), max_pages=int(max_pages or 1),
+                        same_domain=same_domain, path_prefix=prefix.strip() or None
+                    ):
+                        pages += 1
+                        merged.extend(fresh)
+                        choices = [(format_file_label(i, f), f['id']) for i, f in enumerate(merged)]
+                        yield (
+                            gr.update(choices=choices),
+                            [f['id'] for f in merged],
+                            mgr,
+                            f"Crawled {pages} pages (depth {page_depth}: {page_url}); "
+                            f"{len(merged)} files so far.",
+                            None
+                        )
+                    if not merged:
+                        yield (gr.update(choices=[], value=[]), [], mgr,
+                               f"No files found in {pages} crawled pages.", None)
+                        return
+                    yield (gr.update(), [f['id'] for f in merged], mgr,
+                           f"Crawled {pages} pages; found {len(merged)} files.",
+                           [f['url'] for f in merged])
+
+            def select_all_manual_fn(file_ids):
+                return gr.update(value=file_ids)
 
             def deselect_all_manual_fn():
                 return gr.update(value=[])
 
-            async def download_manual_fn(selected, label_list, folder, do_del, manager, last_url, custom_ext_str):
+            async def download_manual_fn(selected, folder, do_del, do_sync, manager, last_url,
+                                         use_store, listing, profile):
                 if manager is None:
-                    return "No manager. Please analyze a Manual URL first."
+                    yield "No manager. Please analyze a Manual URL first.", ""
+                    return
                 if not last_url:
-                    return "No last URL. Please analyze a URL first."
+                    yield "No last URL. Please analyze a URL first.", ""
+                    return
                 if not selected:
-                    return "No files selected."
-
-                exts = [x.strip() for x in custom_ext_str.split(",") if x.strip()]
-                discovered = await manager.analyze_url(last_url, exts)
-                try:
-                    indices = [int(x.split(".")[0]) for x in selected]
-                except:
-                    return "Error parsing selected items."
-
-                chosen = []
-                for i in indices:
-                    if i < len(discovered):
-                        chosen.append(discovered[i])
+                    yield "No files selected.", ""
+                    return
 
+                # Selected values are file IDs from the analysis; no need to re-analyze.
+                chosen = manager.results.get_many(selected)
                 if not chosen:
-                    return "No valid files selected."
+                    yield "No valid files selected.", ""
+                    return
 
                 if not folder:
                     folder = "./downloads_manual"
 
-                downloaded = await manager.download_files(chosen, folder, referer=last_url)
-                if not downloaded:
-                    return "No files downloaded."
-
-                if do_del:
-                    for fp in downloaded:
-                        try:
-                            os.remove(fp)
-                            logger.info(f"Deleted: {fp}")
-                        except OSError as e:
-                            logger.error(f"Error deleting {fp}: {e}")
-                    return f"Downloaded & deleted {len(downloaded)} files: {downloaded}"
-                else:
-                    return f"Downloaded {len(downloaded)} files to '{folder}': {downloaded}"
+                async with manager.in_use():
+                    manager.set_profile(profile)
+                    manager.set_store(DEFAULT_STORE_DIR if (use_store or do_sync) else None)
+                    tracker = manager.track_transfers(chosen)
+                    if do_sync:
+                        task = asyncio.ensure_future(
+                            manager.sync_files(chosen, folder, referer=last_url, tracker=tracker,
+                                               listed_urls=listing))
+                    else:
+                        task = asyncio.ensure_future(
+                            manager.download_files(chosen, folder, referer=last_url, tracker=tracker))
+                    async for update in stream_transfers(task, tracker, f"Downloading to '{folder}'"):
+                        yield update
+                    result = task.result()
+
+                    if do_sync:
+                        yield f"Synced '{folder}': {format_sync_summary(result)}", tracker.table()
+                        return
+
+                    downloaded = result
+                    if not downloaded:
+                        yield "No files downloaded.", tracker.table()
+                        return
+
+                    if do_del:
+                        for p in tracker.items.values():
+                            if p.path:
+                                manager.delete_download(p.url, p.path)
+                        yield f"Downloaded & deleted {len(downloaded)} files: {downloaded}", tracker.table()
+                    else:
+                        yield (f"Downloaded {len(downloaded)} files to '{folder}': {downloaded}",
+                               tracker.table())
 
             # Wire up
             analyze_manual_btn.click(
                 fn=analyze_manual_fn,
-                inputs=[manual_url, use_proxy_manual, proxy_manual, manual_manager_state, custom_extensions],
-                outputs=[manual_files_checkbox, manual_files_label_state, manual_manager_state, manual_output]
+                inputs=[manual_url, use_proxy_manual, proxy_manual, manual_manager_state, custom_extensions,
+                        behavior_profile],
+                outputs=[manual_files_checkbox, manual_file_ids_state, manual_manager_state,
+                         manual_url_state, manual_output, manual_listing_state]
+            )
+
+            crawl_manual_btn.click(
+                fn=crawl_manual_fn,
+                inputs=[manual_url, use_proxy_manual, proxy_manual, manual_manager_state, custom_extensions,
+                        behavior_profile, crawl_depth_sl, crawl_pages_num, crawl_same_domain_ck, crawl_prefix],
+                outputs=[manual_files_checkbox, manual_file_ids_state, manual_manager_state, manual_output,
+                         manual_listing_state]
             ).then(
                 fn=lambda x: x,
                 inputs=[manual_url],
@@ -559,7 +4071,7 @@ def build_gradio_app():
 
             select_all_manual_btn.click(
                 fn=select_all_manual_fn,
-                inputs=[manual_files_label_state],
+                inputs=[manual_file_ids_state],
                 outputs=[manual_files_checkbox]
             )
 
@@ -570,9 +4082,10 @@ def build_gradio_app():
 
             download_manual_btn.click(
                 fn=download_manual_fn,
-                inputs=[manual_files_checkbox, manual_files_label_state, directory_manual,
-                        delete_manual_ck, manual_manager_state, manual_url_state, custom_extensions],
-                outputs=[manual_output]
+                inputs=[manual_files_checkbox, directory_manual,
+                        delete_manual_ck, sync_manual_ck, manual_manager_state, manual_url_state,
+                        use_store_ck, manual_listing_state, behavior_profile],
+                outputs=[manual_output, manual_progress]
             )
 
             clear_manual_logs_btn.click(
@@ -587,18 +4100,21 @@ def build_gradio_app():
         with gr.Group(visible=False) as search_group:
             gr.Markdown("## Bing Search Workflow")
             search_manager_state = gr.State(None)
-            search_file_label_state = gr.State([])
+            # IDs of the files listed by the last analysis (checkbox values)
+            search_file_ids_state = gr.State([])
             search_url_state = gr.State("")
 
             use_proxy_search = gr.Checkbox(label="Use Proxy? (Search)", value=False)
             proxy_search = gr.Textbox(label="Proxy (http://ip:port)", placeholder="Optional")
 
             query_inp = gr.Textbox(label="Bing Search Query")
-            num_results_sl = gr.Slider(label="Number of Results", minimum=1, maximum=50, value=5, step=1)
+            num_results_sl = gr.Slider(label="Number of Results", minimum=1, maximum=200, value=5, step=1)
             search_btn = gr.Button("Search Bing")
 
             results_dd = gr.Dropdown(label="Bing Results", choices=[], value=None)
-            analyze_search_btn = gr.Button("Analyze Selected URL")
+            with gr.Row():
+                analyze_search_btn = gr.Button("Analyze Selected URL")
+                analyze_all_search_btn = gr.Button("Analyze All Results")
 
             search_files_checkbox = gr.CheckboxGroup(label="Files from Search", choices=[])
             with gr.Row():
@@ -610,108 +4126,149 @@ def build_gradio_app():
             download_search_btn = gr.Button("Download (Search)")
 
             search_output = gr.Textbox(label="Search Output / Logs", lines=5)
+            search_progress = gr.Markdown("")
 
             # For clearing logs
             clear_search_logs_btn = gr.Button("Clear Logs (Search)")
 
-            async def create_search_manager(usep, px, query, numr):
-                dm = DownloadManager(use_proxy=usep, proxy=px, query=query, num_results=numr)
-                await dm.__aenter__()
-                return dm
+            def create_search_manager(usep, px, query, numr, profile):
+                # Opened by in_use() and closed again once the session sits idle.
+                return DownloadManager(use_proxy=usep, proxy=px, query=query, num_results=numr,
+                                       profile=profile, store_dir=None)
 
-            async def do_search_fn(usep, px, query, numr):
+            async def do_search_fn(usep, px, query, numr, old_mgr, profile):
+                # Give the previous search's browser context back to the pool.
+                if old_mgr is not None:
+                    await old_mgr.close()
                 if not query:
                     return (gr.update(choices=[], value=[]), None, "No query entered.")
-                mgr = await create_search_manager(usep, px, query, numr)
-                results = await mgr.search_bing()
+                mgr = create_search_manager(usep, px, query, numr, profile)
+                async with mgr.in_use():
+                    results = await mgr.search_bing()
                 if not results:
                     return (gr.update(choices=[], value=[]), mgr, "No results or Bing error.")
                 return (gr.update(choices=results, value=results[0]), mgr, f"Found {len(results)} results.")
 
-            async def analyze_search_fn(sel_url, mgr, custom_ext_str):
+            async def analyze_search_fn(sel_url, mgr, custom_ext_str, profile):
                 if not sel_url:
-                    return (gr.update(choices=[], value=[]), [], "No URL selected.")
+                    yield (gr.update(choices=[], value=[]), [], sel_url, "No URL selected.")
+                    return
                 if mgr is None:
-                    return (gr.update(choices=[], value=[]), [], "No manager. Please search again.")
+                    yield (gr.update(choices=[], value=[]), [], sel_url, "No manager. Please search again.")
+                    return
+
+                exts = [x.strip() for x in custom_ext_str.split(",") if x.strip()]
+                async with mgr.in_use():
+                    mgr.set_profile(profile)
+                    yield (gr.update(choices=[], value=[]), [], sel_url, f"Analyzing {sel_url}...")
+                    discovered = []
+                    last_update = time.monotonic()
+                    async for found in mgr.iter_analyze_url(sel_url, exts):
+                        discovered.append(found)
+                        if time.monotonic() - last_update >= PROGRESS_INTERVAL:
+                            last_update = time.monotonic()
+                            choices = [(format_file_label(i, f), f['id']) for i, f in enumerate(discovered)]
+                            yield (gr.update(choices=choices), [f['id'] for f in discovered], sel_url,
+                                   f"Analyzing: {len(discovered)} files so far...")
+                    if not discovered:
+                        yield (gr.update(choices=[], value=[]), [], sel_url, "No files found on that page.")
+                        return
+
+                    choices = [(format_file_label(i, f), f['id']) for i, f in enumerate(discovered)]
+                    yield (gr.update(choices=choices), [f['id'] for f in discovered], sel_url,
+                           f"Found {len(discovered)} files.")
+
+            async def analyze_all_search_fn(mgr, custom_ext_str, profile):
+                if mgr is None or not mgr.search_results:
+                    yield (gr.update(choices=[], value=[]), [], "No search results. Please search first.")
+                    return
 
                 exts = [x.strip() for x in custom_ext_str.split(",") if x.strip()]
-                discovered = await mgr.analyze_url(sel_url, exts)
-                if not discovered:
-                    return (gr.update(choices=[], value=[]), [], "No files found on that page.")
-
-                labels = []
-                for i, f in enumerate(discovered):
-                    detail_parts = []
-                    if f['size']:
-                        detail_parts.append(f"Size: {f['size']}")
-                    meta = f.get("metadata", {})
-                    if meta.get('Title') and meta['Title'] != 'N/A':
-                        detail_parts.append(f"Title: {meta['Title']}")
-                    if meta.get('Author') and meta['Author'] != 'N/A':
-                        detail_parts.append(f"Author: {meta['Author']}")
-                    if meta.get('Pages') is not None:
-                        detail_parts.append(f"Pages: {meta['Pages']}")
-                    labels.append(f"{i}. {f['filename']} | " + " | ".join(detail_parts))
-
-                return (gr.update(choices=labels, value=[]), labels, f"Found {len(discovered)} files.")
-
-            def select_all_search_fn(file_labels):
-                return gr.update(value=file_labels)
+                async with mgr.in_use():
+                    mgr.set_profile(profile)
+                    total = len(mgr.search_results)
+                    merged = []
+                    done = 0
+                    # Each page's files appear as soon as that page finishes.
+                    async for page_url, fresh in mgr.iter_analyze_search_results(exts):
+                        done += 1
+                        merged.extend(fresh)
+                        choices = [(format_file_label(i, f), f['id']) for i, f in enumerate(merged)]
+                        yield (
+                            gr.update(choices=choices),
+                            [f['id'] for f in merged],
+                            f"Analyzed {done}/{total} results; {len(merged)} unique files so far "
+                            f"(+{len(fresh)} from {page_url})."
+                        )
+                    if not merged:
+                        yield (gr.update(choices=[], value=[]), [], "No files found on any result page.")
+
+            def select_all_search_fn(file_ids):
+                return gr.update(value=file_ids)
 
             def deselect_all_search_fn():
                 return gr.update(value=[])
 
-            async def download_search_fn(selected, label_list, folder, do_del, mgr, sel_url, custom_ext_str):
+            async def download_search_fn(selected, folder, do_del, mgr, sel_url, use_store, profile):
                 if mgr is None:
-                    return "No manager. Please search first."
+                    yield "No manager. Please search first.", ""
+                    return
                 if not sel_url:
-                    return "No selected URL from results."
+                    yield "No selected URL from results.", ""
+                    return
                 if not selected:
-                    return "No files selected."
+                    yield "No files selected.", ""
+                    return
 
-                exts = [x.strip() for x in custom_ext_str.split(",") if x.strip()]
-                discovered = await mgr.analyze_url(sel_url, exts)
-                try:
-                    idxs = [int(x.split(".")[0]) for x in selected]
-                except:
-                    return "Error parsing selected items."
-
-                chosen = []
-                for i in idxs:
-                    if i < len(discovered):
-                        chosen.append(discovered[i])
+                # Selected values are file IDs from the analysis; no need to re-analyze.
+                chosen = mgr.results.get_many(selected)
                 if not chosen:
-                    return "No valid files selected."
+                    yield "No valid files selected.", ""
+                    return
 
                 if not folder:
                     folder = "./downloads_search"
 
-                downloaded = await mgr.download_files(chosen, folder, referer=sel_url)
-                if not downloaded:
-                    return "No files downloaded."
-
-                if do_del:
-                    for fp in downloaded:
-                        try:
-                            os.remove(fp)
-                            logger.info(f"Deleted: {fp}")
-                        except OSError as e:
-                            logger.error(f"Error deleting {fp}: {e}")
-                    return f"Downloaded & deleted {len(downloaded)} files: {downloaded}"
-                else:
-                    return f"Downloaded {len(downloaded)} files to '{folder}': {downloaded}"
+                async with mgr.in_use():
+                    mgr.set_profile(profile)
+                    mgr.set_store(DEFAULT_STORE_DIR if use_store else None)
+                    tracker = mgr.track_transfers(chosen)
+                    task = asyncio.ensure_future(
+                        mgr.download_files(chosen, folder, referer=sel_url, tracker=tracker))
+                    async for update in stream_transfers(task, tracker, f"Downloading to '{folder}'"):
+                        yield update
+                    downloaded = task.result()
+                    if not downloaded:
+                        yield "No files downloaded.", tracker.table()
+                        return
+
+                    if do_del:
+                        for p in tracker.items.values():
+                            if p.path:
+                                mgr.delete_download(p.url, p.path)
+                        yield f"Downloaded & deleted {len(downloaded)} files: {downloaded}", tracker.table()
+                    else:
+                        yield (f"Downloaded {len(downloaded)} files to '{folder}': {downloaded}",
+                               tracker.table())
 
             # Wire up
             search_btn.click(
                 fn=do_search_fn,
-                inputs=[use_proxy_search, proxy_search, query_inp, num_results_sl],
+                inputs=[use_proxy_search, proxy_search, query_inp, num_results_sl, search_manager_state,
+                        behavior_profile],
                 outputs=[results_dd, search_manager_state, search_output]
             )
 
             analyze_search_btn.click(
                 fn=analyze_search_fn,
-                inputs=[results_dd, search_manager_state, custom_extensions],
-                outputs=[search_files_checkbox, search_file_label_state, search_output]
+                inputs=[results_dd, search_manager_state, custom_extensions, behavior_profile],
+                outputs=[search_files_checkbox, search_file_ids_state, search_url_state, search_output]
+            )
+
+            analyze_all_search_btn.click(
+                fn=analyze_all_search_fn,
+                inputs=[search_manager_state, custom_extensions, behavior_profile],
+                outputs=[search_files_checkbox, search_file_ids_state, search_output]
             ).then(
                 fn=lambda x: x,
                 inputs=[results_dd],
@@ -720,7 +4277,7 @@ def build_gradio_app():
 
             select_all_search_btn.click(
                 fn=select_all_search_fn,
-                inputs=[search_file_label_state],
+                inputs=[search_file_ids_state],
                 outputs=[search_files_checkbox]
             )
 
@@ -731,9 +4288,10 @@ def build_gradio_app():
 
             download_search_btn.click(
                 fn=download_search_fn,
-                inputs=[search_files_checkbox, search_file_label_state, directory_search,
-                        delete_search_ck, search_manager_state, search_url_state, custom_extensions],
-                outputs=[search_output]
+                inputs=[search_files_checkbox, directory_search,
+                        delete_search_ck, search_manager_state, search_url_state, use_store_ck,
+                        behavior_profile],
+                outputs=[search_output, search_progress]
             )
 
             clear_search_logs_btn.click(
@@ -757,12 +4315,27 @@ def build_gradio_app():
             outputs=[manual_group, search_group],
         )
 
+        # ------------------------------------------------------------------
+        # Metrics: where the time of searches, analyses and downloads went
+        # ------------------------------------------------------------------
+        with gr.Accordion("Metrics", open=False):
+            gr.Markdown(
+                "Time per stage, bytes per host and browser pool use since the app started. "
+                "Set `METRICS_PORT` to also serve them for Prometheus at `/metrics`."
+            )
+            metrics_md = gr.Markdown(format_metrics_summary())
+            refresh_metrics_btn = gr.Button("Refresh Metrics")
+
+        refresh_metrics_btn.click(fn=format_metrics_summary, inputs=[], outputs=[metrics_md])
+
     return demo
 
 # ------------------------------------------------------------------------------
 # MAIN
 # ------------------------------------------------------------------------------
 if __name__ == "__main__":
+    if os.environ.get("METRICS_PORT"):
+        start_metrics_server(int(os.environ["METRICS_PORT"]))
     app = build_gradio_app()
     # Try port 7860; if it's unavailable, fall back to port 0 (an open random port).
     try:
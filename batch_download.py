@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Headless batch runner: analyze pages (or Bing queries) and download the
+files found, writing one JSON line per event. Gradio is never imported.
+
+    python batch_download.py urls.txt -o results.jsonl -d ./downloads
+    cat queries.txt | python batch_download.py - --mode query --analyze-only
+
+Input lines are page URLs or Bing queries (blank lines and lines starting
+with '#' are skipped); in the default "auto" mode a line is a URL when it
+starts with http:// or https://. Every output record has an "event"
+("search", "page", "file", "download" or "summary"), a "status" and "t_ms",
+the milliseconds since the run started.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from advanced_search import (
+    BEHAVIOR_PROFILES,
+    DEFAULT_BATCH_PAGES,
+    DEFAULT_CLASSIFY_CONCURRENCY,
+    DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+    DEFAULT_PER_HOST_DOWNLOADS,
+    DEFAULT_PROFILE,
+    DEFAULT_SEARCH_CACHE_PATH,
+    DEFAULT_STORE_DIR,
+    FETCH_MODES,
+    DownloadManager,
+    TransferScheduler,
+    get_browser_pool,
+    logger,
+    start_metrics_server,
+)
+
+DEFAULT_DOWNLOAD_DIR = "./downloads_batch"
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Analyze pages or Bing queries and download the files found, "
+                    "writing JSON lines."
+    )
+    parser.add_argument("input", nargs="?", default="-",
+                        help="file with one URL or query per line ('-' for stdin, the default)")
+    parser.add_argument("-o", "--output", default="-",
+                        help="JSONL output file ('-' for stdout, the default)")
+    parser.add_argument("-d", "--download-dir", default=DEFAULT_DOWNLOAD_DIR,
+                        help=f"where files are saved (default {DEFAULT_DOWNLOAD_DIR})")
+    parser.add_argument("--mode", choices=("auto", "url", "query"), default="auto",
+                        help="how input lines are read (default: URLs if they look like URLs)")
+    parser.add_argument("--analyze-only", action="store_true",
+                        help="list files without downloading them")
+    parser.add_argument("--sync", action="store_true",
+                        help="only transfer files changed since the last sync into the folder")
+    parser.add_argument("--ext", default="",
+                        help="extra file extensions, comma-separated (e.g. .csv,.txt)")
+    parser.add_argument("--num-results", type=int, default=5,
+                        help="Bing results analyzed per query (default 5)")
+    parser.add_argument("--pages", type=int, default=DEFAULT_BATCH_PAGES,
+                        help=f"pages analyzed at once (default {DEFAULT_BATCH_PAGES})")
+    parser.add_argument("--downloads", type=int, default=DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+                        help=f"concurrent downloads (default {DEFAULT_MAX_CONCURRENT_DOWNLOADS})")
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST_DOWNLOADS,
+                        help=f"concurrent downloads per host (default {DEFAULT_PER_HOST_DOWNLOADS})")
+    parser.add_argument("--classify", type=int, default=DEFAULT_CLASSIFY_CONCURRENCY,
+                        help=f"links classified at once per page (default {DEFAULT_CLASSIFY_CONCURRENCY})")
+    parser.add_argument("--fetch-mode", choices=FETCH_MODES, default="auto",
+                        help="plain HTTP first ('auto'), or force 'http' / 'browser'")
+    parser.add_argument("--profile", choices=list(BEHAVIOR_PROFILES), default=DEFAULT_PROFILE,
+                        help=f"request pacing and page interactions (default {DEFAULT_PROFILE})")
+    parser.add_argument("--proxy", default=None, help="proxy URL, e.g. http://host:8080")
+    parser.add_argument("--store-dir", default="",
+                        help=f"content-addressed download store (off unless given; "
+                             f"--sync defaults to {DEFAULT_STORE_DIR})")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on this port while running")
+    parser.add_argument("--search-cache", default=DEFAULT_SEARCH_CACHE_PATH,
+                        help="Bing result cache file ('' to disable)")
+    return parser.parse_args(argv)
+
+def read_jobs(stream, mode):
+    """[(kind, value)] for the input lines, kind being 'url' or 'query'."""
+    jobs = []
+    for line in stream:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if mode == "url" or (mode == "auto" and line.lower().startswith(("http://", "https://"))):
+            jobs.append(("url", line))
+        else:
+            jobs.append(("query", line))
+    return jobs
+
+def load_jobs(path, mode):
+    """
+    read_jobs over the file at `path` ('-' for stdin). Reports an empty
+    input on stderr and returns None, the CLIs then exit with status 2.
+    """
+    if path == "-":
+        jobs = read_jobs(sys.stdin, mode)
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            jobs = read_jobs(f, mode)
+    if not jobs:
+        print("No URLs or queries in the input.", file=sys.stderr)
+        return None
+    return jobs
+
+class JsonlWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.started = time.monotonic()
+
+    def write(self, event, **fields):
+        record = {"event": event}
+        record.update(fields)
+        record["t_ms"] = round((time.monotonic() - self.started) * 1000)
+        self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.stream.flush()
+
+def file_fields(f):
+    return {
+        "id": f['id'],
+        "url": f['url'],
+        "filename": f['filename'],
+        "size": f['size'],
+        "page": f.get('source'),
+        "metadata": f.get('metadata') or {},
+    }
+
+async def collect_pages(mgr, jobs, args, out):
+    """Resolve queries through Bing; returns the page URLs to analyze, in order."""
+    pages = []
+    for kind, value in jobs:
+        if kind == "url":
+            pages.append(value)
+            continue
+        mgr.query = value
+        mgr.num_results = args.num_results
+        started = time.monotonic()
+        results = await mgr.search_bing()
+        out.write("search", query=value, status="ok" if results else "empty",
+                  results=results, duration_ms=round((time.monotonic() - started) * 1000))
+        pages.extend(results)
+    return pages
+
+async def analyze(mgr, pages, args, out):
+    exts = [x.strip() for x in args.ext.split(",") if x.strip()]
+    found = []
+    async for page_url, fresh in mgr.iter_analyze_many(pages, exts, concurrency=args.pages):
+        outcome = mgr.results.page_outcome(page_url) or {}
+        if outcome.get('error'):
+            status = "error"
+        elif fresh:
+            status = "ok"
+        else:
+            # Every file it lists was already reported for an earlier page.
+            status = "duplicate" if mgr.results.files_for(page_url) else "empty"
+        seconds = outcome.get('seconds')
+        out.write("page", page=page_url, status=status, files=len(fresh),
+                  duration_ms=round(seconds * 1000) if seconds is not None else None,
+                  error=outcome.get('error'))
+        for f in fresh:
+            out.write("file", status="found", **file_fields(f))
+        found.extend(fresh)
+    return found
+
+async def download(mgr, files, args, out):
+    """Download `files`; returns the number that failed."""
+    failed = 0
+    if args.sync:
+        # Files of one page are synced together so "removed" is judged per page.
+        by_page = {}
+        for f in files:
+            by_page.setdefault(f['source'], []).append(f)
+        for page_url, page_files in by_page.items():
+            # The page's full list, including files an earlier page already produced.
+            listed = [f['url'] for f in mgr.results.files_for(page_url)]
+            async for f, state, path in mgr.iter_sync(page_files, args.download_dir, page_url,
+                                                      listed_urls=listed):
+                failed += state == "failed"
+                out.write("download", status=state, url=f['url'], id=f.get('id'), page=page_url,
+                          path=path, bytes=os.path.getsize(path) if path and os.path.exists(path) else None)
+        return failed
+
+    await mgr.prepare_transfers()
+    scheduler = TransferScheduler(mgr.max_concurrent_downloads, mgr.per_host_downloads)
+
+    async def timed(f):
+        started = time.monotonic()
+        path = await mgr.scheduled_download(scheduler, f, args.download_dir, f['source'])
+        return path, time.monotonic() - started
+
+    async for f, (path, elapsed) in scheduler.run(files, timed):
+        size = os.path.getsize(path) if path else None
+        failed += path is None
+        out.write("download", status="ok" if path else "failed", id=f['id'], url=f['url'],
+                  page=f['source'], path=path, bytes=size, duration_ms=round(elapsed * 1000),
+                  bytes_per_s=round(size / elapsed) if size and elapsed > 0 else None)
+    return failed
+
+async def run(args, jobs, out):
+    mgr = DownloadManager(
+        use_proxy=bool(args.proxy), proxy=args.proxy, num_results=args.num_results,
+        max_concurrent_downloads=args.downloads, per_host_downloads=args.per_host,
+        classify_concurrency=args.classify, fetch_mode=args.fetch_mode,
+        store_dir=args.store_dir or (DEFAULT_STORE_DIR if args.sync else None), profile=args.profile,
+        search_cache_path=args.search_cache or None,
+    )
+    try:
+        async with mgr:
+            pages = await collect_pages(mgr, jobs, args, out)
+            files = await analyze(mgr, pages, args, out)
+            failed = 0
+            if files and not args.analyze_only:
+                failed = await download(mgr, files, args, out)
+    finally:
+        # Browsers are only running if some page needed one.
+        await get_browser_pool().close()
+    out.write("summary", status="failed" if failed else "ok", pages=len(pages),
+              files=len(files), failed=failed)
+    return 1 if failed else 0
+
+def main(argv=None):
+    args = parse_args(argv)
+    jobs = load_jobs(args.input, args.mode)
+    if jobs is None:
+        return 2
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    out_stream = sys.stdout if args.output == "-" else open(args.output, 'w', encoding='utf-8')
+    try:
+        return asyncio.run(run(args, jobs, JsonlWriter(out_stream)))
+    except KeyboardInterrupt:
+        logger.info("Batch run interrupted")
+        return 130
+    finally:
+        if out_stream is not sys.stdout:
+            out_stream.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
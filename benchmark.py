@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks: a local fixture HTTP server with synthetic sites, and
+DownloadManager.analyze_url / download_files run against each of them.
+
+    python benchmark.py -o results.json
+    python benchmark.py --quick --scenarios anchors_1k,large_ranged
+    python benchmark.py -o new.json --compare results.json
+
+Every scenario runs in a freshly spawned process, so its peak RSS is its
+own; the fixture server runs in this process and counts the requests each
+scenario issues. Results are one JSON document (stdout or -o) and a short
+table on stderr.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+from aiohttp import web
+
+from advanced_search import METRICS, DownloadManager, RateLimiter, get_browser_pool
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+BENCHMARK_FORMAT = 1
+DEFAULT_HOST = "127.0.0.1"
+CHUNK = 256 * 1024
+PATTERN = bytes(range(256)) * 4096      # 1 MiB of filler repeated for synthetic bodies
+SLOW_CHUNK = 64 * 1024
+SLOW_CHUNK_DELAY = 0.02                 # seconds between chunks: ~3 MB/s per transfer
+
+# Sizes per scale. "quick" keeps every code path (large files still cross
+# the segmented-download threshold) but runs in well under a minute.
+SCALES = {
+    "full": {
+        "anchors": (10, 1000, 10000), "mime_links": 200,
+        "pdf_sizes": (16 * 1024, 1024 * 1024, 32 * 1024 * 1024),
+        "large": 160 * 1024 * 1024, "small_files": 200, "small_size": 64 * 1024,
+        "slow_files": 4, "slow_size": 2 * 1024 * 1024, "flaky_files": 10, "flaky_size": 1024 * 1024,
+    },
+    "quick": {
+        "anchors": (10, 1000, 2000), "mime_links": 50,
+        "pdf_sizes": (16 * 1024, 1024 * 1024, 8 * 1024 * 1024),
+        "large": 40 * 1024 * 1024, "small_files": 50, "small_size": 64 * 1024,
+        "slow_files": 4, "slow_size": 512 * 1024, "flaky_files": 5, "flaky_size": 256 * 1024,
+    },
+}
+
+# name -> (kind, description). "download" scenarios analyze their page first.
+SCENARIOS = {
+    "anchors_10": ("analyze", "page with 10 anchors, half of them files"),
+    "anchors_1k": ("analyze", "page with 1k anchors, half of them files"),
+    "anchors_10k": ("analyze", "page with the largest anchor count of the scale"),
+    "mime_mix": ("analyze", "extensionless links of mixed MIME types"),
+    "pdf_sizes": ("analyze", "PDFs of several sizes (metadata via range reads)"),
+    "large_ranged": ("download", "one large file on a server accepting byte ranges"),
+    "large_plain": ("download", "one large file on a server ignoring ranges"),
+    "small_files": ("download", "many small files"),
+    "slow": ("download", "files trickled out in small, delayed chunks"),
+    "flaky": ("download", "files that drop mid-body, then answer 503, then succeed"),
+}
+
+# ------------------------------------------------------------------------------
+# Fixture content
+
+def make_pdf(size, title):
+    """A valid one-page PDF of roughly `size` bytes with a Title and Author."""
+    padding_lines = max(0, (size - 600) // 80)
+    content = b"".join(b"% " + b"x" * 77 + b"\n" for _ in range(padding_lines))
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 5 0 R >>",
+        b"<< /Title (" + title.encode('ascii') + b") /Author (benchmark) >>",
+        b"<< /Length " + str(len(content)).encode() + b" >>\nstream\n" + content + b"\nendstream",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{num} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += (f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R /Info 4 0 R >>\n"
+            f"startxref\n{xref}\n%%EOF\n").encode()
+    return bytes(out)
+
+def pattern_bytes(start, length):
+    """`length` bytes of the repeating filler, starting at offset `start`."""
+    offset = start % len(PATTERN)
+    out = PATTERN[offset:offset + length]
+    while len(out) < length:
+        out += PATTERN[:length - len(out)]
+    return out
+
+MIME_CYCLE = (
+    ("application/pdf", None),
+    ("application/zip", None),
+    ("text/html", None),
+    ("application/octet-stream", 'attachment; filename="data-{i}.bin"'),
+    ("image/png", None),
+)
+
+def page_links(name, scale):
+    """The hrefs listed on the fixture page of scenario `name`."""
+    if name.startswith("anchors_"):
+        index = {"anchors_10": 0, "anchors_1k": 1, "anchors_10k": 2}[name]
+        count = scale["anchors"][index]
+        return [f"/files/4096/doc-{i}.zip" if i % 2 else f"/articles/{i}" for i in range(count)]
+    if name == "mime_mix":
+        return [f"/blob/{i}" for i in range(scale["mime_links"])]
+    if name == "pdf_sizes":
+        return [f"/pdf/{size}/report-{size}.pdf" for size in scale["pdf_sizes"]]
+    if name == "large_ranged":
+        return [f"/files/{scale['large']}/large.bin.zip"]
+    if name == "large_plain":
+        return [f"/plain/{scale['large']}/large.bin.zip"]
+    if name == "small_files":
+        return [f"/files/{scale['small_size']}/small-{i}.zip" for i in range(scale["small_files"])]
+    if name == "slow":
+        return [f"/slow/{scale['slow_size']}/slow-{i}.zip" for i in range(scale["slow_files"])]
+    if name == "flaky":
+        return [f"/flaky/{scale['flaky_size']}/flaky-{i}.zip" for i in range(scale["flaky_files"])]
+    return []
+
+# ------------------------------------------------------------------------------
+# Fixture server
+
+def parse_range(value, total):
+    """(start, end) of a single `bytes=a-b` range within `total`, or None."""
+    m = re.match(r'bytes=(\d*)-(\d*)$', value or '')
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if m.group(1):
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else total - 1
+    else:
+        start = max(0, total - int(m.group(2)))
+        end = total - 1
+    if start >= total or end < start:
+        return None
+    return start, min(end, total - 1)
+
+class FixtureServer:
+    """The synthetic sites, served by aiohttp from a background thread."""
+
+    def __init__(self, scale, host=DEFAULT_HOST, port=0):
+        self.scale = scale
+        self.host = host
+        self.port = port
+        self.requests = {}          # method -> count since the last reset()
+        self.bytes_sent = 0
+        self._attempts = {}         # flaky path -> GETs seen
+        self._pdfs = {}
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def reset(self):
+        self.requests = {}
+        self.bytes_sent = 0
+        self._attempts = {}
+
+    def start(self):
+        ready = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start())
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, name="fixture-server", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    async def _start(self):
+        app = web.Application(middlewares=[self._count])
+        app.router.add_get('/page/{name}', self._page)
+        app.router.add_route('*', '/articles/{n}', self._article)
+        app.router.add_route('*', '/files/{size}/{fname}', self._ranged)
+        app.router.add_route('*', '/plain/{size}/{fname}', self._plain)
+        app.router.add_route('*', '/slow/{size}/{fname}', self._slow)
+        app.router.add_route('*', '/flaky/{size}/{fname}', self._flaky)
+        app.router.add_route('*', '/pdf/{size}/{fname}', self._pdf)
+        app.router.add_route('*', '/blob/{n}', self._blob)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    @web.middleware
+    async def _count(self, request, handler):
+        self.requests[request.method] = self.requests.get(request.method, 0) + 1
+        return await handler(request)
+
+    async def _page(self, request):
+        links = page_links(request.match_info['name'], self.scale)
+        if not links:
+            raise web.HTTPNotFound()
+        body = "\n".join(f'<li><a href="{href}">{href.rsplit("/", 1)[-1]}</a></li>' for href in links)
+        return web.Response(text=f"<html><head><title>fixture</title></head><body><ul>\n{body}\n</ul>"
+                                 f"</body></html>", content_type="text/html")
+
+    async def _article(self, request):
+        return web.Response(text="<html><body><p>Not a file.</p></body></html>",
+                            content_type="text/html")
+
+    async def _send(self, request, total, read, content_type, ranges=True,
+                    chunk=CHUNK, delay=0.0, drop_after=None, headers=None):
+        """Stream `total` bytes produced by read(start, length), honouring Range if `ranges`."""
+        hdrs = {'Content-Type': content_type, 'ETag': f'"{total}"',
+                'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+        if ranges:
+            hdrs['Accept-Ranges'] = 'bytes'
+        hdrs.update(headers or {})
+        start, end, status = 0, total - 1, 200
+        if ranges and request.headers.get('Range'):
+            if_range = request.headers.get('If-Range')
+            span = parse_range(request.headers['Range'], total)
+            if span is None:
+                return web.Response(status=416, headers={'Content-Range': f"bytes */{total}"})
+            if not if_range or if_range in (hdrs['ETag'], hdrs['Last-Modified']):
+                start, end, status = span[0], span[1], 206
+                hdrs['Content-Range'] = f"bytes {start}-{end}/{total}"
+        length = end - start + 1
+        hdrs['Content-Length'] = str(length)
+        if request.method == 'HEAD':
+            return web.Response(status=status, headers=hdrs)
+        resp = web.StreamResponse(status=status, headers=hdrs)
+        await resp.prepare(request)
+        pos = start
+        while pos <= end:
+            if drop_after is not None and pos - start >= drop_after:
+                # Cut the connection mid-body, as a failing proxy would.
+                request.transport.close()
+                return resp
+            n = min(chunk, end + 1 - pos)
+            await resp.write(read(pos, n))
+            self.bytes_sent += n
+            pos += n
+            if delay:
+                await asyncio.sleep(delay)
+        await resp.write_eof()
+        return resp
+
+    async def _ranged(self, request):
+        return await self._send(request, int(request.match_info['size']), pattern_bytes,
+                                "application/zip")
+
+    async def _plain(self, request):
+        return await self._send(request, int(request.match_info['size']), pattern_bytes,
+                                "application/zip", ranges=False)
+
+    async def _slow(self, request):
+        return await self._send(request, int(request.match_info['size']), pattern_bytes,
+                                "application/zip", chunk=SLOW_CHUNK, delay=SLOW_CHUNK_DELAY)
+
+    async def _flaky(self, request):
+        total = int(request.match_info['size'])
+        if request.method == 'GET':
+            attempt = self._attempts[request.path] = self._attempts.get(request.path, 0) + 1
+            if attempt == 1:
+                return await self._send(request, total, pattern_bytes, "application/zip",
+                                        chunk=16 * 1024, drop_after=total // 2)
+            if attempt == 2:
+                return web.Response(status=503, headers={'Retry-After': '1'})
+        return await self._send(request, total, pattern_bytes, "application/zip")
+
+    def _pdf_bytes(self, size, title):
+        if size not in self._pdfs:
+            self._pdfs[size] = make_pdf(size, title)
+        return self._pdfs[size]
+
+    async def _pdf(self, request):
+        data = self._pdf_bytes(int(request.match_info['size']), request.match_info['fname'])
+        return await self._send(request, len(data), lambda s, n: data[s:s + n], "application/pdf")
+
+    async def _blob(self, request):
+        i = int(request.match_info['n'])
+        ctype, cdisp = MIME_CYCLE[i % len(MIME_CYCLE)]
+        if ctype == "text/html":
+            return await self._article(request)
+        if ctype == "application/pdf":
+            data = self._pdf_bytes(32 * 1024, "blob")
+            read = lambda s, n: data[s:s + n]
+            total = len(data)
+        else:
+            read, total = pattern_bytes, 32 * 1024
+        headers = {'Content-Disposition': cdisp.format(i=i)} if cdisp else None
+        return await self._send(request, total, read, ctype, headers=headers)
+
+# ------------------------------------------------------------------------------
+# Scenario runs (each in its own process)
+
+def peak_rss_bytes():
+    # VmHWM belongs to this process image. ru_maxrss survives execve on
+    # Linux, so in a spawned child it can report the parent's peak instead.
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def run_scenario(name, base_url, options):
+    """Process entry point: run scenario `name` and return its measurements."""
+    return asyncio.run(_run_scenario(name, base_url, options))
+
+async def _run_scenario(name, base_url, options):
+    kind = SCENARIOS[name][0]
+    limiter = None if options['paced'] else RateLimiter(1e9, 1e9)
+    mgr = DownloadManager(
+        fetch_mode=options['fetch_mode'], profile="throughput", rate_limiter=limiter,
+        store_dir=None, search_cache_path=None,
+        classify_concurrency=options['classify'],
+        max_concurrent_downloads=options['downloads'], per_host_downloads=options['downloads'],
+    )
+    page_url = f"{base_url}/page/{name}"
+    download_dir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    result = {'name': name, 'kind': kind}
+    try:
+        started = time.monotonic()
+        async with mgr:
+            files = await mgr.analyze_url(page_url, [])
+            result['analyze_s'] = round(time.monotonic() - started, 4)
+            result['files_found'] = len(files)
+            if kind == "download":
+                dl_started = time.monotonic()
+                paths = await mgr.download_files(files, download_dir, page_url)
+                elapsed = time.monotonic() - dl_started
+                size = sum(os.path.getsize(p) for p in paths)
+                result.update({
+                    'download_s': round(elapsed, 4),
+                    'files_downloaded': len(paths),
+                    'bytes': size,
+                    'throughput_bps': round(size / elapsed) if elapsed > 0 else None,
+                })
+        result['wall_s'] = round(time.monotonic() - started, 4)
+    finally:
+        shutil.rmtree(download_dir, ignore_errors=True)
+        await get_browser_pool().close()
+    result['peak_rss_bytes'] = peak_rss_bytes()
+    counters, histograms, _ = METRICS.samples()
+    result['stages'] = {
+        dict(labels)['stage']: {'count': count, 'seconds': round(total, 4)}
+        for (metric, labels), (_, _, total, count) in sorted(histograms.items())
+        if metric == "stage_seconds"
+    }
+    return result
+
+def run_isolated(name, base_url, options):
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        return pool.submit(run_scenario, name, base_url, options).result()
+
+def median(values):
+    ordered = sorted(values)
+    mid = len(ordered) // 2
+    return ordered[mid] if len(ordered) % 2 else (ordered[mid - 1] + ordered[mid]) / 2
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run_benchmarks(names, scale_name, options, repeat=1, report=None):
+    """Run the scenarios `names`; returns the results document."""
+    server = FixtureServer(SCALES[scale_name]).start()
+    results = []
+    try:
+        for name in names:
+            runs = []
+            for _ in range(repeat):
+                server.reset()
+                run = run_isolated(name, server.base_url, options)
+                run['requests'] = sum(server.requests.values())
+                run['requests_by_method'] = dict(server.requests)
+                run['bytes_served'] = server.bytes_sent
+                runs.append(run)
+            result = dict(runs[-1])
+            result['description'] = SCENARIOS[name][1]
+            result['wall_s'] = median([r['wall_s'] for r in runs])
+            result['wall_s_runs'] = [r['wall_s'] for r in runs]
+            results.append(result)
+            if report:
+                report(result)
+    finally:
+        server.stop()
+    return {
+        'format': BENCHMARK_FORMAT,
+        'started_at': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'scale': scale_name,
+        'repeat': repeat,
+        'options': options,
+        'scenarios': results,
+    }
+
+# ------------------------------------------------------------------------------
+# Command line
+
+def format_row(result):
+    rss = result.get('peak_rss_bytes')
+    tput = result.get('throughput_bps')
+    return (f"{result['name']:<14} {result['wall_s']:>9.3f}s {result['requests']:>7} req "
+            f"{result['files_found']:>6} files "
+            f"{(f'{rss / 2 ** 20:.0f} MiB' if rss else '-'):>9} "
+            f"{(f'{tput / 2 ** 20:.1f} MiB/s' if tput else ''):>12}")
+
+def compare(baseline, current):
+    """Lines comparing wall times with a previous results document."""
+    old = {r['name']: r for r in baseline.get('scenarios', [])}
+    lines = [f"{'scenario':<14} {'before':>10} {'after':>10} {'change':>8}"]
+    for result in current['scenarios']:
+        before = old.get(result['name'])
+        if before is None:
+            continue
+        change = (result['wall_s'] / before['wall_s'] - 1) * 100 if before['wall_s'] else 0.0
+        lines.append(f"{result['name']:<14} {before['wall_s']:>9.3f}s {result['wall_s']:>9.3f}s "
+                     f"{change:>+7.1f}%")
+    return lines
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of analysis and downloads.")
+    parser.add_argument("-o", "--output", default="-",
+                        help="results JSON file ('-' for stdout, the default)")
+    parser.add_argument("--scenarios", default="",
+                        help="comma-separated scenario names (default: all): " + ", ".join(SCENARIOS))
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, for a fast check")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="runs per scenario; wall_s is their median (default 1)")
+    parser.add_argument("--fetch-mode", choices=("auto", "http", "browser"), default="auto")
+    parser.add_argument("--paced", action="store_true",
+                        help="keep the throughput profile's rate limits (default: unpaced)")
+    parser.add_argument("--classify", type=int, default=8, help="links classified at once")
+    parser.add_argument("--downloads", type=int, default=8, help="concurrent downloads")
+    parser.add_argument("--compare", default=None, metavar="RESULTS_JSON",
+                        help="print wall-time changes against an earlier results file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()] or list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    options = {'fetch_mode': args.fetch_mode, 'paced': args.paced,
+               'classify': args.classify, 'downloads': args.downloads}
+
+    report = lambda result: print(format_row(result), file=sys.stderr, flush=True)
+    document = run_benchmarks(names, "quick" if args.quick else "full", options,
+                              repeat=max(1, args.repeat), report=report)
+    text = json.dumps(document, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            for line in compare(json.load(f), document):
+                print(line, file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Run crawl-and-download jobs across several machines.
+
+The coordinator keeps the job queue (see job_queue.py) and serves it over a
+small HTTP API. Workers on any machine pull tasks with a lease, renew the
+lease through heartbeats while they work, and push results back. Follow-up
+tasks (analyze a search result, download a file found) are queued by the
+coordinator when the result arrives. Tasks of a worker that stops sending
+heartbeats are handed to another worker once their lease runs out.
+
+    python cluster.py coordinator --host 0.0.0.0 --port 8470 --token SECRET
+    python cluster.py worker http://coordinator:8470 --token SECRET --download-root /data/downloads
+    python cluster.py submit http://coordinator:8470 urls.txt --token SECRET -d batch1
+
+The coordinator only listens beyond loopback with a token, and a worker
+keeps every job's download folder inside its own --download-root.
+
+API (JSON bodies; every request carries "Authorization: Bearer <token>"
+when the coordinator has one):
+
+    POST /jobs                  {"jobs": [["url"|"query", value], ...], "options": {...}}
+    GET  /jobs/{id}             task counts per kind and state
+    GET  /jobs/{id}/results     one JSON line per task
+    POST /tasks/claim           {"worker": id, "limit": n, "wait": seconds}
+    POST /tasks/heartbeat       {"worker": id, "task_ids": [...]}
+    POST /tasks/{id}/complete   {"worker": id, "result": {...}, "children": [...]}
+    POST /tasks/{id}/fail       {"worker": id, "error": "..."}
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import hmac
+import ipaddress
+import json
+import os
+import socket
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+from advanced_search import (
+    BEHAVIOR_PROFILES,
+    DEFAULT_PROFILE,
+    DEFAULT_STORE_DIR,
+    FETCH_MODES,
+    DownloadManager,
+    get_browser_pool,
+    logger,
+    start_metrics_server,
+)
+from batch_download import load_jobs
+from job_queue import (
+    DEFAULT_QUEUE_PATH,
+    DEFAULT_WORKER_CONCURRENCY,
+    LEASE_SECONDS,
+    JobQueue,
+    run_task,
+)
+
+DEFAULT_PORT = 8470
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_DOWNLOAD_ROOT = "./downloads_jobs"
+CLAIM_WAIT = 10.0          # seconds a claim may wait on the coordinator for work
+CLAIM_POLL = 0.2
+CLAIM_RECHECK = 2.0        # seconds a waiting claim sleeps between checks with no wake-up
+MAX_CLAIM_LIMIT = 64
+CLIENT_TIMEOUT = aiohttp.ClientTimeout(total=CLAIM_WAIT + 30)
+
+# ------------------------------------------------------------------------------
+# Coordinator
+
+def make_coordinator_app(queue_path=DEFAULT_QUEUE_PATH, token=None):
+    """aiohttp application serving the job queue at `queue_path`."""
+    # Every queue call runs on one thread owning the connection: a write
+    # waiting on the SQLite lock must not stall heartbeats of other workers.
+    db_thread = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    queue = None
+    # Set (and replaced) whenever new tasks may have become claimable.
+    work_ready = None
+    routes = web.RouteTableDef()
+
+    def call(fn, *args):
+        return asyncio.get_running_loop().run_in_executor(db_thread, fn, *args)
+
+    def wake_claims():
+        nonlocal work_ready
+        work_ready.set()
+        work_ready = asyncio.Event()
+
+    expected = f"Bearer {token}".encode('utf-8') if token else None
+
+    @web.middleware
+    async def check_token(request, handler):
+        if expected is not None and not hmac.compare_digest(
+                request.headers.get('Authorization', '').encode('utf-8'), expected):
+            return web.json_response({'error': 'unauthorized'}, status=401)
+        try:
+            return await handler(request)
+        except (ValueError, KeyError, TypeError) as e:
+            return web.json_response({'error': f"bad request: {e}"}, status=400)
+
+    @routes.post('/jobs')
+    async def submit_job(request):
+        body = await request.json()
+        jobs = [(kind, value) for kind, value in body['jobs']]
+        if not jobs:
+            raise ValueError("no jobs")
+        job_id = await call(queue.submit, jobs, body.get('options') or {})
+        wake_claims()
+        logger.info(f"Coordinator: job {job_id} submitted with {len(jobs)} entries")
+        return web.json_response({'job_id': job_id})
+
+    @routes.get('/jobs/{job_id}')
+    async def job_status(request):
+        status = await call(queue.job_status, int(request.match_info['job_id']))
+        if status is None:
+            return web.json_response({'error': 'no such job'}, status=404)
+        return web.json_response(status)
+
+    @routes.get('/jobs/{job_id}/results')
+    async def job_results(request):
+        job_id = int(request.match_info['job_id'])
+        records = await call(lambda: list(queue.iter_results(job_id)))
+        resp = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await resp.prepare(request)
+        for record in records:
+            await resp.write((json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8'))
+        await resp.write_eof()
+        return resp
+
+    @routes.post('/tasks/claim')
+    async def claim(request):
+        body = await request.json()
+        worker = str(body['worker'])
+        limit = max(1, min(int(body.get('limit', 1)), MAX_CLAIM_LIMIT))
+        deadline = time.monotonic() + min(float(body.get('wait', 0)), CLAIM_WAIT)
+        # Long poll: an idle worker waits here for a submit or a finished task
+        # to wake it. Retry delays and expired leases free tasks without one,
+        # hence the occasional recheck.
+        while True:
+            ready = work_ready
+            tasks = await call(queue.claim, worker, limit)
+            remaining = deadline - time.monotonic()
+            if tasks or remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(ready.wait(), min(remaining, CLAIM_RECHECK))
+            except asyncio.TimeoutError:
+                pass
+        options = {}
+        for task in tasks:
+            if task['job_id'] not in options:
+                options[task['job_id']] = await call(queue.job_options, task['job_id'])
+            task['options'] = options[task['job_id']]
+        return web.json_response({'tasks': tasks, 'lease_seconds': LEASE_SECONDS})
+
+    @routes.post('/tasks/heartbeat')
+    async def heartbeat(request):
+        body = await request.json()
+        await call(queue.renew, str(body['worker']), [int(t) for t in body.get('task_ids', [])])
+        return web.json_response({'ok': True})
+
+    async def finish(request, done):
+        body = await request.json()
+        task = await call(queue.get_task, int(request.match_info['task_id']))
+        if task is None:
+            return web.json_response({'error': 'no such task'}, status=404)
+        worker = str(body['worker'])
+        if done:
+            children = [(kind, key, payload) for kind, key, payload in body.get('children', [])]
+            accepted = await call(queue.complete, task, worker, body.get('result'), children)
+            if children:
+                wake_claims()
+        else:
+            accepted = await call(queue.fail, task, worker, str(body.get('error') or 'failed'))
+        return web.json_response({'accepted': accepted})
+
+    @routes.post('/tasks/{task_id}/complete')
+    async def complete(request):
+        return await finish(request, True)
+
+    @routes.post('/tasks/{task_id}/fail')
+    async def fail(request):
+        return await finish(request, False)
+
+    async def open_queue(app):
+        nonlocal queue, work_ready
+        queue = await call(JobQueue, queue_path)
+        work_ready = asyncio.Event()
+
+    async def close_queue(app):
+        await call(queue.close)
+        db_thread.shutdown()
+
+    app = web.Application(middlewares=[check_token])
+    app.add_routes(routes)
+    app.on_startup.append(open_queue)
+    app.on_cleanup.append(close_queue)
+    return app
+
+# ------------------------------------------------------------------------------
+# Worker
+
+class CoordinatorClient:
+    """Worker-side calls to the coordinator API."""
+
+    def __init__(self, base_url, worker_id, token=None):
+        self.base_url = base_url.rstrip('/')
+        self.worker_id = worker_id
+        headers = {'Authorization': f"Bearer {token}"} if token else {}
+        self.session = aiohttp.ClientSession(headers=headers, timeout=CLIENT_TIMEOUT)
+
+    async def close(self):
+        await self.session.close()
+
+    async def _post(self, path, body):
+        body = dict(body, worker=self.worker_id)
+        async with self.session.post(self.base_url + path, json=body) as resp:
+            resp.raise_for_status()
+            return await resp.json()
+
+    async def claim(self, limit, wait=CLAIM_WAIT):
+        return (await self._post('/tasks/claim', {'limit': limit, 'wait': wait}))['tasks']
+
+    async def heartbeat(self, task_ids):
+        await self._post('/tasks/heartbeat', {'task_ids': task_ids})
+
+    async def complete(self, task, result, children):
+        reply = await self._post(f"/tasks/{task['id']}/complete",
+                                 {'result': result, 'children': children})
+        return reply['accepted']
+
+    async def fail(self, task, error):
+        reply = await self._post(f"/tasks/{task['id']}/fail", {'error': error})
+        return reply['accepted']
+
+async def run_worker(base_url, worker_id=None, token=None, concurrency=DEFAULT_WORKER_CONCURRENCY,
+                     manager_options=None, exit_when_idle=False, download_root=DEFAULT_DOWNLOAD_ROOT):
+    """
+    Pull tasks from the coordinator at `base_url` and run them, up to
+    `concurrency` at a time, until cancelled (or, with `exit_when_idle`,
+    until a claim comes back empty while nothing is running). Files are
+    only written inside `download_root`, whatever folder a job names.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    client = CoordinatorClient(base_url, worker_id, token)
+    active = {}   # asyncio task -> queue task
+
+    async def send_heartbeats():
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            try:
+                await client.heartbeat([t['id'] for t in active.values()])
+            except Exception as e:
+                logger.error(f"[{worker_id}] heartbeat failed: {e}")
+
+    async def execute(task):
+        try:
+            result, children = await run_task(mgr, task, task.get('options') or {}, download_root)
+        except Exception as e:
+            logger.error(f"[{worker_id}] task {task['id']} ({task['kind']}) failed: {e}")
+            try:
+                await client.fail(task, str(e))
+            except Exception as report_error:
+                # The lease will expire and the task will be retried elsewhere.
+                logger.error(f"[{worker_id}] could not report failure of task {task['id']}: {report_error}")
+            return
+        result = dict(result, worker=worker_id)
+        try:
+            await client.complete(task, result, children)
+        except Exception as e:
+            logger.error(f"[{worker_id}] could not report task {task['id']}: {e}")
+
+    mgr = DownloadManager(**(manager_options or {}))
+    heartbeats = asyncio.ensure_future(send_heartbeats())
+    logger.info(f"Worker {worker_id} pulling from {base_url}")
+    try:
+        async with mgr:
+            await mgr.prepare_transfers()
+            while True:
+                free = concurrency - len(active)
+                if free > 0:
+                    try:
+                        # Only wait on the coordinator when there is nothing to do here.
+                        claimed = await client.claim(free, wait=0 if active else CLAIM_WAIT)
+                    except Exception as e:
+                        logger.error(f"[{worker_id}] claim failed: {e}")
+                        claimed = []
+                        await asyncio.sleep(CLAIM_POLL * 10)
+                    for task in claimed:
+                        active[asyncio.ensure_future(execute(task))] = task
+                    if not claimed and not active and exit_when_idle:
+                        break
+                if not active:
+                    continue
+                done, _ = await asyncio.wait(list(active), timeout=CLAIM_POLL * 5,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for fut in done:
+                    active.pop(fut, None)
+    finally:
+        heartbeats.cancel()
+        for fut in active:
+            fut.cancel()
+        await asyncio.gather(heartbeats, *active, return_exceptions=True)
+        await client.close()
+        await get_browser_pool().close()
+
+# ------------------------------------------------------------------------------
+# Command line
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+async def submit_remote(base_url, token, jobs, options):
+    headers = {'Authorization': f"Bearer {token}"} if token else {}
+    async with aiohttp.ClientSession(headers=headers, timeout=CLIENT_TIMEOUT) as session:
+        async with session.post(base_url.rstrip('/') + '/jobs',
+                                json={'jobs': jobs, 'options': options}) as resp:
+            resp.raise_for_status()
+            return (await resp.json())['job_id']
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Distributed crawl-and-download coordinator and workers.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("coordinator", help="serve the job queue over HTTP")
+    p.add_argument("--host", default=DEFAULT_HOST,
+                   help=f"listen address (default {DEFAULT_HOST}; any other needs --token)")
+    p.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p.add_argument("--queue", default=DEFAULT_QUEUE_PATH)
+    p.add_argument("--token", default=os.environ.get("CLUSTER_TOKEN"),
+                   help="shared secret workers must send (default $CLUSTER_TOKEN)")
+
+    p = sub.add_parser("worker", help="pull and run tasks from a coordinator")
+    p.add_argument("coordinator", help="coordinator base URL, e.g. http://host:8470")
+    p.add_argument("--token", default=os.environ.get("CLUSTER_TOKEN"))
+    p.add_argument("--worker-id", default=None)
+    p.add_argument("--concurrency", type=int, default=DEFAULT_WORKER_CONCURRENCY)
+    p.add_argument("--exit-when-idle", action="store_true")
+    p.add_argument("--fetch-mode", choices=FETCH_MODES, default="auto")
+    p.add_argument("--profile", choices=list(BEHAVIOR_PROFILES), default=DEFAULT_PROFILE)
+    p.add_argument("--proxy", default=None)
+    p.add_argument("--store-dir", default="",
+                   help=f"content-addressed download store, e.g. {DEFAULT_STORE_DIR} (off by default)")
+    p.add_argument("--download-root", default=DEFAULT_DOWNLOAD_ROOT,
+                   help=f"folder every job's downloads go under (default {DEFAULT_DOWNLOAD_ROOT})")
+    p.add_argument("--metrics-port", type=int, default=None,
+                   help="serve this worker's Prometheus metrics on this port")
+    p.add_argument("--metrics-host", default=DEFAULT_HOST,
+                   help=f"metrics listen address (default {DEFAULT_HOST}; the endpoint has no token)")
+
+    p = sub.add_parser("submit", help="submit a job file of URLs/queries ('-' for stdin)")
+    p.add_argument("coordinator")
+    p.add_argument("input", nargs="?", default="-")
+    p.add_argument("--token", default=os.environ.get("CLUSTER_TOKEN"))
+    p.add_argument("--mode", choices=("auto", "url", "query"), default="auto")
+    p.add_argument("-d", "--download-dir", default="",
+                   help="download folder under each worker's --download-root")
+    p.add_argument("--ext", default="")
+    p.add_argument("--num-results", type=int, default=5)
+    p.add_argument("--analyze-only", action="store_true")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "coordinator":
+        if not args.token and not is_loopback(args.host):
+            print(f"Refusing to serve the queue on {args.host} without --token (or CLUSTER_TOKEN).",
+                  file=sys.stderr)
+            return 2
+        web.run_app(make_coordinator_app(args.queue, args.token), host=args.host, port=args.port)
+        return 0
+
+    if args.command == "worker":
+        options = {
+            'use_proxy': bool(args.proxy), 'proxy': args.proxy, 'fetch_mode': args.fetch_mode,
+            'profile': args.profile, 'store_dir': args.store_dir or None,
+        }
+        if args.metrics_port:
+            start_metrics_server(args.metrics_port, host=args.metrics_host)
+        try:
+            asyncio.run(run_worker(args.coordinator, args.worker_id, args.token, args.concurrency,
+                                   options, args.exit_when_idle, args.download_root))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    jobs = load_jobs(args.input, args.mode)
+    if jobs is None:
+        return 2
+    job_id = asyncio.run(submit_remote(args.coordinator, args.token, jobs, {
+        'download_dir': args.download_dir,
+        'exts': [x.strip() for x in args.ext.split(",") if x.strip()],
+        'num_results': args.num_results,
+        'analyze_only': args.analyze_only,
+    }))
+    print(job_id)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""
+Durable job queue for large runs, kept in SQLite, with worker processes.
+
+A job is a list of page URLs and/or Bing queries plus its options. It is
+split into tasks: a "search" task yields "analyze" tasks, and an "analyze"
+task yields one "download" task per file found. Workers are separate
+processes, each with its own DownloadManager (and browser, if a page
+needs one). They claim tasks under a time-limited lease and renew it while
+working. When a worker dies, its leases expire and another worker picks
+the tasks up again.
+
+    python job_queue.py submit urls.txt -d ./downloads
+    python job_queue.py work --workers 4
+    python job_queue.py status 1
+    python job_queue.py results 1 > results.jsonl
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import time
+
+from advanced_search import (
+    BEHAVIOR_PROFILES,
+    DEFAULT_PROFILE,
+    DEFAULT_STORE_DIR,
+    FETCH_MODES,
+    DownloadManager,
+    get_browser_pool,
+    logger,
+    start_metrics_server,
+)
+from batch_download import load_jobs
+
+DEFAULT_QUEUE_PATH = "download_jobs.sqlite3"
+LEASE_SECONDS = 120           # a task not renewed for this long is handed out again
+MAX_TASK_ATTEMPTS = 3
+RETRY_DELAY = 30              # seconds before a failed task is retried
+WORKER_POLL_INTERVAL = 1.0
+DEFAULT_WORKER_CONCURRENCY = 4
+
+TASK_STATES = ("pending", "leased", "done", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    options TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL REFERENCES jobs(id),
+    kind TEXT NOT NULL,
+    dedupe_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    updated_at REAL,
+    UNIQUE (job_id, kind, dedupe_key)
+);
+CREATE INDEX IF NOT EXISTS tasks_claim ON tasks(status, available_at);
+CREATE INDEX IF NOT EXISTS tasks_job ON tasks(job_id, status);
+"""
+
+class JobQueue:
+    """SQLite-backed jobs and tasks, safe to share between processes."""
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH):
+        self.path = path
+        # Autocommit mode: transactions are opened explicitly where needed.
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can
+        # never claim the same task.
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def _insert_task(self, job_id, kind, dedupe_key, payload, now):
+        self.db.execute(
+            "INSERT OR IGNORE INTO tasks (job_id, kind, dedupe_key, payload, updated_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (job_id, kind, dedupe_key, json.dumps(payload), now)
+        )
+
+    def submit(self, jobs, options):
+        """
+        Queue a job for `jobs`, a list of ('url' | 'query', value) pairs,
+        and return its id. `options` (a dict) is handed to every task.
+        """
+        now = time.time()
+        db = self._transaction()
+        try:
+            cur = db.execute("INSERT INTO jobs (options, created_at) VALUES (?, ?)",
+                             (json.dumps(options), now))
+            job_id = cur.lastrowid
+            for kind, value in jobs:
+                if kind == "query":
+                    self._insert_task(job_id, "search", value, {'query': value}, now)
+                else:
+                    self._insert_task(job_id, "analyze", value, {'url': value}, now)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return job_id
+
+    def get_task(self, task_id):
+        row = self.db.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        if row is None:
+            return None
+        task = dict(row)
+        task['payload'] = json.loads(row['payload'])
+        return task
+
+    def job_options(self, job_id):
+        row = self.db.execute("SELECT options FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row['options']) if row else {}
+
+    def claim(self, owner, limit=1):
+        """
+        Lease up to `limit` runnable tasks to `owner`: pending ones whose
+        retry delay has passed, and leased ones whose lease expired.
+        Returns them as dicts with the payload decoded.
+        """
+        now = time.time()
+        db = self._transaction()
+        try:
+            rows = db.execute(
+                "SELECT * FROM tasks WHERE (status = 'pending' AND available_at <= ?)"
+                " OR (status = 'leased' AND lease_expires < ?) ORDER BY id LIMIT ?",
+                (now, now, limit)
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                if row['status'] == 'leased':
+                    logger.info(f"Reclaiming task {row['id']} from {row['lease_owner']} (lease expired)")
+                if row['attempts'] >= MAX_TASK_ATTEMPTS:
+                    db.execute(
+                        "UPDATE tasks SET status = 'failed', lease_owner = NULL,"
+                        " error = COALESCE(error, 'lease expired too often'), updated_at = ?"
+                        " WHERE id = ?", (now, row['id'])
+                    )
+                    self._update_job(row['job_id'], now)
+                    continue
+                db.execute(
+                    "UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?,"
+                    " attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (owner, now + LEASE_SECONDS, now, row['id'])
+                )
+                task = dict(row)
+                task['payload'] = json.loads(row['payload'])
+                task['attempts'] += 1
+                claimed.append(task)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return claimed
+
+    def renew(self, owner, task_ids):
+        """Extend the leases `owner` still holds on `task_ids`."""
+        if not task_ids:
+            return
+        now = time.time()
+        marks = ",".join("?" * len(task_ids))
+        self.db.execute(
+            f"UPDATE tasks SET lease_expires = ? WHERE status = 'leased' AND lease_owner = ?"
+            f" AND id IN ({marks})",
+            [now + LEASE_SECONDS, owner] + list(task_ids)
+        )
+
+    def _update_job(self, job_id, now):
+        """Mark the job finished once none of its tasks is pending or leased."""
+        open_tasks = self.db.execute(
+            "SELECT COUNT(*) FROM tasks WHERE job_id = ? AND status IN ('pending', 'leased')",
+            (job_id,)
+        ).fetchone()[0]
+        if open_tasks == 0:
+            self.db.execute("UPDATE jobs SET status = 'finished', finished_at = ? WHERE id = ?",
+                            (now, job_id))
+        else:
+            self.db.execute("UPDATE jobs SET status = 'running' WHERE id = ? AND status = 'queued'",
+                            (job_id,))
+
+    def _finish(self, task, owner, status, result=None, error=None, children=()):
+        now = time.time()
+        db = self._transaction()
+        try:
+            cur = db.execute(
+                "UPDATE tasks SET status = ?, result = ?, error = ?, lease_owner = NULL,"
+                " lease_expires = NULL, available_at = ?, updated_at = ?"
+                " WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                (status, json.dumps(result) if result is not None else None, error,
+                 now + RETRY_DELAY if status == 'pending' else 0, now, task['id'], owner)
+            )
+            if cur.rowcount == 0:
+                # The lease expired and the task went to another worker; its result wins.
+                db.execute("ROLLBACK")
+                logger.info(f"Dropping result of task {task['id']}: lease lost")
+                return False
+            for kind, dedupe_key, payload in children:
+                self._insert_task(task['job_id'], kind, dedupe_key, payload, now)
+            self._update_job(task['job_id'], now)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return True
+
+    def complete(self, task, owner, result, children=()):
+        """Mark `task` done and queue its follow-up (kind, dedupe_key, payload) tasks."""
+        return self._finish(task, owner, "done", result=result, children=children)
+
+    def fail(self, task, owner, error):
+        """Retry `task` after RETRY_DELAY, or fail it for good after MAX_TASK_ATTEMPTS."""
+        status = "failed" if task['attempts'] >= MAX_TASK_ATTEMPTS else "pending"
+        return self._finish(task, owner, status, error=error)
+
+    def job_status(self, job_id):
+        """{'job': row, 'tasks': {kind: {state: count}}} or None for an unknown job."""
+        job = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if job is None:
+            return None
+        counts = {}
+        for row in self.db.execute(
+            "SELECT kind, status, COUNT(*) AS n FROM tasks WHERE job_id = ? GROUP BY kind, status",
+            (job_id,)
+        ):
+            counts.setdefault(row['kind'], dict.fromkeys(TASK_STATES, 0))[row['status']] = row['n']
+        return {'job': dict(job), 'tasks': counts}
+
+    def has_open_tasks(self):
+        return self.db.execute(
+            "SELECT 1 FROM tasks WHERE status IN ('pending', 'leased') LIMIT 1"
+        ).fetchone() is not None
+
+    def iter_results(self, job_id):
+        for row in self.db.execute("SELECT * FROM tasks WHERE job_id = ? ORDER BY id", (job_id,)):
+            yield {
+                'task': row['id'], 'kind': row['kind'], 'status': row['status'],
+                'attempts': row['attempts'], 'payload': json.loads(row['payload']),
+                'result': json.loads(row['result']) if row['result'] else None,
+                'error': row['error'],
+            }
+
+# ------------------------------------------------------------------------------
+# Worker side
+
+def confined_dir(root, requested):
+    """
+    `requested` resolved inside `root` (relative paths are taken from
+    `root`); raises ValueError when it points anywhere else.
+    """
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, requested or ""))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"Download folder {requested!r} is outside {root}")
+    return path
+
+async def run_task(mgr, task, opts, download_root=None):
+    """
+    Execute one claimed task with the job's options `opts`; returns
+    (result, children), children being (kind, dedupe_key, payload) tuples.
+    With `download_root`, the job's download folder must lie inside it.
+    """
+    payload = task['payload']
+    if task['kind'] == "search":
+        # Result pages that need the browser get their own contexts, so
+        # several search tasks can run at once on this manager.
+        results = await mgr.fetch_search_results(payload['query'], opts.get('num_results', 5))
+        return {'results': results}, [("analyze", url, {'url': url}) for url in results]
+
+    if task['kind'] == "analyze":
+        exts = opts.get('exts', [])
+        files = [f async for f in mgr.iter_analyze_url(payload['url'], exts, isolated=True)]
+        children = []
+        if not opts.get('analyze_only'):
+            # The HEAD made during analysis travels with the task, so whichever
+            # worker downloads the file does not probe it again.
+            children = [("download", f['id'], {'file': f, 'probe': mgr.probe_cache.peek(f['url'])})
+                        for f in files]
+        return {'files': files}, children
+
+    if task['kind'] == "download":
+        fi = payload['file']
+        if payload.get('probe') and mgr.probe_cache.peek(fi['url']) is None:
+            mgr.probe_cache.put(fi['url'], payload['probe'])
+        if download_root is None:
+            directory = opts.get('download_dir', './downloads_jobs')
+        else:
+            directory = confined_dir(download_root, opts.get('download_dir'))
+        started = time.monotonic()
+        path = await mgr.download_one(fi, directory, fi['source'])
+        if path is None:
+            raise IOError(f"Download failed: {fi['url']}")
+        return {'path': path, 'bytes': os.path.getsize(path),
+                'duration_ms': round((time.monotonic() - started) * 1000)}, []
+
+    raise ValueError(f"Unknown task kind {task['kind']!r}")
+
+async def work(queue_path, owner, concurrency=DEFAULT_WORKER_CONCURRENCY, manager_options=None,
+               exit_when_idle=False):
+    """
+    Claim and run tasks, up to `concurrency` at a time, until cancelled
+    (or, with `exit_when_idle`, until the queue has no open tasks).
+    """
+    # The queue's connection lives on one thread of its own, so SQLite calls
+    # that wait on another process's lock never stall transfers on this loop.
+    db_thread = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    loop = asyncio.get_running_loop()
+
+    def call(fn, *args):
+        return loop.run_in_executor(db_thread, fn, *args)
+
+    queue = await call(JobQueue, queue_path)
+    active = {}   # asyncio task -> queue task
+
+    async def renew_leases():
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            try:
+                await call(queue.renew, owner, [t['id'] for t in active.values()])
+            except Exception as e:
+                # Keep trying; a lease only lapses after LEASE_SECONDS.
+                logger.error(f"[{owner}] lease renewal failed: {e}")
+
+    async def execute(task):
+        try:
+            opts = await call(queue.job_options, task['job_id'])
+            result, children = await run_task(mgr, task, opts)
+        except Exception as e:
+            logger.error(f"[{owner}] task {task['id']} ({task['kind']}) failed: {e}")
+            try:
+                await call(queue.fail, task, owner, str(e))
+            except Exception as e:
+                logger.error(f"[{owner}] could not record failure of task {task['id']}: {e}")
+        else:
+            try:
+                await call(queue.complete, task, owner, result, children)
+            except Exception as e:
+                # The lease runs out and the task is handed out again.
+                logger.error(f"[{owner}] could not record result of task {task['id']}: {e}")
+
+    async def claim(limit):
+        try:
+            return await call(queue.claim, owner, limit)
+        except Exception as e:
+            logger.error(f"[{owner}] could not claim tasks: {e}")
+            return []
+
+    mgr = DownloadManager(**(manager_options or {}))
+    renewer = asyncio.ensure_future(renew_leases())
+    try:
+        async with mgr:
+            await mgr.prepare_transfers()
+            while True:
+                free = concurrency - len(active)
+                claimed = await claim(free) if free > 0 else []
+                for task in claimed:
+                    active[asyncio.ensure_future(execute(task))] = task
+                if not active:
+                    if exit_when_idle and not await call(queue.has_open_tasks):
+                        break
+                    await asyncio.sleep(WORKER_POLL_INTERVAL)
+                    continue
+                done, _ = await asyncio.wait(list(active), timeout=WORKER_POLL_INTERVAL,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for fut in done:
+                    active.pop(fut, None)
+    finally:
+        renewer.cancel()
+        for fut in active:
+            fut.cancel()
+        await asyncio.gather(renewer, *active, return_exceptions=True)
+        await get_browser_pool().close()
+        await call(queue.close)
+        db_thread.shutdown()
+
+def worker_main(queue_path, index, concurrency, manager_options, exit_when_idle,
+                metrics_port=None):
+    """
+    Process entry point: one event loop and one DownloadManager per worker.
+    With `metrics_port`, the worker serves its metrics on metrics_port + index.
+    """
+    owner = f"{socket.gethostname()}:{os.getpid()}:{index}"
+    logger.info(f"Worker {owner} started")
+    if metrics_port:
+        start_metrics_server(metrics_port + index)
+    try:
+        asyncio.run(work(queue_path, owner, concurrency, manager_options, exit_when_idle))
+    except KeyboardInterrupt:
+        pass
+    logger.info(f"Worker {owner} stopped")
+
+def start_workers(queue_path, count, concurrency=DEFAULT_WORKER_CONCURRENCY,
+                  manager_options=None, exit_when_idle=False, metrics_port=None):
+    """Start `count` worker processes; returns them (already started)."""
+    ctx = multiprocessing.get_context("spawn")
+    procs = []
+    for i in range(count):
+        p = ctx.Process(target=worker_main,
+                        args=(queue_path, i, concurrency, manager_options or {}, exit_when_idle,
+                              metrics_port),
+                        daemon=False)
+        p.start()
+        procs.append(p)
+    return procs
+
+# ------------------------------------------------------------------------------
+# Command line
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Durable download job queue.")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_PATH,
+                        help=f"queue database (default {DEFAULT_QUEUE_PATH})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("submit", help="queue a job from a file of URLs/queries ('-' for stdin)")
+    p.add_argument("input", nargs="?", default="-")
+    p.add_argument("--mode", choices=("auto", "url", "query"), default="auto")
+    p.add_argument("-d", "--download-dir", default="./downloads_jobs")
+    p.add_argument("--ext", default="", help="extra file extensions, comma-separated")
+    p.add_argument("--num-results", type=int, default=5)
+    p.add_argument("--analyze-only", action="store_true")
+
+    p = sub.add_parser("work", help="run worker processes until interrupted")
+    p.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    p.add_argument("--concurrency", type=int, default=DEFAULT_WORKER_CONCURRENCY,
+                   help="tasks each worker runs at once")
+    p.add_argument("--exit-when-idle", action="store_true",
+                   help="stop once no task is pending or leased")
+    p.add_argument("--fetch-mode", choices=FETCH_MODES, default="auto")
+    p.add_argument("--profile", choices=list(BEHAVIOR_PROFILES), default=DEFAULT_PROFILE)
+    p.add_argument("--proxy", default=None)
+    p.add_argument("--store-dir", default="",
+                   help=f"content-addressed download store, e.g. {DEFAULT_STORE_DIR} (off by default)")
+    p.add_argument("--metrics-port", type=int, default=None,
+                   help="serve Prometheus metrics, worker i on this port + i")
+
+    p = sub.add_parser("status", help="task counts of a job")
+    p.add_argument("job", type=int)
+
+    p = sub.add_parser("results", help="every task of a job as JSON lines")
+    p.add_argument("job", type=int)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == "work":
+        options = {
+            'use_proxy': bool(args.proxy), 'proxy': args.proxy, 'fetch_mode': args.fetch_mode,
+            'profile': args.profile, 'store_dir': args.store_dir or None,
+        }
+        JobQueue(args.queue).close()  # create the schema before the workers race to
+        procs = start_workers(args.queue, args.workers, args.concurrency, options,
+                              args.exit_when_idle, args.metrics_port)
+        try:
+            for p in procs:
+                p.join()
+        except KeyboardInterrupt:
+            for p in procs:
+                p.join()
+        return 0
+
+    queue = JobQueue(args.queue)
+    try:
+        if args.command == "submit":
+            jobs = load_jobs(args.input, args.mode)
+            if jobs is None:
+                return 2
+            job_id = queue.submit(jobs, {
+                'download_dir': os.path.abspath(args.download_dir),
+                'exts': [x.strip() for x in args.ext.split(",") if x.strip()],
+                'num_results': args.num_results,
+                'analyze_only': args.analyze_only,
+            })
+            print(job_id)
+        elif args.command == "status":
+            status = queue.job_status(args.job)
+            if status is None:
+                print(f"No job {args.job}", file=sys.stderr)
+                return 1
+            print(json.dumps(status, indent=2))
+        elif args.command == "results":
+            for record in queue.iter_results(args.job):
+                print(json.dumps(record, ensure_ascii=False))
+    finally:
+        queue.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
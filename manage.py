@@ -140,7 +140,9 @@ playwright>=1.40.0
 beautifulsoup4>=4.12.0
 PyPDF2>=3.0.0
 asyncio>=3.4.3
-urllib3>=2.0.0""")
+urllib3>=2.0.0
+aiohttp>=3.8.0
+lxml>=4.9.0""")
     
     print("Installing requirements...")
     return run_command([pip, "install", "-r", "requirements.txt"])
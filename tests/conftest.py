@@ -0,0 +1,12 @@
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+@pytest.fixture
+def fixture_path():
+    """Path of a file under tests/fixtures."""
+    return lambda *parts: os.path.join(TESTS_DIR, "fixtures", *parts)
@@ -0,0 +1,35 @@
+import asyncio
+import io
+import json
+
+import pytest
+
+import batch_download
+from benchmark import SCALES, FixtureServer
+
+@pytest.fixture
+def fixture_server():
+    server = FixtureServer(dict(SCALES["quick"], small_files=3, small_size=4096)).start()
+    yield server
+    server.stop()
+
+def test_page_records(fixture_server, tmp_path):
+    base = fixture_server.base_url
+    pages = {
+        f"{base}/page/small_files": "ok",
+        f"{base}/page/small_files?again=1": "duplicate",
+        f"{base}/page/missing": "error",
+        f"{base}/articles/1": "empty",
+    }
+    args = batch_download.parse_args(["--analyze-only", "--fetch-mode", "http",
+                                      "--search-cache", "", "-d", str(tmp_path)])
+    stream = io.StringIO()
+    code = asyncio.run(batch_download.run(args, [("url", u) for u in pages],
+                                          batch_download.JsonlWriter(stream)))
+    assert code == 0
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    by_page = {r['page']: r for r in records if r['event'] == "page"}
+    assert {url: r['status'] for url, r in by_page.items()} == pages
+    assert all(isinstance(r['duration_ms'], int) for r in by_page.values())
+    assert by_page[f"{base}/page/missing"]['error'] == "HTTP 404"
+    assert by_page[f"{base}/page/small_files"]['files'] == 3
@@ -0,0 +1,90 @@
+import base64
+
+import pytest
+
+import advanced_search
+from advanced_search import parse_bing_results, unwrap_bing_link
+
+EXPECTED_RESULTS = [
+    "https://arxiv.org/abs/1706.03762",
+    "https://papers.nips.cc/paper_files/paper/2017/hash/3f5ee243547dee91fbd053c1c4a845aa-Abstract.html",
+    "https://papers.nips.cc/paper/7181-attention-is-all-you-need.pdf",
+    "https://github.com/tensorflow/tensor2tensor#readme",
+    "https://en.wikipedia.org/wiki/Attention_Is_All_You_Need",
+]
+
+def ck_link(target, host="www.bing.com"):
+    encoded = base64.urlsafe_b64encode(target.encode("utf-8")).decode("ascii").rstrip("=")
+    return f"https://{host}/ck/a?!&&p=0123abcd&ptn=3&ver=2&u=a1{encoded}&ntb=1"
+
+def read_fixture(fixture_path, name):
+    with open(fixture_path("bing", name), encoding="utf-8") as f:
+        return f.read()
+
+@pytest.fixture(params=["lxml", "bs4"])
+def parser(request, monkeypatch):
+    """Run a test with lxml, then again through the BeautifulSoup fallback."""
+    if request.param == "lxml":
+        if advanced_search.lxml_html is None:
+            pytest.skip("lxml is not installed")
+    else:
+        monkeypatch.setattr(advanced_search, "lxml_html", None)
+    return request.param
+
+def test_b_algo_results_in_page_order(parser, fixture_path):
+    # Ads, answers, pagination and related searches are not b_algo results,
+    # and only the first (title) link of each result counts.
+    assert parse_bing_results(read_fixture(fixture_path, "results.html")) == EXPECTED_RESULTS
+
+def test_no_results_page(parser, fixture_path):
+    assert parse_bing_results(read_fixture(fixture_path, "no_results.html")) == []
+
+def test_empty_and_blank_html(parser):
+    assert parse_bing_results("") == []
+    assert parse_bing_results("   \n") == []
+
+def test_multi_class_b_algo(parser):
+    html = ('<ol><li class="b_algo  b_vtl_deeplinks"><h2><a href="https://a.example/x">x</a></h2></li>'
+            '<li class="b_algox"><h2><a href="https://b.example/y">y</a></h2></li></ol>')
+    assert parse_bing_results(html) == ["https://a.example/x"]
+
+def test_result_without_h2_uses_first_link(parser):
+    html = ('<ol><li class="b_algo"><div class="b_title"><a href="https://a.example/x">x</a></div>'
+            '<a href="https://b.example/y">y</a></li></ol>')
+    assert parse_bing_results(html) == ["https://a.example/x"]
+
+def test_unwrap_ck_link():
+    target = "https://example.org/reports/annual report 2023.pdf?lang=en"
+    assert unwrap_bing_link(ck_link(target)) == target
+
+def test_unwrap_ck_link_without_padding():
+    # Bing strips the base64 padding; every residue length must decode.
+    for target in ("https://e.org/a", "https://e.org/ab", "https://e.org/abc"):
+        assert unwrap_bing_link(ck_link(target)) == target
+
+def test_unwrap_ck_link_on_bing_subdomain():
+    assert unwrap_bing_link(ck_link("https://e.org/x", host="cn.bing.com")) == "https://e.org/x"
+
+@pytest.mark.parametrize("href", [
+    "https://example.org/ck/a?u=a1aHR0cHM6Ly9lLm9yZy94",            # not bing.com
+    "https://www.bing.com/search?q=x&u=a1aHR0cHM6Ly9lLm9yZy94",     # not a /ck/ link
+    "https://www.bing.com/ck/a?!&&p=1&ntb=1",                        # no u= parameter
+    "https://www.bing.com/ck/a?!&&p=1&u=b2aHR0cHM6Ly9lLm9yZy94",     # unknown u= scheme
+    "https://www.bing.com/ck/a?!&&p=1&u=a1%%%%",                     # not base64
+    "https://www.bing.com/ck/a?!&&p=1&u=a1//79/g",                   # not UTF-8
+])
+def test_unwrap_leaves_other_links_alone(href):
+    assert unwrap_bing_link(href) == href
+
+def test_unwrap_rejects_non_http_target():
+    href = ck_link("javascript:alert(1)")
+    assert unwrap_bing_link(href) == href
+
+def test_parse_unwraps_ck_links_and_drops_relative(parser):
+    # A ck/a link that cannot be unwrapped is still a working redirect, so it stays.
+    ftp = ck_link("ftp://e.org/b.pdf")
+    html = ('<ol><li class="b_algo"><h2><a href="%s">a</a></h2></li>'
+            '<li class="b_algo"><h2><a href="%s">b</a></h2></li>'
+            '<li class="b_algo"><h2><a href="/relative/path">c</a></h2></li></ol>'
+            % (ck_link("https://e.org/a.pdf").replace("&", "&amp;"), ftp.replace("&", "&amp;")))
+    assert parse_bing_results(html) == ["https://e.org/a.pdf", ftp]
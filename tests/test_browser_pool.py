@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from advanced_search import BrowserPool
+
+class FakeContext:
+    async def new_page(self):
+        return object()
+
+    async def close(self):
+        pass
+
+class FakeBrowser:
+    def __init__(self):
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    async def new_context(self, user_agent=None):
+        return FakeContext()
+
+    async def close(self):
+        pass
+
+class FakePool(BrowserPool):
+    """BrowserPool launching FakeBrowsers instead of Chromium."""
+    async def _launch(self, proxy):
+        entry = {'proxy': proxy, 'browser': FakeBrowser(), 'uses': 0, 'active': 0,
+                 'last_used': time.monotonic()}
+        self._browsers.append(entry)
+        return entry
+
+def test_disconnected_browser_frees_its_slot():
+    async def scenario():
+        pool = FakePool(max_browsers=1)
+        first = await pool.acquire()
+        first.entry['browser'].connected = False
+        # The dead browser still has a lease, yet no longer blocks a new one.
+        second = await asyncio.wait_for(pool.acquire(), timeout=1)
+        stats = pool.stats()
+        await pool.close()
+        return first, second, stats
+
+    first, second, stats = asyncio.run(scenario())
+    assert second.entry is not first.entry
+    assert stats['browsers'] == 1 and stats['contexts'] == 2
+
+def test_pool_survives_a_new_event_loop():
+    pool = FakePool(max_browsers=1, max_contexts=1)
+
+    async def lease_twice():
+        first = await pool.acquire()
+        # The second acquire waits on the pool's condition until the first is back.
+        waiting = asyncio.ensure_future(pool.acquire())
+        await asyncio.sleep(0.01)
+        await first.release()
+        second = await asyncio.wait_for(waiting, timeout=1)
+        await second.release()
+        return pool.stats()
+
+    asyncio.run(lease_twice())
+    assert asyncio.run(lease_twice())['contexts'] == 0
@@ -0,0 +1,99 @@
+import asyncio
+import os
+
+import pytest
+from aiohttp import web
+
+import cluster
+import job_queue
+from benchmark import SCALES, FixtureServer
+
+TOKEN = "secret"
+FILES = 6
+MANAGER_OPTIONS = {'fetch_mode': "http", 'store_dir': None, 'search_cache_path': None}
+
+@pytest.fixture(autouse=True)
+def short_claims(monkeypatch):
+    # Idle workers give up after one empty long poll; keep that poll short.
+    monkeypatch.setattr(cluster, "CLAIM_WAIT", 1.0)
+
+@pytest.fixture
+def fixture_server():
+    scale = dict(SCALES["quick"], small_files=FILES, small_size=4096)
+    server = FixtureServer(scale).start()
+    yield server
+    server.stop()
+
+async def start_coordinator(queue_path):
+    runner = web.AppRunner(cluster.make_coordinator_app(queue_path, TOKEN))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+def worker(base, name, root):
+    return cluster.run_worker(base, name, TOKEN, concurrency=2, manager_options=MANAGER_OPTIONS,
+                              exit_when_idle=True, download_root=root)
+
+def read_results(queue_path, job_id):
+    queue = job_queue.JobQueue(queue_path)
+    try:
+        return queue.job_status(job_id), list(queue.iter_results(job_id))
+    finally:
+        queue.close()
+
+def test_two_workers_run_every_task_once(fixture_server, tmp_path):
+    queue_path = str(tmp_path / "queue.sqlite3")
+    root = str(tmp_path / "downloads")
+
+    async def scenario():
+        runner, base = await start_coordinator(queue_path)
+        try:
+            job_id = await cluster.submit_remote(
+                base, TOKEN, [("url", f"{fixture_server.base_url}/page/small_files")],
+                {'download_dir': "job", 'exts': [], 'num_results': 5, 'analyze_only': False})
+            await asyncio.wait_for(asyncio.gather(worker(base, "w1", root), worker(base, "w2", root)),
+                                   timeout=60)
+        finally:
+            await runner.cleanup()
+        return job_id
+
+    job_id = asyncio.run(scenario())
+    status, results = read_results(queue_path, job_id)
+    assert status['job']['status'] == "finished"
+    assert status['tasks']['analyze']['done'] == 1
+    assert status['tasks']['download']['done'] == FILES
+    assert all(r['status'] == "done" and r['attempts'] == 1 for r in results)
+    assert {r['result']['worker'] for r in results} == {"w1", "w2"}
+    assert len(os.listdir(os.path.join(root, "job"))) == FILES
+
+def test_expired_lease_is_claimed_again(fixture_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "LEASE_SECONDS", 0.5)
+    queue_path = str(tmp_path / "queue.sqlite3")
+    root = str(tmp_path / "downloads")
+
+    async def scenario():
+        runner, base = await start_coordinator(queue_path)
+        try:
+            job_id = await cluster.submit_remote(
+                base, TOKEN, [("url", f"{fixture_server.base_url}/page/small_files")],
+                {'analyze_only': True})
+            # A worker that claims the task, then dies without heartbeats.
+            dead = cluster.CoordinatorClient(base, "dead", TOKEN)
+            [task] = await dead.claim(1, wait=0)
+            await asyncio.sleep(1)
+            await asyncio.wait_for(worker(base, "w1", root), timeout=60)
+            # Its late result is refused: the task belongs to w1 now.
+            late = await dead.complete(task, {'files': []}, [])
+            await dead.close()
+        finally:
+            await runner.cleanup()
+        return job_id, late
+
+    job_id, late = asyncio.run(scenario())
+    assert late is False
+    status, [result] = read_results(queue_path, job_id)
+    assert status['job']['status'] == "finished"
+    assert result['status'] == "done" and result['attempts'] == 2
+    assert result['result']['worker'] == "w1"
+    assert len(result['result']['files']) == FILES
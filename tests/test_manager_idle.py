@@ -0,0 +1,44 @@
+import asyncio
+
+import advanced_search
+from advanced_search import DownloadManager
+
+def make_manager(tmp_path):
+    return DownloadManager(store_dir=str(tmp_path / "store"),
+                           search_cache_path=str(tmp_path / "cache.sqlite3"))
+
+def test_idle_manager_closes_and_reopens(tmp_path, monkeypatch):
+    monkeypatch.setattr(advanced_search, "MANAGER_IDLE_TIMEOUT", 0.05)
+
+    async def scenario():
+        mgr = make_manager(tmp_path)
+        async with mgr.in_use():
+            assert not mgr.http.closed
+            assert mgr.store is not None and mgr.search_cache is not None
+        await asyncio.sleep(0.2)
+        assert mgr.http.closed
+        assert mgr.store is None and mgr.search_cache is None
+
+        async with mgr.in_use():
+            assert not mgr.http.closed
+            assert mgr.store is not None
+        await mgr.close()
+
+    asyncio.run(scenario())
+
+def test_manager_in_use_is_not_closed(tmp_path, monkeypatch):
+    monkeypatch.setattr(advanced_search, "MANAGER_IDLE_TIMEOUT", 0.05)
+
+    async def scenario():
+        mgr = make_manager(tmp_path)
+        async with mgr.in_use():
+            async with mgr.in_use():
+                pass
+            # The inner block ending leaves the outer one holding the manager.
+            await asyncio.sleep(0.2)
+            assert not mgr.http.closed
+        await mgr.close()
+        # close() also drops the pending idle close.
+        assert mgr._idle_close is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+import advanced_search
+from advanced_search import (
+    HttpResponse,
+    PdfBudgetExceeded,
+    get_pdf_metadata,
+    read_pdf_metadata_ranged,
+)
+from benchmark import make_pdf, parse_range
+
+URL = "http://files.example/doc.pdf"
+
+HELLO = {'Title': 'Hello (world) é', 'Author': 'Ünïcode Author', 'Pages': 7}
+FIXTURES = {
+    "classic.pdf": HELLO,
+    "object_stream.pdf": HELLO,
+    "linearized.pdf": HELLO,
+    "incremental.pdf": {'Title': 'Updated (v2)', 'Author': 'AB', 'Pages': 7},
+}
+
+class RangePage:
+    """
+    Stands in for a Playwright page whose `request.get` hits a server
+    holding `data`. Range headers are honored unless `ranges` is False.
+    Every request's Range header (None for a plain GET) is recorded.
+    """
+    def __init__(self, data, ranges=True):
+        self.data = data
+        self.ranges = ranges
+        self.requests = []
+        self.request = self
+
+    async def get(self, url, headers=None, timeout=None):
+        range_value = (headers or {}).get('Range')
+        self.requests.append(range_value)
+        size = len(self.data)
+        if range_value is None or not self.ranges:
+            return HttpResponse(200, {'Content-Length': str(size)}, self.data)
+        start, end = parse_range(range_value, size)
+        return HttpResponse(206, {'Content-Range': f"bytes {start}-{end}/{size}"},
+                            self.data[start:end + 1])
+
+def load(fixture_path, name):
+    with open(fixture_path("pdf", name), "rb") as f:
+        return f.read()
+
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_ranged_metadata(name, fixture_path):
+    page = RangePage(load(fixture_path, name))
+    assert asyncio.run(read_pdf_metadata_ranged(URL, page)) == FIXTURES[name]
+    assert page.requests and all(r is not None for r in page.requests)
+
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_ranged_metadata_with_small_reads(name, fixture_path, monkeypatch):
+    # Tiny windows force separate requests for the xref data and each object.
+    monkeypatch.setattr(advanced_search, "PDF_TAIL_BYTES", 200)
+    monkeypatch.setattr(advanced_search, "PDF_MIN_FETCH", 64)
+    page = RangePage(load(fixture_path, name))
+    assert asyncio.run(read_pdf_metadata_ranged(URL, page)) == FIXTURES[name]
+    assert len(page.requests) > 1
+
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_ranged_matches_full_parse(name, fixture_path):
+    data = load(fixture_path, name)
+    ranged = asyncio.run(read_pdf_metadata_ranged(URL, RangePage(data)))
+    assert ranged == advanced_search._pdf_metadata_from_bytes(data)
+
+def test_large_pdf_reads_only_a_few_ranges():
+    data = make_pdf(4 * 1024 * 1024, "Big file")
+    page = RangePage(data)
+    meta = asyncio.run(get_pdf_metadata(URL, page))
+    assert meta == {'Title': 'Big file', 'Author': 'benchmark', 'Pages': 1}
+    assert None not in page.requests
+    assert len(page.requests) <= 4
+
+def test_server_ignoring_ranges_is_read_once(fixture_path):
+    page = RangePage(load(fixture_path, "classic.pdf"), ranges=False)
+    assert asyncio.run(get_pdf_metadata(URL, page)) == HELLO
+    assert len(page.requests) == 1
+
+def test_budget_exceeded():
+    page = RangePage(make_pdf(1024 * 1024, "Big file"))
+    with pytest.raises(PdfBudgetExceeded):
+        asyncio.run(read_pdf_metadata_ranged(URL, page, budget=1024))
+    assert None not in page.requests
+
+def test_structure_error_falls_back_to_full_download(fixture_path, monkeypatch):
+    async def unreadable(url, page, budget=None):
+        raise ValueError("Malformed xref subsection header")
+    monkeypatch.setattr(advanced_search, "read_pdf_metadata_ranged", unreadable)
+    page = RangePage(load(fixture_path, "classic.pdf"))
+    assert asyncio.run(get_pdf_metadata(URL, page)) == HELLO
+    assert page.requests == [None]
+
+@pytest.mark.parametrize("error", [asyncio.TimeoutError(), ConnectionResetError(),
+                                   PdfBudgetExceeded(URL)])
+def test_request_failure_does_not_download(error, fixture_path, monkeypatch):
+    async def failing(url, page, budget=None):
+        raise error
+    monkeypatch.setattr(advanced_search, "read_pdf_metadata_ranged", failing)
+    page = RangePage(load(fixture_path, "classic.pdf"))
+    assert asyncio.run(get_pdf_metadata(URL, page)) == {}
+    assert page.requests == []
@@ -0,0 +1,53 @@
+import asyncio
+
+from advanced_search import TransferScheduler
+
+def test_extra_segment_slots_respect_global_cap():
+    async def scenario():
+        scheduler = TransferScheduler(max_concurrent=3, per_host=4)
+        taken = {}
+
+        async def transfer(item):
+            if item['url'].endswith("big"):
+                await asyncio.sleep(0.05)   # let the other host's transfer start
+                async with scheduler.extra_host_slots(item['url'], 3) as extra:
+                    taken['extra'] = extra
+                    taken['global_free'] = scheduler._global._value
+            else:
+                await asyncio.sleep(0.2)
+            return item['url']
+
+        items = [{'url': "http://a.example/big"}, {'url': "http://b.example/small"}]
+        done = [url async for _, url in scheduler.run(items, transfer)]
+        return scheduler, taken, done
+
+    scheduler, taken, done = asyncio.run(scenario())
+    assert len(done) == 2
+    # Two transfers hold two of the three global slots: one extra segment fits.
+    assert taken == {'extra': 1, 'global_free': 0}
+    assert scheduler._global._value == 3
+    assert all(sem._value == 4 for sem in scheduler._hosts.values())
+
+def test_closing_run_early_waits_for_transfers():
+    async def scenario():
+        scheduler = TransferScheduler(max_concurrent=4, per_host=4)
+        running = set()
+
+        async def transfer(item):
+            running.add(item['url'])
+            try:
+                await asyncio.sleep(0 if item['url'].endswith("0") else 10)
+            finally:
+                await asyncio.sleep(0.01)   # cleanup that must finish before run() returns
+                running.discard(item['url'])
+            return item['url']
+
+        items = [{'url': f"http://h{i}.example/{i}"} for i in range(4)]
+        gen = scheduler.run(items, transfer)
+        await gen.__anext__()
+        await gen.aclose()
+        return running, scheduler
+
+    running, scheduler = asyncio.run(scenario())
+    assert running == set()
+    assert scheduler._global._value == 4
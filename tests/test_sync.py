@@ -0,0 +1,49 @@
+import asyncio
+import os
+
+from aiohttp import web
+
+from advanced_search import DownloadManager
+
+def stored_objects(store_dir):
+    return sorted(name for _, _, names in os.walk(os.path.join(store_dir, "objects"))
+                  for name in names)
+
+def test_sync_without_validators_compares_content(tmp_path):
+    # The server sends neither ETag nor Last-Modified, so every sync downloads.
+    versions = {'a': 1, 'b': 1}
+
+    async def serve(request):
+        name = request.match_info['name']
+        return web.Response(body=f"{name} v{versions[name]}".encode() * 1000)
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get('/{name}.bin', serve)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        files = [{'url': f"http://127.0.0.1:{port}/{n}.bin", 'filename': f"{n}.bin"}
+                 for n in 'ab']
+        folder, store_dir = str(tmp_path / "out"), str(tmp_path / "store")
+        summaries = []
+        try:
+            for step in range(3):
+                if step == 2:
+                    versions['b'] = 2
+                async with DownloadManager(store_dir=store_dir, search_cache_path=None) as mgr:
+                    summary = await mgr.sync_files(files, folder, "http://example.com/")
+                summaries.append({k: len(v) for k, v in summary.items() if v})
+        finally:
+            await runner.cleanup()
+        return folder, store_dir, summaries
+
+    folder, store_dir, summaries = asyncio.run(scenario())
+    assert summaries == [{'new': 2}, {'unchanged': 2}, {'changed': 1, 'unchanged': 1}]
+    assert sorted(os.listdir(folder)) == ['a.bin', 'b.bin']
+    with open(os.path.join(folder, 'b.bin')) as f:
+        assert f.read(4) == "b v2"
+    # The replaced version of b.bin was dropped from the store.
+    assert len(stored_objects(store_dir)) == 2